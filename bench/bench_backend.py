@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+Compare `job list` latency through the kubectl subprocess backend and the
+pooled in-process API backend, against a local fake API server.
+
+    python bench/bench_backend.py --jobs 50 --replicas 4 --iterations 20
+'''
+
+import argparse
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kube2.backend import APIBackend, KubectlBackend, set_backend  # noqa: E402
+from kube2.utils import get_jobs  # noqa: E402
+
+
+def make_pods(n_jobs: int, replicas: int) -> dict:
+    items = []
+    for j in range(n_jobs):
+        for r in range(replicas):
+            items.append({
+                'metadata': {
+                    'name': f'job{j}-{r}',
+                    'labels': {'app': f'job{j}'},
+                    'creationTimestamp': '2021-06-01T00:00:00Z',
+                },
+                'spec': {'volumes': [{'name': 'data', 'persistentVolumeClaim': {'claimName': 'pvc-data'}}]},
+                'status': {'phase': 'Running', 'containerStatuses': [{'restartCount': 0, 'state': {'running': {}}}]},
+            })
+    return {'kind': 'PodList', 'items': items}
+
+
+def serve(body: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fake_kubectl(tmpdir: str, fixture_fn: str):
+    fn = os.path.join(tmpdir, 'kubectl')
+    with open(fn, 'w') as f:
+        f.write(f'#!/bin/sh\ncat {fixture_fn}\n')
+    os.chmod(fn, os.stat(fn).st_mode | stat.S_IEXEC)
+    os.environ['PATH'] = tmpdir + os.pathsep + os.environ['PATH']
+
+
+def bench(backend, iterations: int) -> float:
+    set_backend(backend)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        get_jobs()
+    return (time.perf_counter() - t0) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    body = json.dumps(make_pods(args.jobs, args.replicas)).encode()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fixture_fn = os.path.join(tmpdir, 'pods.json')
+        with open(fixture_fn, 'wb') as f:
+            f.write(body)
+        fake_kubectl(tmpdir, fixture_fn)
+        server = serve(body)
+        api = APIBackend(f'http://127.0.0.1:{server.server_address[1]}')
+
+        sub_t = bench(KubectlBackend(), args.iterations)
+        api_t = bench(api, args.iterations)
+        server.shutdown()
+
+    print(f'kubectl subprocess: {sub_t * 1000:8.2f} ms/list')
+    print(f'pooled API client:  {api_t * 1000:8.2f} ms/list  ({sub_t / api_t:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+'''
+Micro-benchmark for the pre-flight capacity simulator on a synthetic
+inventory of GPU nodes, half full of single-GPU pods, plus a few scenarios
+whose verdicts are checked: how many replicas fit and what limits them.
+Exits non-zero if a scenario's verdict is wrong.
+
+    python bench/bench_capacity.py --nodes 500 --pods 20000 --iterations 20
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kube2.capacity import JobShape, Snapshot, get_job_shape, parse_quantity, simulate  # noqa: E402
+from kube2.manifest import render_manifests  # noqa: E402
+
+ZONE = 'us-east-1d'
+
+
+def make_node(i: int, *, gpus: int = 8, zone: str = ZONE) -> dict:
+    return {
+        'metadata': {'name': f'node-{i}', 'labels': {'topology.kubernetes.io/zone': zone}},
+        'spec': {},
+        'status': {
+            'allocatable': {
+                'cpu': '95690m',
+                'memory': '1130Gi',
+                'hugepages-2Mi': '10Gi',
+                'nvidia.com/gpu': str(gpus),
+                'vpc.amazonaws.com/efa': '4',
+            },
+            'conditions': [{'type': 'Ready', 'status': 'True'}],
+        },
+    }
+
+
+def make_pod(i: int, node, *, gpus: int = 1, cpu: str = '4', memory: str = '32Gi') -> dict:
+    return {
+        'metadata': {'name': f'pod-{i}'},
+        'spec': {
+            'nodeName': node,
+            'containers': [{
+                'name': 'main',
+                'resources': {'requests': {'cpu': cpu, 'memory': memory}, 'limits': {'nvidia.com/gpu': str(gpus)}},
+            }],
+        },
+        'status': {'phase': 'Running' if node else 'Pending'},
+    }
+
+
+def make_inventory(n_nodes: int, n_pods: int, seed: int = 0) -> Snapshot:
+    rng = random.Random(seed)
+    nodes = [make_node(i) for i in range(n_nodes)]
+    pods = [make_pod(i, f'node-{rng.randrange(n_nodes)}', gpus=0, cpu='100m', memory='128Mi') for i in range(n_pods)]
+    # half of each node's GPUs taken
+    for i in range(n_nodes):
+        pods += [make_pod(n_pods + 4 * i + j, f'node-{i}') for j in range(4)]
+    return Snapshot(nodes=nodes, pods=pods)
+
+
+def get_statefulset_shape(replicas: int) -> JobShape:
+    docs = render_manifests(
+        fn='templates/statefulset.yml',
+        args={
+            'name': 'bench',
+            'docker_image': 'leogao2/gpt-neox:main',
+            'image_pull_policy': 'Always',
+            'nodes': replicas,
+            'secret_name': 'bench-secret',
+            'anti_affinity': True,
+            'topology_spread': False,
+            'zone': ZONE,
+            'mounts': [],
+        }
+    )
+    return get_job_shape(docs)
+
+
+def timeit(fn, iterations: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / iterations * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=500)
+    parser.add_argument('--pods', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    snapshot = make_inventory(args.nodes, args.pods)
+    # half a node per replica, packed two to a node where they fit
+    shape = JobShape(
+        replicas=args.nodes,
+        requests={k: parse_quantity(v) for k, v in {'cpu': '40', 'memory': '400Gi', 'nvidia.com/gpu': '4'}.items()},
+    )
+    ms = timeit(lambda: simulate(snapshot, shape), args.iterations)
+    print(f'simulate, {args.nodes} nodes, {len(snapshot.pods)} pods: {ms:.1f} ms')
+    print(f'    {simulate(snapshot, shape).summary()}')
+
+    gpu_shape = JobShape(replicas=4, requests={'nvidia.com/gpu': 8000})
+    scenarios = [
+        (
+            'empty nodes, exclusive',
+            Snapshot(nodes=[make_node(i) for i in range(4)], pods=[]),
+            get_statefulset_shape(4),
+            (4, None),
+        ),
+        (
+            'one node cordoned',
+            Snapshot(nodes=[make_node(i) for i in range(3)] + [dict(make_node(3), spec={'unschedulable': True})], pods=[]),
+            get_statefulset_shape(4),
+            (3, 'eligible nodes'),
+        ),
+        (
+            'one node in another zone',
+            Snapshot(nodes=[make_node(i) for i in range(3)] + [make_node(3, zone='us-east-1a')], pods=[]),
+            get_statefulset_shape(4),
+            (3, 'eligible nodes'),
+        ),
+        (
+            'free GPUs scattered across nodes',
+            Snapshot(
+                nodes=[make_node(i) for i in range(8)],
+                pods=[make_pod(i, f'node-{i}', gpus=4) for i in range(8)],
+            ),
+            gpu_shape,
+            (0, 'nvidia.com/gpu'),
+        ),
+        (
+            'GPUs and EFA free on different nodes',
+            Snapshot(
+                nodes=[make_node(i) for i in range(8)],
+                pods=[make_pod(i, f'node-{i}', gpus=8 if i < 4 else 0) for i in range(8)]
+                + [dict(make_pod(8 + i, f'node-{i}', gpus=0), spec={
+                    'nodeName': f'node-{i}',
+                    'containers': [{'name': 'main', 'resources': {'requests': {'vpc.amazonaws.com/efa': '4'}}}],
+                }) for i in range(4, 8)],
+            ),
+            JobShape(replicas=4, requests={'nvidia.com/gpu': 8000, 'vpc.amazonaws.com/efa': 4000}),
+            (0, 'fragmentation'),
+        ),
+    ]
+    failed = 0
+    for label, snap, job_shape, expected in scenarios:
+        report = simulate(snap, job_shape)
+        ok = (report.fits, report.limiting) == expected
+        failed += not ok
+        print(f'{label:40s} {"ok" if ok else f"FAILED: expected {expected}"}  {report.summary()}')
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''
+Benchmark cluster discovery against a stubbed EKS client with injected latency.
+
+    python bench/bench_clusters.py --clusters 50 --latency 0.05
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kube2.aws_utils import describe_clusters, list_cluster_names  # noqa: E402
+
+
+class FakePaginator(object):
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self):
+        names = [f'cluster-{i}' for i in range(self.client.n_clusters)]
+        for i in range(0, len(names), self.client.page_size):
+            self.client.sleep()
+            yield {'clusters': names[i:i + self.client.page_size]}
+
+
+class FakeEKS(object):
+    def __init__(self, n_clusters: int, latency: float, page_size: int = 100):
+        self.n_clusters = n_clusters
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def sleep(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def get_paginator(self, name):
+        assert name == 'list_clusters'
+        return FakePaginator(self)
+
+    def describe_cluster(self, name):
+        self.sleep()
+        return {'cluster': {'createdAt': datetime(2021, 1, 1), 'status': 'ACTIVE'}}
+
+
+def run(n_clusters: int, latency: float, max_workers: int):
+    client = FakeEKS(n_clusters, latency)
+    t0 = time.perf_counter()
+    names = list_cluster_names(client)
+    clusters = describe_clusters(client, names, max_workers=max_workers)
+    elapsed = time.perf_counter() - t0
+    assert [c.name for c in clusters] == names
+    return elapsed, client.calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clusters', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    baseline = None
+    for w in args.workers:
+        elapsed, calls = run(args.clusters, args.latency, w)
+        baseline = baseline or elapsed
+        print(f'workers={w:<3d} calls={calls:<4d} {elapsed:7.3f}s  speedup={baseline / elapsed:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
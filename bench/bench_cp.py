@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+'''
+Benchmark for `job cp`, with a fake exec transport whose "pods" are local
+directories (commands run with the local tar and find). Copies a tree to
+every replica with and without compression, then re-copies after touching a
+few files, after a replica's stream broke part way, and back down from every
+replica, checking the contents each time.
+
+    python bench/bench_cp.py --replicas 8 --files 200 --file-kb 512
+'''
+
+import argparse
+import filecmp
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kube2.remote import ExecResult, fan_out  # noqa: E402
+from kube2.sync import SyncProgress  # noqa: E402
+from kube2.transfer import download_from_pod, upload_to_pods  # noqa: E402
+
+
+class LocalExec(object):
+    '''
+    Runs "pod" commands locally, in a directory per pod. Optionally breaks
+    one pod's stdin after some bytes, like a dropped exec stream.
+    '''
+
+    def __init__(self, root: str, break_pod: str = None, break_after: int = 0):
+        self.root = root
+        self.break_pod = break_pod
+        self.break_after = break_after
+
+    def cwd(self, pod: str) -> str:
+        path = os.path.join(self.root, pod)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def run(self, pod, command, input=None, timeout=None) -> ExecResult:
+        proc = subprocess.run(command, input=input, capture_output=True, cwd=self.cwd(pod), timeout=timeout)
+        return ExecResult(pod, proc.returncode, proc.stdout, proc.stderr)
+
+    def popen(self, pod, command, stdin=False):
+        proc = subprocess.Popen(
+            command,
+            cwd=self.cwd(pod),
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if pod == self.break_pod:
+            proc.stdin = BreakingWriter(proc, self.break_after)
+        return proc
+
+
+class BreakingWriter(object):
+    def __init__(self, proc, limit: int):
+        self.proc = proc
+        self.f = proc.stdin
+        self.left = limit
+
+    def write(self, data: bytes):
+        if self.left < len(data):
+            self.proc.kill()
+            raise BrokenPipeError('stream dropped')
+        self.left -= len(data)
+        return self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+
+def make_tree(root: str, n_files: int, file_kb: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(n_files):
+        fn = os.path.join(root, f'd{i % 10}', f'file-{i}.bin')
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        # half random, half zeros, so compression has something to do
+        size = file_kb * 1024
+        with open(fn, 'wb') as f:
+            f.write(rng.randbytes(size // 2) + bytes(size - size // 2))
+
+
+def check_same(a: str, b: str):
+    cmp = filecmp.dircmp(a, b)
+    stack = [cmp]
+    while len(stack) > 0:
+        c = stack.pop()
+        assert not c.left_only and not c.right_only, (c.left, c.left_only, c.right_only)
+        _, mismatch, errors = filecmp.cmpfiles(c.left, c.right, c.common_files, shallow=False)
+        assert not mismatch and not errors, (mismatch, errors)
+        stack += list(c.subdirs.values())
+
+
+def report(label: str, progress: SyncProgress, elapsed: float):
+    print(f'{label:38s} {elapsed:6.2f}s  {progress.summary()}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicas', type=int, default=8)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--file-kb', type=int, default=512)
+    args = parser.parse_args()
+
+    pods = [f'bench-{i}' for i in range(args.replicas)]
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'src')
+        make_tree(src, args.files, args.file_kb)
+        quiet = open(os.devnull, 'w')
+
+        for compress in (False, True):
+            root = os.path.join(tmp, f'pods-{compress}')
+            t0 = time.perf_counter()
+            progress, errors = upload_to_pods(src, 'data', pods, compress=compress, transport=LocalExec(root), out=quiet)
+            report(f'upload to {args.replicas}' + (', compressed' if compress else ''), progress, time.perf_counter() - t0)
+            assert not errors, errors
+            for pod in pods:
+                check_same(src, os.path.join(root, pod, 'data'))
+
+        transport = LocalExec(root)
+        t0 = time.perf_counter()
+        progress, errors = upload_to_pods(src, 'data', pods, transport=transport, out=quiet)
+        report('upload again, nothing changed', progress, time.perf_counter() - t0)
+        assert progress.transferred == 0 and not errors
+
+        for i in range(5):
+            with open(os.path.join(src, 'd0', f'file-{i * 10}.bin'), 'ab') as f:
+                f.write(b'changed')
+        t0 = time.perf_counter()
+        progress, errors = upload_to_pods(src, 'data', pods, transport=transport, out=quiet)
+        report('upload again, 5 files changed', progress, time.perf_counter() - t0)
+        assert progress.transferred == 5 * args.replicas and not errors
+
+        fresh = os.path.join(tmp, 'pods-resume')
+        broken = LocalExec(fresh, break_pod=pods[-1], break_after=args.files * args.file_kb * 1024 // 2)
+        progress, errors = upload_to_pods(src, 'data', pods, transport=broken, out=quiet)
+        assert list(errors) == [pods[-1]], errors
+        t0 = time.perf_counter()
+        progress, errors = upload_to_pods(src, 'data', pods, transport=LocalExec(fresh), out=quiet)
+        report('resume after a dropped stream', progress, time.perf_counter() - t0)
+        assert not errors and 0 < progress.transferred < args.files, progress.summary()
+        check_same(src, os.path.join(fresh, pods[-1], 'data'))
+
+        for compress in (False, True):
+            dest = os.path.join(tmp, f'down-{compress}')
+            progress = SyncProgress(quiet)
+            t0 = time.perf_counter()
+            fan_out(lambda pod: download_from_pod(
+                pod, 'data', os.path.join(dest, pod), compress=compress, transport=transport, progress=progress,
+            ), pods)
+            report(f'download from {args.replicas}' + (', compressed' if compress else ''), progress, time.perf_counter() - t0)
+            for pod in pods:
+                check_same(src, os.path.join(dest, pod))
+
+        progress = SyncProgress(quiet)
+        for pod in pods:
+            download_from_pod(pod, 'data', os.path.join(dest, pod), transport=transport, progress=progress)
+        assert progress.transferred == 0, progress.summary()
+        print('download again: nothing transferred')
+
+
+if __name__ == '__main__':
+    main()
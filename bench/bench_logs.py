@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+'''
+Stress benchmark for `job logs` multiplexing, with fake log sources that
+write as fast as a pipe takes them. Reports merged throughput with and
+without a filter, and the peak bytes held in flight (read from the sources
+but not yet written) when merging into a slow consumer. That grows with the
+buffer size, and stays within the bound the per-stream buffers allow however
+long the streams are, which the benchmark checks along with every line
+arriving, in order within its stream.
+
+    python bench/bench_logs.py --replicas 32 --lines 20000
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kube2.logs import MAX_LINE_BYTES, READ_BYTES, make_line_filter, stream_logs  # noqa: E402
+
+
+class InFlight(object):
+    '''
+    Bytes read from the sources minus bytes written to the sink.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.peak = 0
+
+    def add(self, n: int):
+        with self.lock:
+            self.bytes += n
+            self.peak = max(self.peak, self.bytes)
+
+
+class CountingReader(object):
+    def __init__(self, f, in_flight: InFlight):
+        self.f = f
+        self.in_flight = in_flight
+
+    def read1(self, n: int) -> bytes:
+        data = self.f.read1(n)
+        self.in_flight.add(len(data))
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class FakeProc(object):
+    '''
+    A Popen stand-in whose stdout is a pipe fed by a thread.
+    '''
+
+    def __init__(self, pod: str, lines: int, noisy: bool, in_flight: InFlight):
+        r, w = os.pipe()
+        self.stdout = CountingReader(os.fdopen(r, 'rb'), in_flight)
+        self.stderr = open(os.devnull, 'rb')
+        # a noisy rank logs 10x as much, in long lines
+        n, pad = (lines * 10, 'x' * 200) if noisy else (lines, '')
+        self.thread = threading.Thread(target=self.feed, args=(os.fdopen(w, 'wb'), pod, n, pad), daemon=True)
+        self.thread.start()
+
+    def feed(self, f, pod: str, n: int, pad: str):
+        try:
+            for start in range(0, n, 256):
+                f.write(''.join(f'{pod} {i} loss {i % 97}{pad}\n' for i in range(start, min(n, start + 256))).encode())
+        except BrokenPipeError:
+            pass
+        finally:
+            f.close()
+
+    def wait(self) -> int:
+        self.thread.join()
+        return 0
+
+    def terminate(self):
+        self.stdout.close()
+
+
+class FakeLogs(object):
+    def __init__(self, lines: int, noisy_ranks: int = 0):
+        self.lines = lines
+        self.noisy_ranks = noisy_ranks
+        self.in_flight = InFlight()
+
+    def open(self, pod: str, *, follow: bool = False, since=None) -> FakeProc:
+        return FakeProc(pod, self.lines, int(pod.rsplit('-', 1)[1]) < self.noisy_ranks, self.in_flight)
+
+
+class CheckingSink(object):
+    '''
+    Counts lines per stream and checks they arrive in order. Each write can
+    sleep to stand in for a slow terminal.
+    '''
+
+    def __init__(self, in_flight: InFlight, delay: float = 0.0):
+        self.in_flight = in_flight
+        self.delay = delay
+        self.next = {}
+        self.lines = 0
+
+    def write(self, data: bytes):
+        written = 0
+        for line in data.decode().splitlines():
+            line = line.split('] ', 1)[1]
+            written += len(line) + 1
+            pod, i = line.split(' ')[:2]
+            expected = self.next.get(pod, 0)
+            assert int(i) >= expected, f'{pod}: line {i} after {expected - 1}'
+            self.next[pod] = int(i) + 1
+            self.lines += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+        self.in_flight.add(-written)
+
+    def flush(self):
+        pass
+
+
+def run(replicas: int, lines: int, *, grep=None, buffer_kb=1024, delay=0.0, noisy_ranks=0):
+    pods = [f'bench-{i}' for i in range(replicas)]
+    source = FakeLogs(lines, noisy_ranks)
+    sink = CheckingSink(source.in_flight, delay)
+    t0 = time.perf_counter()
+    results = stream_logs(
+        pods,
+        source=source,
+        match=make_line_filter(grep),
+        out=sink,
+        buffer_kb=buffer_kb,
+    )
+    elapsed = time.perf_counter() - t0
+    assert sum(r.lines for r in results) == sink.lines
+    return sink.lines, elapsed, source.in_flight.peak
+
+
+def in_flight_bound(replicas: int, buffer_kb: int) -> int:
+    # per stream: its buffered batches, the one its reader waits to queue,
+    # and the partial line held for the next read
+    slots = max(1, buffer_kb * 1024 // READ_BYTES)
+    return replicas * ((slots + 1) * (READ_BYTES + MAX_LINE_BYTES) + MAX_LINE_BYTES)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicas', type=int, default=32)
+    parser.add_argument('--lines', type=int, default=20000, help='lines per replica')
+    args = parser.parse_args()
+
+    n, elapsed, _ = run(args.replicas, args.lines)
+    print(f'merge all         {n:9d} lines in {elapsed:6.2f}s ({n / elapsed / 1e3:8.1f}k lines/s)')
+    assert n == args.replicas * args.lines, n
+    n, elapsed, _ = run(args.replicas, args.lines, grep=r'loss 0$')
+    total = args.replicas * args.lines
+    print(f'merge --grep      {n:9d} lines in {elapsed:6.2f}s ({total / elapsed / 1e3:8.1f}k lines/s filtered)')
+
+    # one rank logs 10x more than the rest, into a consumer that's slower
+    # than the sources: what's held is bounded by the buffer, not the log size
+    for lines in (args.lines // 5, args.lines):
+        for buffer_kb in (64, 256, 1024):
+            _, _, peak = run(args.replicas, lines, buffer_kb=buffer_kb, delay=0.002, noisy_ranks=1)
+            bound = in_flight_bound(args.replicas, buffer_kb)
+            print(
+                f'slow consumer, {lines:6d} lines/replica, buffer {buffer_kb:4d} KB: '
+                f'peak in flight {peak / 1e6:6.2f} MB (bound {bound / 1e6:6.2f} MB)'
+            )
+            assert peak <= bound, (peak, bound)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+'''
+Startup benchmark: wall time and `-X importtime` breakdown for loading each
+subcommand group, with a regression budget. Exits non-zero if a budget is
+exceeded or a heavy library is imported before a command needs it.
+
+    python bench/bench_startup.py [--runs 5]
+'''
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+GROUPS = ['cluster', 'job', 'volume']
+
+# milliseconds spent importing kube2 modules (excluding fire and the interpreter)
+IMPORT_BUDGET_MS = 60
+
+# libraries that must only be loaded by the commands that use them
+HEAVY_MODULES = ['boto3', 'botocore', 'jinja2', 'arrow', 'terminaltables', 'urllib3', 'yaml']
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def startup_code(group: str) -> str:
+    # what kube2.py does before Fire dispatches to a subcommand
+    return (
+        'import fire; import kube2.cache; '
+        f'from kube2.{group} import {group.capitalize()}CLI'
+    )
+
+
+def wall_time(group: str, runs: int) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', startup_code(group)], cwd=ROOT, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def import_times(group: str):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', startup_code(group)],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    # cumulative ms per module, and which modules were imported at top level
+    modules, top_level = {}, []
+    for line in proc.stderr.decode().splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m is not None:
+            modules[m.group(3)] = int(m.group(1)) / 1000
+            if m.group(2) == '':
+                top_level.append(m.group(3))
+    return modules, top_level
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    print(f'{"GROUP":10s}{"WALL":>10s}{"FIRE":>10s}{"KUBE2":>10s}  HEAVY')
+    for group in GROUPS:
+        wall = wall_time(group, args.runs) * 1000
+        modules, top_level = import_times(group)
+        kube2_ms = sum(modules[m] for m in top_level if m.startswith('kube2'))
+        heavy = [m for m in HEAVY_MODULES if m in modules]
+        print(f'{group:10s}{wall:8.1f}ms{modules.get("fire", 0):8.1f}ms{kube2_ms:8.1f}ms  {",".join(heavy) or "-"}')
+        if kube2_ms > IMPORT_BUDGET_MS or len(heavy) > 0:
+            failed = True
+    if failed:
+        print(f'FAIL: budget is {IMPORT_BUDGET_MS}ms of kube2 imports and no eager {",".join(HEAVY_MODULES)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Stubbed boto3 clients for the benchmark harness. `install()` replaces
+`kube2.aws_utils.aws_client` (through which kube2 creates every boto3
+client) with fakes that answer from the harness state file, sleep for
+$KUBE2_FAKE_API_LATENCY seconds per call, and count calls per operation.
+'''
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class FakeClient(object):
+    def __init__(self, service: str, state: dict, counts: dict, lock: threading.Lock):
+        self.service = service
+        self.state = state
+        self.counts = counts
+        self.lock = lock
+        self.latency = float(os.environ.get('KUBE2_FAKE_API_LATENCY', '0'))
+
+    def call(self, op: str, **kwargs) -> dict:
+        with self.lock:
+            key = f'{self.service}.{op}'
+            self.counts[key] = self.counts.get(key, 0) + 1
+        time.sleep(self.latency)
+        return getattr(self, 'op_' + op, lambda **kw: {})(**kwargs)
+
+    def __getattr__(self, op: str):
+        if op.startswith('op_') or op.startswith('_'):
+            raise AttributeError(op)
+        return lambda **kwargs: self.call(op, **kwargs)
+
+    def get_paginator(self, op: str):
+        client = self
+
+        class Paginator(object):
+            def paginate(self, **kwargs):
+                yield client.call(op, **kwargs)
+        return Paginator()
+
+    # eks
+
+    def op_list_clusters(self, **kwargs):
+        return {'clusters': self.state['clusters']}
+
+    def op_describe_cluster(self, name: str):
+        return {'cluster': {
+            'name': name,
+            'createdAt': datetime(2021, 6, 1, tzinfo=timezone.utc),
+            'status': 'ACTIVE',
+            'resourcesVpcConfig': {'vpcId': 'vpc-bench'},
+        }}
+
+    # ec2
+
+    def op_describe_security_groups(self, **kwargs):
+        return {'SecurityGroups': []}
+
+    def op_describe_subnets(self, **kwargs):
+        return {'Subnets': [
+            {'SubnetId': f'subnet-{i}', 'AvailabilityZone': az, 'MapPublicIpOnLaunch': False, 'AvailableIpAddressCount': 100}
+            for i, az in enumerate(['us-east-1a', 'us-east-1d'])
+        ]}
+
+    def op_create_security_group(self, **kwargs):
+        return {'GroupId': 'sg-bench'}
+
+
+def install(counts_fn: str):
+    import atexit
+    import kube2.aws_utils
+
+    with open(os.environ['KUBE2_FAKE_STATE']) as f:
+        state = json.load(f)
+    counts: dict = {}
+    lock = threading.Lock()
+    kube2.aws_utils.aws_client = lambda service, **kwargs: FakeClient(service, state, counts, lock)
+
+    def dump():
+        with open(counts_fn, 'w') as f:
+            json.dump(counts, f)
+    atexit.register(dump)
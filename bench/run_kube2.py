@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+'''
+Runs kube2.py with AWS clients replaced by the fakes in bench/fake_aws.py, writing
+per-operation API call counts to $KUBE2_FAKE_API_COUNTS on exit.
+'''
+
+import os
+import runpy
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_aws  # noqa: E402
+
+fake_aws.install(os.environ['KUBE2_FAKE_API_COUNTS'])
+sys.argv = [os.path.join(ROOT, 'kube2.py')] + sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
@@ -1,25 +1,110 @@
 #!/usr/bin/env python3
 
+import sys
+from typing import List, Optional, Tuple
+
 import fire
 
-from kube2.cluster import ClusterCLI
-from kube2.job import JobCLI
-from kube2.utils import assert_binary_on_path
-from kube2.volume import VolumeCLI
+from kube2.cache import configure_cache
+from kube2.trace import configure_tracing
 
 
 class CLI(object):
     '''
     A CLI for working with Kubernetes clusters on EKS.
+
+    Global flags (may appear anywhere on the command line):
+        --no-cache   bypass the on-disk metadata cache in ~/.cache/kube2
+        --debug      print cache hit/miss counters on exit
+        --trace FILE write a Chrome trace of every subprocess, API, AWS and
+                     template call to FILE (open it in ui.perfetto.dev)
+        --timings    print a table of time spent per call on exit
+
+    `job exec` also takes its command after `--`, as in
+    `kube2.py job exec --name X -- nvidia-smi -L`.
+    '''
+
+    # subcommand modules are imported on first access, so a command only
+    # pays for the libraries it actually uses
+
+    @property
+    def cluster(self):
+        from kube2.cluster import ClusterCLI
+        return ClusterCLI()
+
+    @property
+    def job(self):
+        from kube2.job import JobCLI
+        return JobCLI()
+
+    @property
+    def volume(self):
+        from kube2.volume import VolumeCLI
+        return VolumeCLI()
+
+
+def pop_flag(argv: List[str], flag: str) -> bool:
+    '''
+    Remove a boolean global flag from argv, returning whether it was present.
+    '''
+
+    found = flag in argv
+    while flag in argv:
+        argv.remove(flag)
+    return found
+
+
+def pop_option(argv: List[str], flag: str) -> Optional[str]:
+    '''
+    Remove a global `--flag VALUE` / `--flag=VALUE` option from argv,
+    returning its (last) value, or None if it wasn't given.
+    '''
+
+    value = None
+    i = 0
+    while i < len(argv):
+        if argv[i] == flag:
+            if i + 1 >= len(argv):
+                print(f'Error: {flag} requires a value')
+                sys.exit(1)
+            value = argv[i + 1]
+            del argv[i:i + 2]
+        elif argv[i].startswith(flag + '='):
+            value = argv[i][len(flag) + 1:]
+            del argv[i]
+        else:
+            i += 1
+    return value
+
+
+def split_remote_command(argv: List[str]) -> Tuple[List[str], Optional[List[str]]]:
+    '''
+    Split `... -- CMD ARGS` into kube2's own arguments and a command to run
+    remotely, so neither the global flags nor Fire see the command.
     '''
 
-    cluster = ClusterCLI()
-    job = JobCLI()
-    volume = VolumeCLI()
+    if '--' not in argv:
+        return argv, None
+    i = argv.index('--')
+    return argv[:i], argv[i + 1:]
 
 
 if __name__ == '__main__':
-    assert_binary_on_path('eksctl', 'You must install `eksctl` to use this tool.')
-    assert_binary_on_path('kubectl', 'You must install `kubectl` to use this tool.')
-    assert_binary_on_path('aws', 'You must install the AWS CLI tool to use this tool.')
-    fire.Fire(CLI)
+    argv, remote_command = split_remote_command(sys.argv[1:])
+    no_cache = pop_flag(argv, '--no-cache')
+    debug = pop_flag(argv, '--debug')
+    configure_cache(enabled=not no_cache, debug=debug)
+    trace_file = pop_option(argv, '--trace')
+    timings = pop_flag(argv, '--timings')
+    configure_tracing(trace_file=trace_file, timings=timings)
+    if remote_command is not None:
+        if [a for a in argv if not a.startswith('-')][:2] == ['job', 'exec']:
+            # joined with spaces like pdsh, so `-- 'cd /data && ls'` and
+            # `-- cd /data '&&' ls` both reach the remote shell as written;
+            # passed as a Python string literal, which Fire leaves unparsed
+            argv += ['--cmd', repr(' '.join(remote_command))]
+        else:
+            # Fire's own flags, e.g. `-- --help`
+            argv += ['--'] + remote_command
+    # required binaries (kubectl, eksctl, aws) are checked when first used
+    fire.Fire(CLI, command=argv)
@@ -1,46 +1,267 @@
-from typing import List, Optional
-import boto3
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
+from kube2.cache import (
+    CLUSTERS_TTL,
+    SECURITY_GROUP_TTL,
+    SUBNET_TTL,
+    VPC_TTL,
+    ZONES_TTL,
+    cache,
+)
+from kube2.trace import trace_aws_client, tracer
 from kube2.types import (
     Cluster,
 )
 
 
-def get_clusters() -> List[Cluster]:
-    EKS = boto3.client('eks')
-    response = EKS.list_clusters()
-    clusters: List[Cluster] = []
-    for cluster_name in response['clusters']:
-        response2 = EKS.describe_cluster(name=cluster_name)
-        created_at = response2['cluster']['createdAt']
-        status = response2['cluster']['status']
-        clusters.append(Cluster(
+# upper bound on concurrent `describe_cluster` calls (EKS throttles bursts)
+DEFAULT_DESCRIBE_CONCURRENCY = 8
+
+# region used when a command isn't given one and has no cluster to take it from
+DEFAULT_REGION = os.environ.get('KUBE2_REGION', 'us-east-1')
+
+
+class ZoneError(Exception):
+    pass
+
+
+def _scope() -> str:
+    '''
+    The AWS identity cached metadata belongs to, so switching `AWS_PROFILE`
+    or exported credentials never serves another account's clusters: the
+    profile name, plus a hash of the access key when one is exported.
+    '''
+
+    scope = os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+    key_id = os.environ.get('AWS_ACCESS_KEY_ID')
+    if key_id:
+        scope += '+' + hashlib.sha1(key_id.encode()).hexdigest()[:12]
+    return scope
+
+
+def aws_client(service: str, **kwargs):
+    # boto3 takes a noticeable fraction of a second to import, so only load
+    # it once a command actually talks to AWS
+    import boto3
+    client = boto3.client(service, **kwargs)
+    if tracer.enabled:
+        trace_aws_client(client)
+    return client
+
+
+def bounded_config(timeout: float):
+    '''
+    A botocore config that gives up on an unresponsive endpoint after about
+    `timeout` seconds instead of retrying for minutes.
+    '''
+
+    from botocore.config import Config
+    return Config(connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': 1})
+
+
+def list_cluster_names(eks_client) -> List[str]:
+    names: List[str] = []
+    paginator = eks_client.get_paginator('list_clusters')
+    for page in paginator.paginate():
+        names.extend(page['clusters'])
+    return names
+
+
+def describe_clusters(
+    eks_client,
+    cluster_names: List[str],
+    max_workers: int = DEFAULT_DESCRIBE_CONCURRENCY,
+    region: str = DEFAULT_REGION,
+) -> List[Cluster]:
+    '''
+    Describe the given clusters on a bounded thread pool. boto3 clients are
+    thread-safe, so a single client (and its connection pool) is shared by all
+    the workers. Results come back in the same order as `cluster_names`.
+    '''
+
+    def describe(cluster_name: str) -> Cluster:
+        response = eks_client.describe_cluster(name=cluster_name)
+        return Cluster(
             name=cluster_name,
-            created_at=created_at,
-            status=status,
-        ))
-    return clusters
+            created_at=response['cluster']['createdAt'],
+            status=response['cluster']['status'],
+            region=region,
+        )
+
+    if len(cluster_names) == 0:
+        return []
+    max_workers = max(1, min(max_workers, len(cluster_names)))
+    if max_workers == 1:
+        return [describe(n) for n in cluster_names]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(describe, cluster_names))
+
+
+def get_clusters(
+    max_workers: int = DEFAULT_DESCRIBE_CONCURRENCY,
+    *,
+    region: str = DEFAULT_REGION,
+    timeout: Optional[float] = None,
+) -> List[Cluster]:
+    '''
+    The clusters in `region` with their current status. With `timeout`, each
+    AWS call gives up after about that many seconds.
+    '''
+
+    kwargs = {'config': bounded_config(timeout)} if timeout is not None else {}
+    EKS = aws_client('eks', region_name=region, **kwargs)
+    names = list_cluster_names(EKS)
+    cache.set(f'clusters:{_scope()}:{region}', names, CLUSTERS_TTL)
+    return describe_clusters(EKS, names, max_workers=max_workers, region=region)
+
 
+def get_enabled_regions() -> List[str]:
+    ec2 = aws_client('ec2', region_name=DEFAULT_REGION)
+    return sorted(r['RegionName'] for r in ec2.describe_regions()['Regions'])
 
-def get_cluster_vpc_id(cluster_name: str):
-    eks_client = boto3.client('eks')
-    response = eks_client.describe_cluster(
-        name=cluster_name
+
+def get_availability_zones(region: str = DEFAULT_REGION) -> List[str]:
+    def fetch():
+        ec2 = aws_client('ec2', region_name=region)
+        zones = ec2.describe_availability_zones(Filters=[
+            {'Name': 'state', 'Values': ['available']},
+            {'Name': 'zone-type', 'Values': ['availability-zone']},
+        ])['AvailabilityZones']
+        return sorted(z['ZoneName'] for z in zones)
+    return cache.cached(f'zones:{_scope()}:{region}', ZONES_TTL, fetch)
+
+
+def get_instance_type_zones(instance_type: str, region: str = DEFAULT_REGION) -> List[str]:
+    '''
+    The zones of `region` that offer `instance_type`.
+    '''
+
+    def fetch():
+        ec2 = aws_client('ec2', region_name=region)
+        paginator = ec2.get_paginator('describe_instance_type_offerings')
+        pages = paginator.paginate(
+            LocationType='availability-zone',
+            Filters=[{'Name': 'instance-type', 'Values': [instance_type]}],
+        )
+        return sorted(o['Location'] for page in pages for o in page['InstanceTypeOfferings'])
+    return cache.cached(f'offerings:{_scope()}:{region}:{instance_type}', ZONES_TTL, fetch)
+
+
+def choose_cluster_zones(instance_type: str, region: str = DEFAULT_REGION, zone: Optional[str] = None) -> List[str]:
+    '''
+    Zones for a new cluster: first the one its node group goes in (`zone`,
+    or the first zone offering `instance_type`), then a second one, since
+    EKS needs two for the control plane. Raises `ZoneError` if there's no
+    such zone.
+    '''
+
+    zones = get_availability_zones(region)
+    if zone is not None:
+        if zone not in zones:
+            raise ZoneError(f'No availability zone "{zone}" in {region}; expected one of {", ".join(zones)}')
+        node_zone = zone
+    else:
+        offered = [z for z in get_instance_type_zones(instance_type, region) if z in zones]
+        if len(offered) == 0:
+            raise ZoneError(f'No availability zone in {region} offers {instance_type}')
+        node_zone = offered[0]
+    others = [z for z in zones if z != node_zone]
+    if len(others) == 0:
+        raise ZoneError(f'{region} has only one availability zone; EKS needs two')
+    return [node_zone, others[0]]
+
+
+def get_cluster_names(region: str = DEFAULT_REGION) -> List[str]:
+    '''
+    Names of the EKS clusters in `region`, served from the metadata cache
+    when possible. Use `get_clusters` when fresh status is needed.
+    '''
+
+    return cache.cached(
+        f'clusters:{_scope()}:{region}',
+        CLUSTERS_TTL,
+        lambda: list_cluster_names(aws_client('eks', region_name=region)),
     )
-    return response['cluster']['resourcesVpcConfig']['vpcId']
 
 
-def get_security_group_id(vpc_id: str, group_name: str) -> Optional[str]:
-    ec2 = boto3.client('ec2', region_name='us-east-1')
-    for sg in ec2.describe_security_groups()['SecurityGroups']:
-        if sg['GroupName'] == group_name and sg['VpcId'] == vpc_id:
-            return sg['GroupId']
-    return None
+def invalidate_cluster(cluster_name: str, region: str = DEFAULT_REGION):
+    cache.invalidate(f'clusters:{_scope()}:{region}', f'vpc:{_scope()}:{region}:{cluster_name}')
 
 
-def get_subnet_id(vpc_id: str) -> Optional[str]:
-    ec2 = boto3.client('ec2', region_name='us-east-1')
-    for subnet in ec2.describe_subnets()['Subnets']:
-        if subnet['VpcId'] == vpc_id:
-            return subnet['SubnetId']
+def get_cluster_vpc_id(cluster_name: str, region: str = DEFAULT_REGION):
+    def fetch():
+        eks_client = aws_client('eks', region_name=region)
+        response = eks_client.describe_cluster(
+            name=cluster_name
+        )
+        return response['cluster']['resourcesVpcConfig']['vpcId']
+    return cache.cached(f'vpc:{_scope()}:{region}:{cluster_name}', VPC_TTL, fetch)
+
+
+def get_security_group_id(vpc_id: str, group_name: str, region: str = DEFAULT_REGION) -> Optional[str]:
+    def fetch():
+        ec2 = aws_client('ec2', region_name=region)
+        paginator = ec2.get_paginator('describe_security_groups')
+        pages = paginator.paginate(Filters=[
+            {'Name': 'vpc-id', 'Values': [vpc_id]},
+            {'Name': 'group-name', 'Values': [group_name]},
+        ])
+        for page in pages:
+            for sg in page['SecurityGroups']:
+                return sg['GroupId']
+        return None
+    return cache.cached(f'sg:{_scope()}:{vpc_id}:{group_name}', SECURITY_GROUP_TTL, fetch)
+
+
+def get_vpc_subnets(vpc_id: str, region: str = DEFAULT_REGION) -> Dict[str, List[dict]]:
+    '''
+    The VPC's subnets indexed by availability zone. Each zone's list is
+    ordered best-first for placing a filesystem: private subnets (our node
+    groups use private networking) before public ones, then by free IPs.
+    '''
+
+    def fetch():
+        ec2 = aws_client('ec2', region_name=region)
+        paginator = ec2.get_paginator('describe_subnets')
+        subnets = []
+        for page in paginator.paginate(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}]):
+            for subnet in page['Subnets']:
+                subnets.append({
+                    'id': subnet['SubnetId'],
+                    'az': subnet['AvailabilityZone'],
+                    'public': subnet.get('MapPublicIpOnLaunch', False),
+                    'free_ips': subnet.get('AvailableIpAddressCount', 0),
+                })
+        return subnets
+    index: Dict[str, List[dict]] = {}
+    for subnet in cache.cached(f'subnets:{_scope()}:{vpc_id}', SUBNET_TTL, fetch):
+        index.setdefault(subnet['az'], []).append(subnet)
+    for subnets in index.values():
+        subnets.sort(key=lambda s: (s['public'], -s['free_ips'], s['id']))
+    return index
+
+
+def get_subnet_id(
+    vpc_id: str,
+    availability_zone: Optional[str] = None,
+    region: str = DEFAULT_REGION,
+) -> Optional[str]:
+    '''
+    Picks a subnet in `availability_zone` (the node group's zone, when
+    known) if the VPC has one there, so the filesystem sits next to the
+    nodes; otherwise the best subnet elsewhere.
+    '''
+
+    index = get_vpc_subnets(vpc_id, region)
+    if availability_zone in index:
+        return index[availability_zone][0]['id']
+    for az in sorted(index.keys()):
+        return index[az][0]['id']
     return None
+
+
+def invalidate_vpc(vpc_id: str):
+    cache.invalidate(f'subnets:{_scope()}:{vpc_id}', prefix=f'sg:{_scope()}:{vpc_id}:')
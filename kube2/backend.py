@@ -0,0 +1,578 @@
+'''
+Backends for reading Kubernetes objects.
+
+`APIBackend` talks to the API server in-process: kubeconfig is read once,
+credentials are resolved once (and cached on disk for exec plugins such as
+`aws eks get-token`), and all requests share a keep-alive HTTPS pool.
+`KubectlBackend` shells out to `kubectl` and is used as a fallback when the
+API client can't be configured, or when `KUBE2_BACKEND=kubectl` is set.
+
+Both backends return the JSON objects the API server returns.
+'''
+
+import atexit
+import base64
+import binascii
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+from urllib.parse import urlencode
+
+from kube2.binaries import ensure_binary
+from kube2.cache import CACHE_DIR, cache
+from kube2.trace import span
+
+
+# environment that decides who an exec plugin such as `aws eks get-token`
+# authenticates as
+EXEC_IDENTITY_ENV = (
+    'AWS_PROFILE',
+    'AWS_DEFAULT_PROFILE',
+    'AWS_ACCESS_KEY_ID',
+    'AWS_ROLE_ARN',
+    'AWS_WEB_IDENTITY_TOKEN_FILE',
+    'AWS_CONFIG_FILE',
+    'AWS_SHARED_CREDENTIALS_FILE',
+)
+
+
+class KubeError(Exception):
+    def __init__(self, msg: str, status: Optional[int] = None):
+        super().__init__(msg)
+        # HTTP status, when the error came from the API server
+        self.status = status
+
+
+# API group prefix for each resource kube2 touches
+API_GROUPS = {
+    'pods': '/api/v1',
+    'persistentvolumeclaims': '/api/v1',
+    'secrets': '/api/v1',
+    'statefulsets': '/apis/apps/v1',
+    'daemonsets': '/apis/apps/v1',
+}
+
+# kind -> (resource, namespaced) for the objects kube2 applies
+KINDS = {
+    'Pod': ('pods', True),
+    'PersistentVolumeClaim': ('persistentvolumeclaims', True),
+    'Secret': ('secrets', True),
+    'StatefulSet': ('statefulsets', True),
+    'DaemonSet': ('daemonsets', True),
+    'StorageClass': ('storageclasses', False),
+}
+
+
+class KubectlBackend(object):
+    name = 'kubectl'
+    # whether watch() can resume from a resource version
+    supports_resume = False
+
+    def __init__(self, context: Optional[str] = None, request_timeout: Optional[float] = None):
+        self.context = context
+        self.request_timeout = request_timeout
+
+    def kubectl(self, args: str) -> str:
+        ensure_binary('kubectl')
+        cmd = 'kubectl '
+        if self.context is not None:
+            cmd += f'--context {self.context} '
+        if self.request_timeout is not None:
+            cmd += f'--request-timeout={max(1, int(self.request_timeout))}s '
+        with span('kubectl', 'subprocess', cmd=cmd + args) as s:
+            proc = subprocess.run(
+                cmd + args,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            s.set(status=proc.returncode)
+        if proc.returncode != 0:
+            raise KubeError(proc.stderr.decode().strip())
+        return proc.stdout.decode()
+
+    def _get(self, args: str) -> dict:
+        return json.loads(self.kubectl(f'get {args} -o json'))
+
+    def list_pods(self, label_selector: Optional[str] = None) -> List[dict]:
+        selector = f' -l {label_selector}' if label_selector else ''
+        return self._get(f'pods{selector}')['items']
+
+    def list_pvcs(self) -> List[dict]:
+        return self._get('pvc')['items']
+
+    def list_nodes(self) -> List[dict]:
+        return self._get('nodes')['items']
+
+    def list_all_pods(self, field_selector: Optional[str] = None) -> List[dict]:
+        selector = f' --field-selector={field_selector}' if field_selector else ''
+        return self._get(f'pods --all-namespaces{selector}')['items']
+
+    def get_pvc(self, name: str) -> dict:
+        return self._get(f'pvc {name}')
+
+    def get_statefulset(self, name: str) -> dict:
+        return self._get(f'statefulsets {name}')
+
+    def list_statefulsets(self) -> List[dict]:
+        return self._get('statefulsets')['items']
+
+    def get_secret(self, name: str) -> dict:
+        return self._get(f'secrets {name}')
+
+    def list_secrets(self, label_selector: Optional[str] = None) -> List[dict]:
+        selector = f' -l {label_selector}' if label_selector else ''
+        return self._get(f'secrets{selector}')['items']
+
+    def patch(self, resource: str, name: str, patch: dict):
+        '''
+        Applies a JSON merge patch.
+        '''
+
+        self.kubectl(f'patch {resource} {name} --type merge -p {shlex.quote(json.dumps(patch))}')
+
+    def delete(self, resource: str, *names: str):
+        '''
+        Deletes any number of objects with one `kubectl delete`.
+        '''
+
+        if len(names) > 0:
+            self.kubectl(f'delete {resource} {" ".join(names)} --ignore-not-found --wait=false')
+
+    def get_raw(self, path: str, timeout: Optional[float] = None) -> dict:
+        args = f'get --raw {path}'
+        if timeout is not None:
+            args += f' --request-timeout={max(1, int(timeout))}s'
+        return json.loads(self.kubectl(args))
+
+    def apply(self, docs: List[dict]):
+        '''
+        Applies all the objects with a single `kubectl apply -f -`.
+        '''
+
+        from kube2.manifest import to_json_list
+
+        ensure_binary('kubectl')
+        cmd = 'kubectl '
+        if self.context is not None:
+            cmd += f'--context {self.context} '
+        with span('kubectl apply', 'subprocess', cmd=cmd + 'apply -f -', objects=len(docs)) as s:
+            proc = subprocess.run(cmd + 'apply -f -', shell=True, input=to_json_list(docs))
+            s.set(status=proc.returncode)
+        if proc.returncode != 0:
+            raise KubeError(f'kubectl apply failed with exit code {proc.returncode}')
+
+    def watch(
+        self,
+        resource: str,
+        *,
+        name: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        resource_version: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[dict]:
+        '''
+        Streams watch events from `kubectl get --watch`. kubectl can't resume
+        from a resource version, so each (re)connect starts with ADDED events
+        for the current state.
+        '''
+
+        args = f'get {resource}'
+        if name is not None:
+            args += f' {name}'
+        if label_selector:
+            args += f' -l {label_selector}'
+        args += ' -o json --watch --output-watch-events'
+        ensure_binary('kubectl')
+        if timeout is not None:
+            args += f' --request-timeout={max(1, int(timeout))}s'
+        cmd = 'kubectl '
+        if self.context is not None:
+            cmd += f'--context {self.context} '
+        with span('kubectl watch', 'subprocess', cmd=cmd + args) as s:
+            proc = subprocess.Popen(
+                cmd + args,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            try:
+                # events are pretty-printed JSON documents, each ending with a
+                # top-level "}" line
+                lines = []
+                for line in proc.stdout:
+                    lines.append(line)
+                    if line.rstrip() == b'}':
+                        yield json.loads(b''.join(lines))
+                        lines = []
+                if proc.wait() != 0:
+                    raise KubeError(proc.stderr.read().decode().strip())
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                s.set(status=proc.returncode)
+
+
+def _exec_credential(user: dict, context_name: str) -> str:
+    '''
+    Runs a kubeconfig exec plugin (e.g. `aws eks get-token`) and returns the
+    bearer token, caching it on disk until shortly before it expires. The
+    cache key covers the plugin's command line and env and the AWS identity
+    it runs as, so another profile or role never gets this token.
+    '''
+
+    spec = user['exec']
+    argv = [spec['command']] + list(spec.get('args') or [])
+    plugin_env = {e['name']: e['value'] for e in spec.get('env') or []}
+    identity = {name: os.environ.get(name) for name in EXEC_IDENTITY_ENV}
+    digest = hashlib.sha256(json.dumps([argv, plugin_env, identity], sort_keys=True).encode()).hexdigest()[:16]
+    key = f'token:{context_name}:{digest}'
+    token = cache.get(key)
+    if token is not None:
+        return token
+    ensure_binary(spec['command'])
+    env = dict(os.environ)
+    env.update(plugin_env)
+    with span('exec credential', 'subprocess', argv=argv) as s:
+        proc = subprocess.run(
+            argv,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        s.set(status=proc.returncode)
+    if proc.returncode != 0:
+        raise KubeError(proc.stderr.decode().strip())
+    try:
+        status = json.loads(proc.stdout)['status']
+        token = status['token']
+    except (ValueError, KeyError, TypeError) as e:
+        raise KubeError(f'{spec["command"]} returned no credential: {e}')
+    expires = status.get('expirationTimestamp')
+    if expires is not None:
+        expires_at = datetime.strptime(expires, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        ttl = expires_at.timestamp() - time.time() - 60
+        if ttl > 0:
+            cache.set(key, token, ttl)
+    return token
+
+
+def _materialize(data: Optional[str], fn: Optional[str], suffix: str) -> Optional[str]:
+    '''
+    urllib3 wants client certificates as files; write `*-data` fields out to a
+    private file under the cache directory.
+    '''
+
+    if data is None:
+        return fn
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.kube-', suffix=suffix)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(base64.b64decode(data))
+    return path
+
+
+class APIBackend(object):
+    name = 'api'
+    supports_resume = True
+
+    def __init__(
+        self,
+        server: str,
+        *,
+        namespace: str = 'default',
+        token: Optional[str] = None,
+        ca_data: Optional[bytes] = None,
+        ca_file: Optional[str] = None,
+        cert_file: Optional[str] = None,
+        key_file: Optional[str] = None,
+        verify: bool = True,
+        maxsize: int = 8,
+        timeout: float = 30.0,
+    ):
+        import urllib3
+
+        self.server = server.rstrip('/')
+        self.namespace = namespace
+        self.headers = {'Accept': 'application/json'}
+        if token is not None:
+            self.headers['Authorization'] = f'Bearer {token}'
+        kwargs = {}
+        if self.server.startswith('https'):
+            if verify:
+                kwargs['cert_reqs'] = 'CERT_REQUIRED'
+                if ca_data is not None:
+                    kwargs['ca_cert_data'] = ca_data.decode()
+                if ca_file is not None:
+                    kwargs['ca_certs'] = ca_file
+            else:
+                kwargs['cert_reqs'] = 'CERT_NONE'
+            if cert_file is not None:
+                kwargs['cert_file'] = cert_file
+                kwargs['key_file'] = key_file
+        self.timeout = timeout
+        self.pool = urllib3.PoolManager(maxsize=maxsize, block=False, **kwargs)
+        self._temp_files: List[str] = []
+
+    @classmethod
+    def from_kubeconfig(cls, context: Optional[str] = None) -> 'APIBackend':
+        from kube2.kubeconfig import KubeconfigError, load_kubeconfig, resolve_context
+
+        try:
+            context_name, cluster, user, namespace = resolve_context(load_kubeconfig(), context)
+        except KeyError as e:
+            # no current context, or one naming a missing cluster or user
+            raise KubeconfigError(e.args[0])
+        if 'server' not in cluster:
+            raise KubeconfigError(f'The cluster of context "{context_name}" has no server')
+        token = user.get('token')
+        if token is None and 'exec' in user:
+            token = _exec_credential(user, context_name)
+        try:
+            cert_file = _materialize(user.get('client-certificate-data'), user.get('client-certificate'), '.crt')
+            key_file = _materialize(user.get('client-key-data'), user.get('client-key'), '.key')
+            ca_data = cluster.get('certificate-authority-data')
+            ca_data = base64.b64decode(ca_data) if ca_data else None
+        except binascii.Error as e:
+            raise KubeconfigError(f'Bad certificate data for context "{context_name}": {e}')
+        backend = cls(
+            cluster['server'],
+            namespace=namespace,
+            token=token,
+            ca_data=ca_data,
+            ca_file=cluster.get('certificate-authority'),
+            cert_file=cert_file,
+            key_file=key_file,
+            verify=not cluster.get('insecure-skip-tls-verify', False),
+        )
+        for fn, field in ((cert_file, 'client-certificate-data'), (key_file, 'client-key-data')):
+            if user.get(field) is not None:
+                backend._temp_files.append(fn)
+        return backend
+
+    def close(self):
+        self.pool.clear()
+        for fn in self._temp_files:
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+        self._temp_files = []
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        body=None,
+        headers=None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        import urllib3
+
+        url = self.server + path
+        if params:
+            url += '?' + urlencode(params)
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        with span(f'{method} {path}', 'api', params=params) as s:
+            try:
+                resp = self.pool.request(method, url, body=body, headers=all_headers, timeout=timeout or self.timeout)
+            except urllib3.exceptions.HTTPError as e:
+                # connection refused, timeouts, dropped connections: callers
+                # handle these like any other failed request
+                raise KubeError(f'{method} {path}: {e}')
+            s.set(status=resp.status)
+        if resp.status >= 400:
+            raise KubeError(
+                f'{method} {path}: HTTP {resp.status}: {resp.data.decode(errors="replace")}',
+                status=resp.status,
+            )
+        return json.loads(resp.data)
+
+    def _ns(self, resource: str) -> str:
+        group = API_GROUPS[resource.split('/')[0]]
+        return f'{group}/namespaces/{self.namespace}/{resource}'
+
+    def list_pods(self, label_selector: Optional[str] = None) -> List[dict]:
+        params = {'labelSelector': label_selector} if label_selector else None
+        return self.request('GET', self._ns('pods'), params)['items']
+
+    def list_pvcs(self) -> List[dict]:
+        return self.request('GET', self._ns('persistentvolumeclaims'))['items']
+
+    def list_nodes(self) -> List[dict]:
+        return self.request('GET', '/api/v1/nodes')['items']
+
+    def list_all_pods(self, field_selector: Optional[str] = None) -> List[dict]:
+        params = {'fieldSelector': field_selector} if field_selector else None
+        return self.request('GET', '/api/v1/pods', params)['items']
+
+    def get_pvc(self, name: str) -> dict:
+        return self.request('GET', self._ns(f'persistentvolumeclaims/{name}'))
+
+    def get_statefulset(self, name: str) -> dict:
+        return self.request('GET', self._ns(f'statefulsets/{name}'))
+
+    def list_statefulsets(self) -> List[dict]:
+        return self.request('GET', self._ns('statefulsets'))['items']
+
+    def get_secret(self, name: str) -> dict:
+        return self.request('GET', self._ns(f'secrets/{name}'))
+
+    def list_secrets(self, label_selector: Optional[str] = None) -> List[dict]:
+        params = {'labelSelector': label_selector} if label_selector else None
+        return self.request('GET', self._ns('secrets'), params)['items']
+
+    def patch(self, resource: str, name: str, patch: dict):
+        '''
+        Applies a JSON merge patch.
+        '''
+
+        self.request(
+            'PATCH',
+            self._ns(f'{resource}/{name}'),
+            body=json.dumps(patch).encode(),
+            headers={'Content-Type': 'application/merge-patch+json'},
+        )
+
+    def delete(self, resource: str, *names: str):
+        '''
+        Deletes each object over the shared connection pool.
+        '''
+
+        for name in names:
+            try:
+                self.request('DELETE', self._ns(f'{resource}/{name}'), params={'propagationPolicy': 'Background'})
+            except KubeError as e:
+                if e.status != 404:
+                    raise
+
+    def get_raw(self, path: str, timeout: Optional[float] = None) -> dict:
+        return self.request('GET', path, timeout=timeout)
+
+    def object_path(self, doc: dict) -> str:
+        if doc['kind'] not in KINDS:
+            raise KubeError(f'Unsupported kind for the API backend: {doc["kind"]}')
+        resource, namespaced = KINDS[doc['kind']]
+        api_version = doc['apiVersion']
+        group = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+        if namespaced:
+            namespace = doc['metadata'].get('namespace', self.namespace)
+            group += f'/namespaces/{namespace}'
+        return f'{group}/{resource}/{doc["metadata"]["name"]}'
+
+    def apply(self, docs: List[dict]):
+        '''
+        Server-side applies each object over the shared connection pool.
+        '''
+
+        for doc in docs:
+            self.request(
+                'PATCH',
+                self.object_path(doc),
+                params={'fieldManager': 'kube2', 'force': 'true'},
+                body=json.dumps(doc).encode(),
+                headers={'Content-Type': 'application/apply-patch+yaml'},
+            )
+            print(f'{doc["kind"].lower()}/{doc["metadata"]["name"]} applied')
+
+    def watch(
+        self,
+        resource: str,
+        *,
+        name: Optional[str] = None,
+        label_selector: Optional[str] = None,
+        resource_version: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[dict]:
+        import urllib3
+
+        params = {'watch': '1', 'allowWatchBookmarks': 'true'}
+        if name is not None:
+            params['fieldSelector'] = f'metadata.name={name}'
+        if label_selector:
+            params['labelSelector'] = label_selector
+        if resource_version is not None:
+            params['resourceVersion'] = resource_version
+        read_timeout = None
+        if timeout is not None:
+            params['timeoutSeconds'] = str(max(1, int(timeout)))
+            read_timeout = timeout + 10
+        url = self.server + self._ns(resource) + '?' + urlencode(params)
+        try:
+            resp = self.pool.request(
+                'GET',
+                url,
+                headers=self.headers,
+                preload_content=False,
+                timeout=urllib3.Timeout(connect=self.timeout, read=read_timeout),
+            )
+        except urllib3.exceptions.HTTPError as e:
+            raise KubeError(f'watch {resource}: {e}')
+        try:
+            if resp.status >= 400:
+                raise KubeError(f'watch {resource}: HTTP {resp.status}: {resp.read().decode(errors="replace")}')
+            buf = b''
+            for chunk in resp.stream(64 * 1024):
+                buf += chunk
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    if line.strip():
+                        yield json.loads(line)
+        except urllib3.exceptions.HTTPError as e:
+            # the stream broke part way; waiters reconnect on KubeError
+            raise KubeError(f'watch {resource}: {e}')
+        finally:
+            resp.release_conn()
+
+
+def make_backend(context: Optional[str] = None, timeout: Optional[float] = None):
+    '''
+    A backend for `context` (the current context by default). Uses the
+    in-process API client unless `KUBE2_BACKEND=kubectl` is set, or the
+    kubeconfig can't be loaded or its credentials can't be fetched.
+    `timeout` bounds each request.
+    '''
+
+    from kube2.kubeconfig import KubeconfigError
+
+    if os.environ.get('KUBE2_BACKEND', 'api') == 'kubectl':
+        return KubectlBackend(context, request_timeout=timeout)
+    try:
+        backend = APIBackend.from_kubeconfig(context)
+    except (KubeconfigError, KubeError, OSError):
+        return KubectlBackend(context, request_timeout=timeout)
+    if timeout is not None:
+        backend.timeout = timeout
+    atexit.register(backend.close)
+    return backend
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    '''
+    The process-wide backend for the current context.
+    '''
+
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend()
+        return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
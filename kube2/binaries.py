@@ -0,0 +1,35 @@
+import shutil
+import sys
+from functools import lru_cache
+
+
+# external tools kube2 shells out to, and what to tell the user if missing
+REQUIRED_BINARIES = {
+    'eksctl': 'You must install `eksctl` to use this tool.',
+    'kubectl': 'You must install `kubectl` to use this tool.',
+    'aws': 'You must install the AWS CLI tool to use this tool.',
+}
+
+
+@lru_cache(maxsize=None)
+def ensure_binary(binary: str, msg: str = None):
+    '''
+    Exit with a helpful message if `binary` isn't on the PATH. Checked
+    in-process, at most once per binary.
+    '''
+
+    if shutil.which(binary) is None:
+        if msg is None:
+            msg = REQUIRED_BINARIES.get(binary, f'Unable to find `{binary}` on your path. Aborting!')
+        print(msg)
+        sys.exit(1)
+
+
+def ensure_binaries_for(cmd: str):
+    '''
+    Check the tool a shell command starts with, if it's one we depend on.
+    '''
+
+    parts = cmd.split(None, 1)
+    if len(parts) > 0 and parts[0] in REQUIRED_BINARIES:
+        ensure_binary(parts[0])
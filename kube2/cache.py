@@ -0,0 +1,133 @@
+import atexit
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+
+CACHE_DIR = os.environ.get(
+    'KUBE2_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'kube2'),
+)
+
+# default lifetimes (seconds) for the kinds of metadata we cache
+CLUSTERS_TTL = 10 * 60
+VPC_TTL = 24 * 60 * 60
+SUBNET_TTL = 24 * 60 * 60
+SECURITY_GROUP_TTL = 60 * 60
+ZONES_TTL = 24 * 60 * 60
+
+
+class MetadataCache(object):
+    '''
+    A small JSON key/value store with per-entry TTLs, shared between kube2
+    processes. Reads and writes hold an flock on a sidecar lock file and the
+    data file is replaced atomically, so concurrent CLI invocations never see
+    a partially written cache.
+    '''
+
+    def __init__(self, directory: str = CACHE_DIR, enabled: bool = True):
+        self.directory = directory
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, 'metadata.json')
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data: dict):
+        fd, tmp_fn = tempfile.mkstemp(dir=self.directory, prefix='.metadata-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_fn, self.path)
+        except BaseException:
+            os.unlink(tmp_fn)
+            raise
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        with self._locked(exclusive=False):
+            entry = self._read().get(key)
+        if entry is None or entry['expires'] < time.time():
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry['value']
+
+    def set(self, key: str, value: Any, ttl: float):
+        if not self.enabled:
+            return
+        with self._locked(exclusive=True):
+            now = time.time()
+            data = {k: v for k, v in self._read().items() if v['expires'] >= now}
+            data[key] = {'value': value, 'expires': now + ttl}
+            self._write(data)
+
+    def invalidate(self, *keys: str, prefix: Optional[str] = None):
+        '''
+        Drop the given keys (and any key starting with `prefix`). This runs
+        even with the cache disabled, so `--no-cache` never leaves stale
+        entries behind for the next invocation.
+        '''
+
+        if not os.path.exists(self.path):
+            return
+        with self._locked(exclusive=True):
+            data = self._read()
+            for k in list(data.keys()):
+                if k in keys or (prefix is not None and k.startswith(prefix)):
+                    del data[k]
+            self._write(data)
+
+    def cached(self, key: str, ttl: float, fn: Callable[[], Any]) -> Any:
+        '''
+        Return the cached value for `key`, computing and storing it with `fn`
+        on a miss. `None` results are not cached.
+        '''
+
+        value = self.get(key)
+        if value is None:
+            value = fn()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def print_stats(self):
+        print(
+            f'[kube2 cache] hits={self.hits} misses={self.misses} '
+            f'enabled={self.enabled} path={self.path}',
+            file=sys.stderr,
+        )
+
+
+cache = MetadataCache()
+
+
+def configure_cache(*, enabled: bool = True, debug: bool = False):
+    cache.enabled = enabled
+    if debug:
+        atexit.register(cache.print_stats)
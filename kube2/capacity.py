@@ -0,0 +1,371 @@
+'''
+Pre-flight capacity checks: will a job's replicas fit on the cluster?
+
+A snapshot of every node's allocatable resources and the requests of every
+pod bound to it is taken once; the free capacity of each node is then
+allocatable minus requests. Replicas are identical, so packing them is
+exact without search: a node fits as many replicas as its scarcest
+resource allows (or one, when replicas need a node to themselves). The cost
+is linear in nodes plus pods: a few hundred milliseconds for 500 nodes and
+20,000 pods, well under the time it takes to list them.
+
+Deploys that share a cluster (a sweep, or queued jobs) share one
+`CapacityLedger`: they are checked one at a time against the same snapshot,
+and each job let through reserves its replicas in it, so the next check
+doesn't hand out the same room again.
+
+Quantities are compared in integer milli-units (like the API server's
+MilliValue), so "90" CPUs and "500Gi" of memory are exact.
+'''
+
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import ROUND_CEILING, Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kube2.backend import get_backend
+
+
+# pods in these phases no longer hold their requests
+TERMINATED_PHASES = ('Succeeded', 'Failed')
+
+ZONE_LABELS = ('topology.kubernetes.io/zone', 'failure-domain.beta.kubernetes.io/zone')
+
+NODEGROUP_LABEL = 'eks.amazonaws.com/nodegroup'
+
+_SUFFIXES = {
+    'n': (1, 10 ** 9), 'u': (1, 10 ** 6), 'm': (1, 1000), '': (1, 1),
+    'k': (10 ** 3, 1), 'M': (10 ** 6, 1), 'G': (10 ** 9, 1), 'T': (10 ** 12, 1), 'P': (10 ** 15, 1), 'E': (10 ** 18, 1),
+    'Ki': (2 ** 10, 1), 'Mi': (2 ** 20, 1), 'Gi': (2 ** 30, 1), 'Ti': (2 ** 40, 1), 'Pi': (2 ** 50, 1), 'Ei': (2 ** 60, 1),
+}
+
+_QUANTITY_RE = re.compile(r'^([+-]?[0-9.]+(?:[eE][+-]?[0-9]+)?)([a-zA-Z]*)$')
+
+
+class CapacityError(Exception):
+    pass
+
+
+@lru_cache(maxsize=4096)
+def parse_quantity(quantity) -> int:
+    '''
+    A Kubernetes quantity ("90", "500m", "500Gi", 4) in milli-units.
+    '''
+
+    m = _QUANTITY_RE.match(str(quantity).strip())
+    if m is None or m.group(2) not in _SUFFIXES:
+        raise CapacityError(f'Invalid quantity "{quantity}"')
+    multiplier, divisor = _SUFFIXES[m.group(2)]
+    try:
+        value = Decimal(m.group(1)) * multiplier * 1000 / divisor
+    except InvalidOperation:
+        raise CapacityError(f'Invalid quantity "{quantity}"')
+    # round up, like the API server does for milli-values
+    return int(value.to_integral_value(rounding=ROUND_CEILING))
+
+
+def get_pod_requests(pod_spec: dict) -> Dict[str, int]:
+    '''
+    Effective requests of a pod spec, as the scheduler counts them: the sum
+    over containers, or the largest init container if that's bigger, plus
+    the pod overhead. A limit without a request implies an equal request.
+    '''
+
+    def container_requests(container: dict) -> Dict[str, int]:
+        resources = container.get('resources') or {}
+        requests = dict(resources.get('limits') or {})
+        requests.update(resources.get('requests') or {})
+        return {k: parse_quantity(v) for k, v in requests.items()}
+
+    total: Dict[str, int] = defaultdict(int)
+    for container in pod_spec.get('containers') or []:
+        for k, v in container_requests(container).items():
+            total[k] += v
+    for container in pod_spec.get('initContainers') or []:
+        for k, v in container_requests(container).items():
+            total[k] = max(total[k], v)
+    for k, v in (pod_spec.get('overhead') or {}).items():
+        total[k] += parse_quantity(v)
+    return dict(total)
+
+
+def tolerates(taint: dict, tolerations: List[dict]) -> bool:
+    for t in tolerations:
+        if t.get('effect') and t['effect'] != taint.get('effect'):
+            continue
+        if t.get('operator') == 'Exists' and not t.get('key'):
+            return True
+        if t.get('key') != taint.get('key'):
+            continue
+        if t.get('operator') == 'Exists' or t.get('value') == taint.get('value'):
+            return True
+    return False
+
+
+def is_node_schedulable(node: dict, tolerations: List[dict]) -> bool:
+    if node.get('spec', {}).get('unschedulable'):
+        return False
+    for condition in node.get('status', {}).get('conditions') or []:
+        if condition.get('type') == 'Ready' and condition.get('status') != 'True':
+            return False
+    for taint in node.get('spec', {}).get('taints') or []:
+        if taint.get('effect') in ('NoSchedule', 'NoExecute') and not tolerates(taint, tolerations):
+            return False
+    return True
+
+
+def get_node_zone(node: dict) -> Optional[str]:
+    labels = node['metadata'].get('labels') or {}
+    for label in ZONE_LABELS:
+        if label in labels:
+            return labels[label]
+    return None
+
+
+def get_nodegroup_zone(nodes: List[dict], nodegroup: str) -> Optional[str]:
+    '''
+    The zone every node of `nodegroup` is in, or None if the node group has
+    no nodes or spans several zones.
+    '''
+
+    zones = {
+        get_node_zone(node) for node in nodes
+        if (node['metadata'].get('labels') or {}).get(NODEGROUP_LABEL) == nodegroup
+    }
+    return zones.pop() if len(zones) == 1 else None
+
+
+@dataclass
+class JobShape(object):
+    '''
+    What a job asks of the cluster, taken from its rendered StatefulSet.
+    '''
+
+    replicas: int
+    requests: Dict[str, int]
+    exclusive: bool = False
+    zone: Optional[str] = None
+    tolerations: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class Snapshot(object):
+    nodes: List[dict]
+    pods: List[dict]
+
+
+@dataclass
+class FitReport(object):
+    replicas: int
+    fits: int
+    limiting: Optional[str]
+    # resource -> replicas that would fit if only that resource counted
+    by_resource: Dict[str, int]
+    nodes: int
+    pending_pods: int
+
+    @property
+    def ok(self) -> bool:
+        return self.fits >= self.replicas
+
+    def summary(self) -> str:
+        if self.ok:
+            return f'All {self.replicas} replicas fit on {self.nodes} eligible nodes.'
+        msg = f'Only {self.fits} of {self.replicas} replicas fit on {self.nodes} eligible nodes'
+        if self.limiting is not None:
+            msg += f'; limited by {self.limiting} (room for {self.by_resource[self.limiting]})'
+        if self.pending_pods > 0:
+            msg += f'; {self.pending_pods} other pods are already pending'
+        return msg + '.'
+
+
+def get_job_shape(docs: List[dict]) -> JobShape:
+    '''
+    The shape of the StatefulSet among a job's rendered manifests.
+    '''
+
+    for doc in docs:
+        if doc['kind'] != 'StatefulSet':
+            continue
+        pod_spec = doc['spec']['template']['spec']
+        affinity = pod_spec.get('affinity') or {}
+        zone = None
+        node_terms = (affinity.get('nodeAffinity') or {}).get('requiredDuringSchedulingIgnoredDuringExecution') or {}
+        for term in node_terms.get('nodeSelectorTerms') or []:
+            for expr in term.get('matchExpressions') or []:
+                if expr.get('key') in ZONE_LABELS and expr.get('operator') == 'In' and len(expr.get('values') or []) == 1:
+                    zone = expr['values'][0]
+        anti = (affinity.get('podAntiAffinity') or {}).get('requiredDuringSchedulingIgnoredDuringExecution') or []
+        return JobShape(
+            replicas=doc['spec'].get('replicas', 1),
+            requests=get_pod_requests(pod_spec),
+            exclusive=any(t.get('topologyKey') == 'kubernetes.io/hostname' for t in anti),
+            zone=zone,
+            tolerations=pod_spec.get('tolerations') or [],
+        )
+    raise CapacityError('No StatefulSet in the manifests')
+
+
+def get_snapshot(backend=None) -> Snapshot:
+    '''
+    Nodes and live pods, fetched concurrently.
+    '''
+
+    backend = backend or get_backend()
+    selector = ','.join(f'status.phase!={p}' for p in TERMINATED_PHASES)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        nodes = pool.submit(backend.list_nodes)
+        pods = pool.submit(backend.list_all_pods, field_selector=selector)
+        return Snapshot(nodes=nodes.result(), pods=pods.result())
+
+
+def get_free_capacity(snapshot: Snapshot, shape: JobShape) -> Tuple[Dict[str, Dict[str, int]], int]:
+    '''
+    Free milli-units per resource of each node the job could run on, and
+    the number of pods still waiting for a node.
+    '''
+
+    free: Dict[str, Dict[str, int]] = {}
+    for node in snapshot.nodes:
+        if shape.zone is not None and get_node_zone(node) != shape.zone:
+            continue
+        if not is_node_schedulable(node, shape.tolerations):
+            continue
+        allocatable = node.get('status', {}).get('allocatable') or {}
+        free[node['metadata']['name']] = {k: parse_quantity(allocatable.get(k, 0)) for k in shape.requests.keys()}
+
+    pending = 0
+    for pod in snapshot.pods:
+        if pod.get('status', {}).get('phase') in TERMINATED_PHASES:
+            continue
+        node = pod.get('spec', {}).get('nodeName')
+        if not node:
+            pending += 1
+            continue
+        # pods on nodes the job can't use don't matter
+        node_free = free.get(node)
+        if node_free is None:
+            continue
+        for k, v in get_pod_requests(pod['spec']).items():
+            if k in node_free:
+                node_free[k] -= v
+    return free, pending
+
+
+def count_fits(free: Dict[str, int], requests: Dict[str, int], exclusive: bool) -> int:
+    '''
+    How many replicas fit in one node's free capacity.
+    '''
+
+    n = None
+    for k, need in requests.items():
+        if need <= 0:
+            continue
+        fits = max(0, free.get(k, 0)) // need
+        n = fits if n is None else min(n, fits)
+    if n is None:
+        # requests nothing (countable), so it always fits
+        n = 1 if exclusive else 1 << 30
+    return min(n, 1) if exclusive else n
+
+
+def simulate(snapshot: Snapshot, shape: JobShape) -> FitReport:
+    free, pending = get_free_capacity(snapshot, shape)
+    fits = sum(count_fits(f, shape.requests, shape.exclusive) for f in free.values())
+    by_resource = {}
+    for k, need in shape.requests.items():
+        if need > 0:
+            by_resource[k] = sum(count_fits(f, {k: need}, shape.exclusive) for f in free.values())
+    limiting = None
+    if fits < shape.replicas and len(by_resource) > 0:
+        limiting = min(by_resource, key=lambda k: by_resource[k])
+        if shape.exclusive and by_resource[limiting] >= len(free):
+            # every eligible node has room for a replica; there just aren't enough of them
+            limiting = 'eligible nodes'
+            by_resource['eligible nodes'] = len(free)
+        elif by_resource[limiting] >= shape.replicas:
+            # every resource alone has room; they just don't line up on the same nodes
+            limiting = 'fragmentation'
+            by_resource['fragmentation'] = fits
+    return FitReport(
+        replicas=shape.replicas,
+        fits=min(fits, 1 << 30),
+        limiting=limiting,
+        by_resource=by_resource,
+        nodes=len(free),
+        pending_pods=pending,
+    )
+
+
+def reserve(snapshot: Snapshot, shape: JobShape, name: str) -> List[dict]:
+    '''
+    Stand-in pods for the job's replicas, bound to the nodes they'd fill
+    first (in name order), so counting them in a snapshot takes their room.
+    '''
+
+    free, _ = get_free_capacity(snapshot, shape)
+    requests = {k: f'{v}m' for k, v in shape.requests.items()}
+    pods = []
+    for node in sorted(free.keys()):
+        for _ in range(min(count_fits(free[node], shape.requests, shape.exclusive), shape.replicas - len(pods))):
+            pods.append({
+                'metadata': {'name': f'{name}-{len(pods)}', 'labels': {'app': name}},
+                'spec': {'nodeName': node, 'containers': [{'name': name, 'resources': {'requests': requests}}]},
+                'status': {'phase': 'Pending'},
+            })
+    return pods
+
+
+class CapacityLedger(object):
+    '''
+    A snapshot shared by several deploys. `admit` checks one job at a time
+    and reserves the replicas of each job that fits. A reservation lasts
+    until a refreshed snapshot shows all of the job's own pods bound.
+    '''
+
+    def __init__(self, snapshot: Snapshot):
+        self.base = snapshot
+        self.taken_at = time.monotonic()
+        self.reserved: Dict[str, List[dict]] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def snapshot(self) -> Snapshot:
+        pods = list(self.base.pods)
+        for reserved in self.reserved.values():
+            pods += reserved
+        return Snapshot(nodes=self.base.nodes, pods=pods)
+
+    def admit(self, shape: JobShape, name: str) -> FitReport:
+        with self.lock:
+            snapshot = self.snapshot
+            report = simulate(snapshot, shape)
+            if report.ok:
+                self.reserved[name] = reserve(snapshot, shape, name)
+            return report
+
+    def refresh(self, fetch: Callable[[], Snapshot], max_age: float = 0):
+        '''
+        Replaces the snapshot with `fetch()` unless it's under `max_age`
+        seconds old, so deploys waiting together share one fetch.
+        '''
+
+        with self.lock:
+            if time.monotonic() - self.taken_at < max_age:
+                return
+            self.base = fetch()
+            self.taken_at = time.monotonic()
+            bound = Counter(
+                (pod['metadata'].get('labels') or {}).get('app') for pod in self.base.pods
+                if pod.get('spec', {}).get('nodeName')
+            )
+            self.reserved = {name: pods for name, pods in self.reserved.items() if bound[name] < len(pods)}
+
+
+def check_capacity(docs: List[dict], backend=None) -> FitReport:
+    return simulate(get_snapshot(backend), get_job_shape(docs))
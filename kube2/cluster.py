@@ -1,8 +1,5 @@
-from dataclasses import dataclass
-import os
 import sys
-import tempfile
-from typing import List
+from typing import List, Union
 
 from kube2.utils import (
     check_name,
@@ -17,10 +14,30 @@ from kube2.utils import (
 )
 
 from kube2.aws_utils import (
+    DEFAULT_REGION,
+    ZoneError,
+    choose_cluster_zones,
     get_clusters,
+    get_enabled_regions,
+    invalidate_cluster,
 )
+from kube2.manifest import parse_manifests
+from kube2.remote import DEFAULT_TARGET_TIMEOUT, fan_out_with_timeout, format_target_error
 
 
+def parse_regions(regions: Union[str, list, tuple]) -> List[str]:
+    '''
+    `--regions` as given by Fire: a comma-separated string (or `all` for
+    every region enabled in the account), or a list.
+    '''
+
+    if isinstance(regions, (list, tuple)):
+        regions = ','.join(str(r) for r in regions)
+    names = [r.strip() for r in str(regions).split(',') if len(r.strip()) > 0]
+    if names == ['all']:
+        return get_enabled_regions()
+    return names
+
 class ClusterCLI(object):
     '''
     Create or destroy EKS clusters. These commands take a long time!
@@ -32,65 +49,98 @@ class ClusterCLI(object):
         name: str,
         nodes: int,
         instance_type: str,
+        region: str = DEFAULT_REGION,
+        zone: str = None,
     ):
         '''
-        Creates a new EKS cluster.
+        Creates a new EKS cluster. Its nodes go in --zone, or by default the
+        first zone of the region that offers --instance-type. That's no longer
+        always us-east-1d: pass --zone us-east-1d to match older clusters.
         '''
 
         check_name(name)
 
-        if name in [c.name for c in get_clusters()]:
+        if name in [c.name for c in get_clusters(region=region)]:
             print(f'Error: There is already a cluster named "{name}"')
             sys.exit(1)
+        try:
+            node_zone, control_plane_zone = choose_cluster_zones(instance_type, region, zone)
+        except ZoneError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            cluster_config_fn = os.path.join(tmpdir, 'cluster.yml')
-            cluster_config = load_template(
-                fn='templates/cluster.yml',
-                args={
-                    'name': name,
-                    'nodes': nodes,
-                    'instance_type': instance_type,
-                }
-            )
-            with open(cluster_config_fn, 'w') as f:
-                f.write(cluster_config)
-            print('\n>> '.join(cluster_config.split('\n')))
-            y = input('\nEKS cluster will be created with the above YAML configuration. This will take anywhere from 10 minutes to an hour. Proceed? [y|n] ')
-            if y.lower() != 'y':
-                print('Aborting!')
-                sys.exit(1)
-            sh(f'eksctl create cluster -f {cluster_config_fn}')
+        cluster_config = load_template(
+            fn='templates/cluster.yml',
+            args={
+                'name': name,
+                'nodes': nodes,
+                'instance_type': instance_type,
+                'region': region,
+                'node_availability_zone': node_zone,
+                'control_plane_zone': control_plane_zone,
+            }
+        )
+        parse_manifests(cluster_config, source='templates/cluster.yml')
+        print('\n>> '.join(cluster_config.split('\n')))
+        y = input('\nEKS cluster will be created with the above YAML configuration. This will take anywhere from 10 minutes to an hour. Proceed? [y|n] ')
+        if y.lower() != 'y':
+            print('Aborting!')
+            sys.exit(1)
+        sh('eksctl create cluster -f -', input=cluster_config.encode())
+        invalidate_cluster(name, region)
 
         # change the context name so it matches the cluster name
         context_name = get_current_context()
         new_context_name = get_context_name_from_cluster_name(name)
         sh(f'kubectl config rename-context {context_name} {new_context_name}')
 
-    def list(self):
+    def list(
+        self,
+        *,
+        regions: str = DEFAULT_REGION,
+        timeout: int = DEFAULT_TARGET_TIMEOUT,
+    ):
         '''
-        Lists all of the available clusters.
+        Lists all of the available clusters. --regions takes a comma-separated
+        list of regions (or "all"), which are queried concurrently; a region
+        that fails or takes longer than --timeout seconds shows as an error.
         '''
 
-        data = [['NAME', 'CREATED', 'STATUS']]
-        for c in get_clusters():
-            data.append([c.name, humanize_date(c.created_at), c.status])
+        region_names = parse_regions(regions)
+        results = fan_out_with_timeout(
+            lambda region: get_clusters(region=region, timeout=timeout),
+            region_names,
+            timeout=timeout,
+        )
+        data = [['NAME', 'REGION', 'CREATED', 'STATUS']]
+        failed = False
+        for region, (clusters, error) in zip(region_names, results):
+            if error is not None:
+                data.append(['-', region, '-', format_target_error(error)])
+                failed = True
+                continue
+            for c in clusters:
+                data.append([c.name, c.region, humanize_date(c.created_at), c.status])
         print(make_table(data))
+        if failed:
+            sys.exit(1)
 
     def delete(
         self,
         *,
         name: str,
+        region: str = DEFAULT_REGION,
     ):
         '''
         Deletes a cluster.
         '''
 
-        if name not in [c.name for c in get_clusters()]:
-            print(f'Error: No cluster named "{name}"')
+        if name not in [c.name for c in get_clusters(region=region)]:
+            print(f'Error: No cluster named "{name}" in {region}')
             sys.exit(1)
 
-        sh(f'eksctl delete cluster --name {name}')
+        sh(f'eksctl delete cluster --name {name} --region {region}')
+        invalidate_cluster(name, region)
 
     def current(
         self,
@@ -112,23 +162,30 @@ class ClusterCLI(object):
         self,
         *,
         name: str,
+        region: str = DEFAULT_REGION,
     ):
         '''
         Switch to a new cluster.
         '''
 
-        if name not in [c.name for c in get_clusters()]:
-            print(f'Error: No cluster named "{name}"')
+        if name not in [c.name for c in get_clusters(region=region)]:
+            print(f'Error: No cluster named "{name}" in {region}')
             sys.exit(1)
 
+        from kube2.kubeconfig import KubeconfigError, set_current_context
+
         context_name = get_context_name_from_cluster_name(name)
         contexts = get_contexts()
         for c in contexts:
             if c.name == context_name:
                 # cluster is already here, just need to switch to it
-                sh(f'kubectl config use-context {context_name}')
+                try:
+                    set_current_context(context_name)
+                except (KubeconfigError, OSError) as e:
+                    print(f'Error: {e}')
+                    sys.exit(1)
                 return
         # the cluster isn't added yet, we need to add it
-        sh(f'aws eks --region us-east-1 update-kubeconfig --name {name} --alias {context_name}')
+        sh(f'aws eks --region {region} update-kubeconfig --name {name} --alias {context_name}')
         # TODO: update aws-auth ConfigMap
         print('For now, you must manually add your user account to the ConfigMap for this cluster: https://aws.amazon.com/premiumsupport/knowledge-center/eks-cluster-connection/')
@@ -0,0 +1,89 @@
+'''
+Distributing a job's hostfile, hosts list and SSH keypair to every replica.
+
+The files are packed into one tar stream and pushed to all replicas in
+parallel with a single `kubectl exec` each, so launchers can run from any
+rank.
+'''
+
+import io
+import tarfile
+import time
+from typing import Dict, List
+
+from kube2.placement import PlacementError, plan_ranks
+from kube2.remote import DEFAULT_FANOUT, ExecResult, KubectlExec, fan_out
+
+
+# unpack into a private temp dir, then move the files into place
+UNPACK_SCRIPT = (
+    'set -e; d=$(mktemp -d); tar -xf - -C "$d"; '
+    'mkdir -p /job ~/.ssh; '
+    'cp "$d"/hostfile "$d"/hosts /job/; '
+    'install -m 600 "$d"/id_rsa ~/.ssh/id_rsa; '
+    'rm -rf "$d"'
+)
+
+
+class DistributeError(Exception):
+    pass
+
+
+def make_hostfile(pods: List[dict]) -> str:
+    '''
+    One `<ip> slots=<gpus>` line per pod, in rank order (see
+    `kube2.placement.plan_ranks`).
+    '''
+
+    try:
+        ranks = plan_ranks(pods)
+    except PlacementError as e:
+        raise DistributeError(str(e))
+    return ''.join(f'{r.ip} slots={r.slots}\n' for r in ranks)
+
+
+def make_hosts(hostfile: str) -> str:
+    return '\n'.join(line.split(' ')[0] for line in hostfile.splitlines()) + '\n'
+
+
+def pack_files(files: Dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for fn, data in files.items():
+            info = tarfile.TarInfo(fn)
+            info.size = len(data)
+            info.mtime = now
+            info.mode = 0o600 if fn == 'id_rsa' else 0o644
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def distribute_job_files(
+    pods: List[dict],
+    keypair: bytes,
+    *,
+    max_workers: int = DEFAULT_FANOUT,
+    transport=None,
+) -> str:
+    '''
+    Pushes hostfile, hosts and the private key to every pod. Returns the
+    hostfile; raises `DistributeError` listing the pods that failed.
+    '''
+
+    transport = transport or KubectlExec()
+    hostfile = make_hostfile(pods)
+    payload = pack_files({
+        'hostfile': hostfile.encode(),
+        'hosts': make_hosts(hostfile).encode(),
+        'id_rsa': keypair,
+    })
+
+    def push(pod: dict) -> ExecResult:
+        return transport.run(pod['metadata']['name'], ['/bin/bash', '-c', UNPACK_SCRIPT], input=payload)
+
+    failed = [r for r in fan_out(push, pods, max_workers) if r.returncode != 0]
+    if len(failed) > 0:
+        details = '; '.join(f'{r.pod}: {r.stderr.decode(errors="replace").strip()}' for r in failed)
+        raise DistributeError(f'Failed to copy job files to {len(failed)} pod(s): {details}')
+    return hostfile
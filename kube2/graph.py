@@ -0,0 +1,113 @@
+'''
+A small dependency-graph executor for multi-step commands.
+
+Each step names the steps it depends on; a step starts as soon as all of its
+dependencies have finished, so independent steps overlap. Steps may be
+coroutine functions (e.g. built on `sh_async`) or plain functions, which run
+on the default thread pool. Every step receives the dict of results of the
+steps that have completed so far.
+'''
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class Step(object):
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: List[str] = field(default_factory=list)
+
+
+class StepFailed(Exception):
+    def __init__(self, step: str, error: BaseException):
+        super().__init__(f'step "{step}" failed: {error}')
+        self.step = step
+        self.error = error
+
+
+# step name -> (start, end) in seconds since the graph started
+Timings = Dict[str, Tuple[float, float]]
+
+
+def check_graph(steps: List[Step], done: Iterable[str] = ()):
+    names = [s.name for s in steps] + list(done)
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate step names')
+    known = set(done)
+    for s in steps:
+        for d in s.deps:
+            if d not in names:
+                raise ValueError(f'Step "{s.name}" depends on unknown step "{d}"')
+            if d not in known:
+                raise ValueError(f'Step "{s.name}" must be listed after its dependency "{d}"')
+        known.add(s.name)
+
+
+async def run_graph_async(
+    steps: List[Step],
+    initial: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], Timings]:
+    '''
+    Run the steps, returning their results and timings. `initial` holds the
+    results of steps that have already run elsewhere; steps may depend on
+    them by name.
+    '''
+
+    initial = initial or {}
+    check_graph(steps, done=initial.keys())
+    loop = asyncio.get_running_loop()
+    results: Dict[str, Any] = dict(initial)
+    timings: Timings = {}
+    tasks: Dict[str, asyncio.Task] = {}
+    t0 = time.perf_counter()
+
+    async def run(step: Step):
+        pending = [tasks[d] for d in step.deps if d in tasks]
+        if len(pending) > 0:
+            await asyncio.gather(*pending)
+        start = time.perf_counter() - t0
+        try:
+            if asyncio.iscoroutinefunction(step.fn):
+                result = await step.fn(results)
+            else:
+                result = await loop.run_in_executor(None, step.fn, results)
+        except StepFailed:
+            raise
+        except Exception as e:
+            raise StepFailed(step.name, e) from e
+        results[step.name] = result
+        timings[step.name] = (start, time.perf_counter() - t0)
+
+    # steps are listed in dependency order, so dependencies' tasks exist
+    for step in steps:
+        tasks[step.name] = asyncio.ensure_future(run(step))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return results, timings
+
+
+def run_graph(
+    steps: List[Step],
+    initial: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], Timings]:
+    return asyncio.run(run_graph_async(steps, initial))
+
+
+def format_timings(timings: Timings) -> List[List[str]]:
+    '''
+    Rows for `make_table`, in start order.
+    '''
+
+    rows = [['STEP', 'START', 'END', 'DURATION']]
+    for name, (start, end) in sorted(timings.items(), key=lambda e: e[1]):
+        rows.append([name, f'{start:.2f}s', f'{end:.2f}s', f'{end - start:.2f}s'])
+    if len(timings) > 0:
+        rows.append(['total', '', '', f'{max(e for _, e in timings.values()):.2f}s'])
+    return rows
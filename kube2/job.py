@@ -1,19 +1,476 @@
+import asyncio
 from datetime import datetime
 import os
+import queue
 import sys
 import tempfile
+import threading
+import time
 from typing import List
 
 from kube2.utils import (
     check_name,
+    get_cluster_name_from_context_name,
+    get_contexts,
     get_current_cluster,
     get_jobs,
     get_volumes,
+    JobIndex,
     load_template,
     make_table,
+    parse_jobs,
     sh,
-    sh_capture,
+    sh_async,
 )
+from kube2.backend import KubeError, get_backend, make_backend
+from kube2.capacity import CapacityError, CapacityLedger, get_job_shape, get_nodegroup_zone, get_snapshot
+from kube2.distribute import distribute_job_files
+from kube2.graph import Step, StepFailed, format_timings, run_graph, run_graph_async
+from kube2.lifecycle import (
+    DEPLOY_SECRET_LABEL,
+    LifecycleError,
+    delete_secrets,
+    get_orphaned_secrets,
+    resume_job,
+    suspend_job,
+)
+from kube2.logs import DEFAULT_BUFFER_KB, LogsError, make_line_filter, stream_logs
+from kube2.manifest import apply_manifests, make_secret, render_manifests
+from kube2.placement import DEFAULT_PLACEMENT, PlacementError, get_placement_args
+from kube2.prefetch import DEFAULT_PREFETCH_TIMEOUT, JOB_NODEGROUP, PrefetchError, get_pull_policy, prefetch_image
+from kube2.remote import (
+    DEFAULT_FANOUT,
+    DEFAULT_TARGET_TIMEOUT,
+    fan_out,
+    fan_out_with_timeout,
+    format_pod_set,
+    format_target_error,
+    get_job_pods,
+    group_results,
+    run_on_pods,
+)
+from kube2.sync import SyncProgress
+from kube2.transfer import TransferError, download_from_pod, upload_to_pods
+from kube2.types import Job, Volume
+from kube2.wait import WaitTimeout, wait_for_statefulset_ready
+
+
+DEFAULT_DOCKER_IMAGE = 'leogao2/gpt-neox:main'
+
+# how often a queued deploy re-checks whether the job fits, and for how long
+QUEUE_POLL_INTERVAL = 30
+DEFAULT_QUEUE_TIMEOUT = 6 * 60 * 60
+
+
+class DeployError(Exception):
+    pass
+
+
+def check_cluster_selected(results: dict) -> str:
+    cluster_name = get_current_cluster()
+    if cluster_name is None:
+        raise DeployError('First selected a cluster with kube2.py cluster [switch|create]')
+    return cluster_name
+
+
+def get_discovery_steps() -> List[Step]:
+    '''
+    Steps that look at the cluster's current state. Their results are shared
+    by every job deployed in the same invocation.
+    '''
+
+    return [
+        Step('cluster', check_cluster_selected),
+        Step('jobs', lambda results: get_jobs()),
+        Step('volumes', lambda results: get_volumes()),
+    ]
+
+
+def get_capacity_step() -> Step:
+    return Step('capacity', lambda results: CapacityLedger(get_snapshot()))
+
+
+def get_mounts(attach: str, all_volumes: List[Volume]) -> List[dict]:
+    mounts = []
+    attach_list = [x.strip() for x in attach.split(',') if len(x.strip()) > 0]
+    for vol_name in attach_list:
+        if vol_name not in [v.name for v in all_volumes]:
+            raise DeployError(f'No volume with name {vol_name}.')
+        mounts.append({
+            'name': vol_name,
+            'path': f'/mnt/{vol_name}',
+            'pvc_name': f'pvc-{vol_name}',
+        })
+    return mounts
+
+
+def get_deploy_steps(
+    *,
+    name: str,
+    docker_image: str,
+    nodes: int,
+    attach: str,
+    tmpdir: str,
+    timeout: int,
+    fanout: int = DEFAULT_FANOUT,
+    prefetch: bool = False,
+    placement: str = DEFAULT_PLACEMENT,
+    preflight: bool = True,
+    queue: bool = False,
+    queue_timeout: int = DEFAULT_QUEUE_TIMEOUT,
+    shared_capacity: bool = False,
+) -> List[Step]:
+    '''
+    The steps to deploy one job, as a dependency graph. They depend on the
+    "cluster", "jobs" and "volumes" discovery steps. With `prefetch`, the
+    image is pulled on every node (alongside validation and key generation)
+    and the job is rendered with it pinned to the pulled digest. With
+    `preflight`, nothing is applied unless the replicas fit on the cluster
+    right now; with `queue` as well, it waits until they do. With
+    `shared_capacity`, the "capacity" ledger comes from the caller, shared
+    with other deploys, instead of from a snapshot of its own.
+    '''
+
+    date = datetime.now().strftime("%Y-%m-%d-%H-%M")
+    secret_name = f'{name}-{date}'
+    keypair_fn = os.path.join(tmpdir, 'id_rsa')
+    pubkey_fn = os.path.join(tmpdir, 'id_rsa.pub')
+
+    def validate(results):
+        if name in [j.name for j in results['jobs']]:
+            raise DeployError(f'A job already exists with name "{name}".')
+        try:
+            # the zone comes from the cluster's nodes, in the render step
+            placement_args = get_placement_args(placement, None)
+        except PlacementError as e:
+            raise DeployError(str(e))
+        return get_mounts(attach, results['volumes']), placement_args
+
+    def prefetch_step(results):
+        try:
+            return prefetch_image(docker_image, timeout=DEFAULT_PREFETCH_TIMEOUT)
+        except PrefetchError as e:
+            raise DeployError(str(e))
+
+    async def keygen(results):
+        await sh_async(f'ssh-keygen -q -t rsa -f {keypair_fn} -N ""')
+
+    def zone(results):
+        # pin replicas to the node group's zone only when it's in just one,
+        # and not at all if we may not list nodes
+        if preflight:
+            nodes = results['capacity'].base.nodes
+        else:
+            try:
+                nodes = get_backend().list_nodes()
+            except KubeError:
+                return None
+        return get_nodegroup_zone(nodes, JOB_NODEGROUP)
+
+    def render(results):
+        image = results.get('prefetch', docker_image)
+        mounts, placement_args = results['validate']
+        placement_args = dict(placement_args, zone=results['zone'])
+        return render_manifests(
+            fn='templates/statefulset.yml',
+            args={
+                'name': name,
+                'docker_image': image,
+                'image_pull_policy': get_pull_policy(image),
+                'nodes': nodes,
+                'secret_name': secret_name,
+                'mounts': mounts,
+                **placement_args,
+            }
+        )
+
+    def readmit(ledger: CapacityLedger, shape):
+        # queued deploys sharing the ledger share one fresh snapshot per poll
+        ledger.refresh(get_snapshot, max_age=QUEUE_POLL_INTERVAL / 2)
+        return ledger.admit(shape, name)
+
+    async def check_capacity(results):
+        # async so a queued deploy waits on the event loop, not in one of
+        # the executor threads the other deploys of a sweep need
+        loop = asyncio.get_running_loop()
+        ledger = results['capacity']
+        try:
+            shape = get_job_shape(results['render'])
+            report = await loop.run_in_executor(None, ledger.admit, shape, name)
+            deadline = time.monotonic() + queue_timeout
+            last = None
+            while queue and not report.ok and time.monotonic() < deadline:
+                if report.summary() != last:
+                    last = report.summary()
+                    print(f'{name}: queued. {last}', flush=True)
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                report = await loop.run_in_executor(None, readmit, ledger, shape)
+        except (CapacityError, KubeError) as e:
+            raise DeployError(f'Capacity check failed: {e}')
+        if not report.ok:
+            raise DeployError(f'Job "{name}" does not fit on the cluster. {report.summary()}')
+        return report
+
+    def apply(results):
+        # put start script and keys in secret volume, and create it in the
+        # same batch as the pods. The private key is only kept for `job
+        # resume`; the template doesn't mount it. `job gc` finds the secret
+        # by its label.
+        script = load_template(
+            fn='templates/post-start-script.sh',
+            args={}
+        )
+        with open(pubkey_fn, 'rb') as f, open(keypair_fn, 'rb') as g:
+            secret = make_secret(secret_name, {
+                'id_rsa': g.read(),
+                'id_rsa.pub': f.read(),
+                'post_start_script.sh': script.encode(),
+            }, labels={DEPLOY_SECRET_LABEL: name})
+        apply_manifests([secret] + results['render'])
+
+    def ready(results):
+        try:
+            wait_for_statefulset_ready(name, timeout=timeout)
+        except WaitTimeout as e:
+            raise DeployError(f'Job "{name}" did not become ready: {e}')
+
+    def distribute(results):
+        with open(keypair_fn, 'rb') as f:
+            keypair = f.read()
+        return distribute_job_files(get_job_pods(name), keypair, max_workers=fanout)
+
+    steps = [
+        Step('validate', validate, ['cluster', 'jobs', 'volumes']),
+        Step('keygen', keygen),
+    ]
+    if prefetch:
+        steps.append(Step('prefetch', prefetch_step, ['validate']))
+    if preflight and not shared_capacity:
+        steps.append(get_capacity_step())
+    steps.append(Step('zone', zone, ['capacity'] if preflight else []))
+    steps.append(Step('render', render, ['validate', 'zone', 'prefetch'] if prefetch else ['validate', 'zone']))
+    if preflight:
+        steps.append(Step('preflight', check_capacity, ['render', 'capacity']))
+    return steps + [
+        Step('apply', apply, ['cluster', 'keygen', 'render', 'preflight'] if preflight else ['cluster', 'keygen', 'render']),
+        Step('ready', ready, ['apply']),
+        Step('distribute', distribute, ['ready']),
+    ]
+
+
+def load_sweep_spec(fn: str) -> dict:
+    '''
+    Loads a sweep spec: a list of `jobs` (each with a `name` and optionally
+    `docker_image`, `nodes`, `attach` and `placement`), `defaults` applied
+    to every job, and an optional `max_parallel`.
+    '''
+
+    import yaml
+    with open(fn) as f:
+        spec = yaml.safe_load(f) or {}
+    defaults = {'docker_image': DEFAULT_DOCKER_IMAGE, 'nodes': 1, 'attach': '', 'placement': DEFAULT_PLACEMENT}
+    defaults.update(spec.get('defaults') or {})
+    jobs = []
+    for entry in spec.get('jobs') or []:
+        job = dict(defaults)
+        job.update(entry)
+        if 'name' not in job:
+            raise DeployError(f'{fn}: every job needs a name')
+        unknown = set(job.keys()) - {'name', 'docker_image', 'nodes', 'attach', 'placement'}
+        if len(unknown) > 0:
+            raise DeployError(f'{fn}: unknown job fields {", ".join(sorted(unknown))}')
+        jobs.append(job)
+    names = [j['name'] for j in jobs]
+    if len(set(names)) != len(names):
+        raise DeployError(f'{fn}: job names must be unique')
+    return {'jobs': jobs, 'max_parallel': spec.get('max_parallel')}
+
+
+async def deploy_many_async(jobs: List[dict], max_parallel: int, timeout: int) -> List[list]:
+    '''
+    Deploys every job with at most `max_parallel` in flight, after one shared
+    discovery pass. Their capacity checks run one at a time against one
+    shared snapshot, with each admitted job's replicas taken out of it. A
+    failing job doesn't affect the others. Returns summary rows for
+    `make_table`.
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # readiness waits hold a thread each, so size the pool to the fan-out
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * max_parallel + 4))
+
+    # a taken name or unknown volume fails that job's validate step, and
+    # shows up in its row. One capacity snapshot serves the whole sweep.
+    discovery, _ = await run_graph_async(get_discovery_steps() + [get_capacity_step()])
+
+    sem = asyncio.Semaphore(max_parallel)
+
+    async def deploy_one(job: dict) -> list:
+        async with sem:
+            t0 = time.perf_counter()
+            with tempfile.TemporaryDirectory() as tmpdir:
+                steps = get_deploy_steps(
+                    name=job['name'],
+                    docker_image=job['docker_image'],
+                    nodes=job['nodes'],
+                    attach=job['attach'],
+                    tmpdir=tmpdir,
+                    timeout=timeout,
+                    placement=job['placement'],
+                    shared_capacity=True,
+                )
+                try:
+                    await run_graph_async(steps, initial=discovery)
+                    status = 'Deployed'
+                except StepFailed as e:
+                    status = f'Failed at {e.step}: {e.error}'
+            return [job['name'], job['nodes'], f'{time.perf_counter() - t0:.1f}s', status]
+
+    rows = await asyncio.gather(*(deploy_one(job) for job in jobs))
+    return [['NAME', 'NODES', 'TIME', 'STATUS']] + list(rows)
+
+
+JOB_TABLE_HEADER = ['NAME', 'NODES', 'RESTARTS', 'STATUS', 'AGE', 'ATTACHED']
+
+# how often the dashboard re-renders every row, so ages advance for jobs
+# without events
+DASHBOARD_TICK = 1.0
+
+
+def get_job_row(job: Job) -> list:
+    return [job.name, job.nodes, job.restarts, job.status, job.age, ','.join(job.attached_volumes)]
+
+
+def get_all_cluster_job_rows(timeout: float) -> List[list]:
+    '''
+    Job rows, prefixed with the cluster, for every kube2 context in the
+    kubeconfig. Clusters are queried concurrently; one that fails or doesn't
+    answer within `timeout` seconds gets an error row.
+    '''
+
+    contexts = [c.name for c in get_contexts()]
+
+    def list_jobs(context: str) -> List[Job]:
+        return parse_jobs(make_backend(context, timeout=timeout).list_pods())
+
+    rows = [['CLUSTER'] + JOB_TABLE_HEADER]
+    for context, (jobs, error) in zip(contexts, fan_out_with_timeout(list_jobs, contexts, timeout=timeout)):
+        cluster = get_cluster_name_from_context_name(context) or context
+        if error is not None:
+            rows.append([cluster, '-', '-', '-', format_target_error(error), '-', '-'])
+            continue
+        for job in jobs:
+            rows.append([cluster] + get_job_row(job))
+    return rows
+
+
+def watch_pod_events(backend, events: 'queue.Queue', stop: threading.Event):
+    '''
+    Feeds pod watch events into `events`, reconnecting when the stream ends.
+    A `None` item tells the consumer to drop its state, because the next
+    events will be a full relist. An exception item reports why the stream
+    broke; the watcher keeps reconnecting.
+    '''
+
+    resource_version = None
+    backoff = 0.5
+    while not stop.is_set():
+        if resource_version is None:
+            events.put(None)
+        try:
+            for event in backend.watch('pods', resource_version=resource_version, timeout=300):
+                if event['type'] == 'ERROR':
+                    resource_version = None
+                    break
+                backoff = 0.5
+                if event['type'] == 'BOOKMARK':
+                    resource_version = event['object']['metadata']['resourceVersion']
+                    continue
+                if backend.supports_resume:
+                    resource_version = event['object']['metadata'].get('resourceVersion')
+                events.put(event)
+                if stop.is_set():
+                    return
+        except Exception as e:
+            # whatever broke the stream, this thread must keep running or the
+            # dashboard freezes with no sign of why
+            resource_version = None
+            events.put(e)
+        stop.wait(backoff)
+        backoff = min(backoff * 2, 10)
+
+
+def run_job_dashboard(backend=None, refresh: float = 0.5, tick: float = DASHBOARD_TICK, out=sys.stdout):
+    '''
+    Live job table. Pod events update a `JobIndex`; every `refresh` seconds
+    the rows of jobs that changed are re-rendered, and every `tick` seconds
+    all of them, so their ages stay current. Only terminal lines whose text
+    differs are rewritten.
+    '''
+
+    backend = backend or get_backend()
+    index = JobIndex()
+    rows = {}
+    events = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_pod_events, args=(backend, events, stop), daemon=True)
+    thread.start()
+
+    lines = []
+    error = None
+    next_tick = time.monotonic() + tick
+    out.write('\x1b[2J')
+    try:
+        while True:
+            dirty = set()
+            last_error = error
+            deadline = time.monotonic() + refresh
+            while True:
+                try:
+                    event = events.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(event, Exception):
+                    error = event
+                    continue
+                error = None
+                if event is None:
+                    dirty.update(rows.keys())
+                    index.clear()
+                    continue
+                changed = index.apply(event)
+                if changed is not None:
+                    dirty.add(changed)
+            if time.monotonic() >= next_tick:
+                dirty.update(rows.keys())
+                next_tick = time.monotonic() + tick
+            for name in dirty:
+                job = index.get_job(name)
+                if job is None:
+                    rows.pop(name, None)
+                else:
+                    rows[name] = get_job_row(job)
+            if len(dirty) == 0 and error is last_error and len(lines) > 0:
+                continue
+            table = [JOB_TABLE_HEADER] + [rows[k] for k in sorted(rows.keys())]
+            new_lines = make_table(table).split('\n')
+            footer = f'{len(rows)} jobs, {len(index.pods)} pods.'
+            if error is not None:
+                footer += f' Watch failed, reconnecting: {error}'
+            new_lines.append(f'{footer} Ctrl-C to exit.')
+            for i in range(max(len(lines), len(new_lines))):
+                line = new_lines[i] if i < len(new_lines) else ''
+                if i >= len(lines) or lines[i] != line:
+                    out.write(f'\x1b[{i + 1};1H{line}\x1b[K')
+            out.write(f'\x1b[{len(new_lines) + 1};1H')
+            out.flush()
+            lines = new_lines
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
 
 
 class JobCLI(object):
@@ -25,111 +482,349 @@ class JobCLI(object):
         self,
         *,
         name: str,
-        docker_image: str = 'leogao2/gpt-neox:main',
+        docker_image: str = DEFAULT_DOCKER_IMAGE,
         nodes: int = 1,
         attach: str = '',
+        timeout: int = 300,
+        fanout: int = DEFAULT_FANOUT,
+        prefetch: bool = False,
+        placement: str = DEFAULT_PLACEMENT,
+        preflight: bool = True,
+        queue: bool = False,
     ):
         '''
         Deploy a new job (aka, a group of networked pods) to the cluster.
-        '''
-
-        cluster_name = get_current_cluster()
-        if cluster_name is None:
-            print('First selected a cluster with kube2.py cluster [switch|create]')
-            sys.exit(1)
 
-        check_name(name)
-        jobs = get_jobs()
-        if name in [j.name for j in jobs]:
-            print(f'Error: A job already exists with name "{name}".')
-            sys.exit(1)
+        With --prefetch, the image is first pulled on every node and the job
+        is pinned to that digest, so replicas start without pulling.
+        --placement is "exclusive" (one replica per node, the default),
+        "spread" (replicas spread evenly over nodes) or "any".
 
-        # prepare the mounts
-        all_volumes = get_volumes()
-        mounts = []
-        attach_list = [x.strip() for x in attach.split(',') if len(x.strip()) > 0]
-        for vol_name in attach_list:
-            if vol_name not in [v.name for v in all_volumes]:
-                print(f'Error: No volume with name {vol_name}.')
-                sys.exit(1)
-            else:
-                mounts.append({
-                    'name': vol_name,
-                    'path': f'/mnt/{vol_name}',
-                    'pvc_name': f'pvc-{vol_name}',
-                })
+        Before applying anything, deploy checks that the replicas fit on
+        the cluster's free capacity and fails fast if they don't; with
+        --queue it waits until they do. --nopreflight skips the check.
+        '''
 
+        check_name(name)
         with tempfile.TemporaryDirectory() as tmpdir:
-
-            # put start script and keys in secret volume
-            date = datetime.now().strftime("%Y-%m-%d-%H-%M")
-            secret_name = f'{name}-{date}'
-            script = load_template(
-                fn='templates/post-start-script.sh',
-                args={}
-            )
-            keypair_fn = os.path.join(tmpdir, 'id_rsa')
-            pubkey_fn = os.path.join(tmpdir, 'id_rsa.pub')
-            script_fn = os.path.join(tmpdir, 'tmp.sh')
-            sh(f'ssh-keygen -q -t rsa -f {keypair_fn} -N ""')
-            with open(script_fn, 'w') as f:
-                f.write(script)
-            sh(
-                f'kubectl create secret generic {secret_name}'
-                f'    --from-file=id_rsa.pub={pubkey_fn}'
-                f'    --from-file=post_start_script.sh={script_fn}'
+            steps = get_discovery_steps() + get_deploy_steps(
+                name=name,
+                docker_image=docker_image,
+                nodes=nodes,
+                attach=attach,
+                tmpdir=tmpdir,
+                timeout=timeout,
+                fanout=fanout,
+                prefetch=prefetch,
+                placement=placement,
+                preflight=preflight,
+                queue=queue,
             )
+            try:
+                _, timings = run_graph(steps)
+            except StepFailed as e:
+                print(f'Error: {e.error}')
+                sys.exit(1)
+        print(make_table(format_timings(timings)))
 
-            # create the pods
-            ss = load_template(
-                fn='templates/statefulset.yml',
-                args={
-                    'name': name,
-                    'docker_image': docker_image,
-                    'nodes': nodes,
-                    'secret_name': secret_name,
-                    'mounts': mounts,
-                }
-            )
-            ss_fn = os.path.join(tmpdir, 'ss.yml')
-            with open(ss_fn, 'w') as f:
-                f.write(ss)
-            sh(f'kubectl apply -f {f.name}')
+    def deploy_many(
+        self,
+        *,
+        spec: str,
+        max_parallel: int = None,
+        timeout: int = 300,
+    ):
+        '''
+        Deploy a sweep of jobs described in a YAML spec file, several at a time.
+        '''
 
-            # wait for them to be ready
-            sh(f'kubectl rollout status --watch --logtostderr --timeout=300s statefulsets/{name}')
+        try:
+            sweep = load_sweep_spec(spec)
+        except (OSError, DeployError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        for job in sweep['jobs']:
+            check_name(job['name'])
+        if len(sweep['jobs']) == 0:
+            print('No jobs in spec.')
+            return
+        max_parallel = max_parallel or sweep['max_parallel'] or 8
 
-            # generate the hostfile
-            hostfile_fn = os.path.join(tmpdir, 'hostfile')
-            hosts_fn = os.path.join(tmpdir, 'hosts')
-            sh(f'''kubectl get pods -o wide | grep {name} | awk '{{print $6 " slots=8"}}' > {hostfile_fn}''')
-            sh(f"cat {hostfile_fn} | cut -f1 -d' ' > {hosts_fn}")
+        try:
+            table = asyncio.run(deploy_many_async(sweep['jobs'], max_parallel, timeout))
+        except (DeployError, StepFailed) as e:
+            print(f'Error: {getattr(e, "error", e)}')
+            sys.exit(1)
+        print(make_table(table))
+        if any(row[3] != 'Deployed' for row in table[1:]):
+            sys.exit(1)
 
-            # copy them to the node
-            home_dir = sh_capture(f'kubectl exec {name}-0 -- /bin/bash -c "cd ~; pwd; sudo -s"').strip()
-            sh(f'kubectl cp {hostfile_fn} {name}-0:/job')
-            sh(f'kubectl cp {hosts_fn} {name}-0:/job')
-            sh(f'kubectl cp {keypair_fn} {name}-0:{home_dir}/.ssh')
+    def prefetch(
+        self,
+        *,
+        docker_image: str = DEFAULT_DOCKER_IMAGE,
+        timeout: int = DEFAULT_PREFETCH_TIMEOUT,
+    ):
+        '''
+        Pull an image on every node ahead of a deploy, and print its digest.
+        '''
 
-            # TODO: generate SSH credentials and such
+        try:
+            pinned = prefetch_image(docker_image, timeout=timeout)
+        except (PrefetchError, KubeError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        print(f'{docker_image} is on every node.')
+        if pinned != docker_image:
+            print(f'Deploy with --docker-image {pinned} to start without pulling.')
 
     def list(
         self,
+        *,
+        watch: bool = False,
+        all_clusters: bool = False,
+        timeout: int = DEFAULT_TARGET_TIMEOUT,
     ):
         '''
-        List all the running jobs.
+        List all the running jobs. With --watch, keep the table updated live.
+        With --all-clusters, list the jobs on every kube2 cluster in your
+        kubeconfig at once.
         '''
 
-        table = [['NAME', 'NODES', 'RESTARTS', 'STATUS', 'AGE', 'ATTACHED']]
+        if all_clusters:
+            if watch:
+                print('Error: --watch and --all-clusters can\'t be combined.')
+                sys.exit(1)
+            rows = get_all_cluster_job_rows(timeout)
+            print(make_table(rows))
+            if any(row[4].startswith('ERROR') for row in rows[1:]):
+                sys.exit(1)
+            return
+
+        if watch:
+            run_job_dashboard()
+            return
+
+        table = [JOB_TABLE_HEADER]
         jobs = get_jobs()
         if len(jobs) == 0:
             # just show the raw kubectl output (it might actually be an error)
             sh('kubectl get pods')
         else:
             for job in jobs:
-                table.append([job.name, job.nodes, job.restarts, job.status, job.age, ','.join(job.attached_volumes)])
+                table.append(get_job_row(job))
             print(make_table(table))
 
+    def logs(
+        self,
+        *,
+        name: str,
+        follow: bool = False,
+        since: str = None,
+        grep: str = None,
+        ignore_case: bool = False,
+        out_dir: str = None,
+        buffer_kb: int = DEFAULT_BUFFER_KB,
+    ):
+        '''
+        Stream the logs of every replica of a job, merged into one output with
+        each line prefixed by the pod's ordinal. `--since` takes a duration
+        (10m, 1h) or an RFC 3339 time, and `--grep` a regex lines must match.
+        With `--out-dir`, each replica's log goes to its own file instead.
+        '''
+
+        check_name(name)
+        try:
+            match = make_line_filter(grep, ignore_case)
+            pods = [p['metadata']['name'] for p in get_job_pods(name)]
+        except (LogsError, KubeError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        if len(pods) == 0:
+            print(f'Error: No pods found for job "{name}".')
+            sys.exit(1)
+
+        try:
+            results = stream_logs(
+                pods,
+                follow=follow,
+                since=since,
+                match=match,
+                out_dir=out_dir,
+                buffer_kb=buffer_kb,
+            )
+        except KeyboardInterrupt:
+            return
+        if out_dir is not None:
+            for r in results:
+                print(f'{os.path.join(out_dir, r.pod + ".log")}: {r.lines} lines')
+        failed = [r for r in results if r.returncode != 0]
+        for r in failed:
+            print(f'Error: {r.pod}: {r.error or f"exited with {r.returncode}"}', file=sys.stderr)
+        if len(failed) > 0:
+            sys.exit(1)
+
+    def exec(
+        self,
+        *,
+        name: str,
+        cmd: str,
+        fanout: int = DEFAULT_FANOUT,
+        timeout: float = None,
+    ):
+        '''
+        Run a shell command on every replica of a job at once, e.g.
+        `kube2.py job exec --name X -- pip install /data/x.whl`. At most
+        `--fanout` replicas run it at a time. Replicas with the same output
+        and exit status are shown together. Exits non-zero if the command
+        failed on any replica.
+        '''
+
+        check_name(name)
+        try:
+            pods = [p['metadata']['name'] for p in get_job_pods(name)]
+        except KubeError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        if len(pods) == 0:
+            print(f'Error: No pods found for job "{name}".')
+            sys.exit(1)
+
+        results = run_on_pods(pods, ['/bin/sh', '-c', str(cmd)], max_workers=fanout, timeout=timeout)
+        out = sys.stdout.buffer
+        for group, r in group_results(results):
+            header = f'{format_pod_set(group)} (exit {r.returncode})'
+            out.write(f'{"-" * len(header)}\n{header}\n{"-" * len(header)}\n'.encode())
+            for data in (r.stdout, r.stderr):
+                out.write(data if data.endswith(b'\n') or len(data) == 0 else data + b'\n')
+        out.flush()
+        failed = [r.pod for r in results if r.returncode != 0]
+        if len(failed) > 0:
+            print(f'Error: failed on {len(failed)} of {len(results)} replicas: {format_pod_set(failed)}')
+            sys.exit(1)
+
+    def cp(
+        self,
+        *,
+        name: str,
+        src: str,
+        dest: str,
+        download: bool = False,
+        rank: int = None,
+        compress: bool = False,
+        fanout: int = DEFAULT_FANOUT,
+    ):
+        '''
+        Copy a local file or directory's contents into the directory --dest on
+        every replica (or only --rank), or with --download, copy the directory
+        --src from each replica into --dest/<pod> (or from --rank into
+        --dest). Files whose size and mtime match are skipped, so an
+        interrupted copy resumes. --compress gzips the stream.
+        '''
+
+        check_name(name)
+        try:
+            pods = [p['metadata']['name'] for p in get_job_pods(name)]
+        except KubeError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        if rank is not None:
+            pods = [p for p in pods if p == f'{name}-{rank}']
+        if len(pods) == 0:
+            print(f'Error: No pods found for job "{name}"' + (f' with rank {rank}.' if rank is not None else '.'))
+            sys.exit(1)
+
+        if download:
+            progress = SyncProgress()
+
+            def download_one(pod: str):
+                pod_dest = dest if rank is not None else os.path.join(dest, pod)
+                try:
+                    download_from_pod(pod, src, pod_dest, compress=compress, progress=progress)
+                except TransferError as e:
+                    progress.add(error=str(e))
+                except OSError as e:
+                    progress.add(error=f'{pod}: {e}')
+
+            fan_out(download_one, pods, fanout)
+        else:
+            try:
+                progress, _ = upload_to_pods(src, dest, pods, compress=compress, max_workers=fanout)
+            except TransferError as e:
+                print(f'Error: {e}')
+                sys.exit(1)
+        for error in progress.errors[:20]:
+            print(f'Failed: {error}')
+        print(progress.summary())
+        if progress.failed > 0:
+            sys.exit(1)
+
+    def suspend(
+        self,
+        *,
+        name: str,
+    ):
+        '''
+        Scale a job down to zero replicas, keeping its StatefulSet, secret and
+        volume mounts so `job resume` can bring it back quickly.
+        '''
+
+        check_name(name)
+        try:
+            replicas = suspend_job(name)
+        except (LifecycleError, KubeError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        print(f'Suspended "{name}" ({replicas} replicas).')
+
+    def resume(
+        self,
+        *,
+        name: str,
+        timeout: int = 300,
+        fanout: int = DEFAULT_FANOUT,
+    ):
+        '''
+        Scale a suspended job back up and distribute its hostfile again.
+        Reuses the job's keys and secret, so there's no key generation,
+        rendering or apply.
+        '''
+
+        check_name(name)
+        t0 = time.perf_counter()
+        try:
+            resume_job(name, timeout=timeout, max_workers=fanout)
+        except (LifecycleError, KubeError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        print(f'Resumed "{name}" in {time.perf_counter() - t0:.1f}s.')
+
+    def gc(
+        self,
+        *,
+        dry_run: bool = False,
+        legacy: bool = False,
+    ):
+        '''
+        Delete deploy secrets that no job uses any more, e.g. those left by
+        `job kill`. Secrets less than an hour old are kept, since they may
+        belong to a deploy in progress. With --legacy, also delete unlabelled
+        ones left by older versions of kube2: secrets named
+        `{name}-YYYY-MM-DD-HH-MM` holding only `id_rsa.pub` and
+        `post_start_script.sh`, that no pod mounts.
+        '''
+
+        try:
+            names = get_orphaned_secrets(legacy=legacy)
+            for secret_name in names:
+                print(secret_name)
+            if not dry_run:
+                delete_secrets(names)
+        except KubeError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        print(f'{"Would delete" if dry_run else "Deleted"} {len(names)} secrets.')
+
     def kill(
         self,
         *,
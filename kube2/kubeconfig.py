@@ -0,0 +1,175 @@
+'''
+Reading and updating kubeconfig in-process, following kubectl's rules for
+merging the files listed in `KUBECONFIG`.
+
+Each file is parsed once per process and again only when it changes on
+disk, so commands can look up the current context as often as they like
+without starting kubectl.
+'''
+
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+
+class KubeconfigError(Exception):
+    pass
+
+
+# path -> ((inode, mtime, size), parsed file)
+_file_cache: Dict[str, Tuple[tuple, dict]] = {}
+_file_cache_lock = threading.Lock()
+
+
+def get_kubeconfig_paths() -> List[str]:
+    env = os.environ.get('KUBECONFIG')
+    if env:
+        return [p for p in env.split(os.pathsep) if p]
+    return [os.path.join(os.path.expanduser('~'), '.kube', 'config')]
+
+
+def _load_file(fn: str) -> dict:
+    '''
+    The parsed file, or {} if it doesn't exist. Don't modify the result, it's
+    shared with later calls.
+    '''
+
+    try:
+        st = os.stat(fn)
+    except FileNotFoundError:
+        return {}
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _file_cache_lock:
+        cached = _file_cache.get(fn)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(fn) as f:
+            config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) or {}
+    except FileNotFoundError:
+        return {}
+    except yaml.YAMLError as e:
+        raise KubeconfigError(f'Could not parse {fn}: {e}')
+    with _file_cache_lock:
+        _file_cache[fn] = (key, config)
+    return config
+
+
+def load_kubeconfig() -> dict:
+    '''
+    Loads and merges the kubeconfig files. Like kubectl, the first file to
+    define a named cluster, user or context (or current-context) wins.
+    Entries are shared with later calls, so don't modify them.
+    '''
+
+    merged = {'clusters': [], 'users': [], 'contexts': [], 'current-context': None}
+    seen = {'clusters': set(), 'users': set(), 'contexts': set()}
+    for fn in get_kubeconfig_paths():
+        config = _load_file(fn)
+        if merged['current-context'] is None and config.get('current-context'):
+            merged['current-context'] = config['current-context']
+        for key in ('clusters', 'users', 'contexts'):
+            for entry in config.get(key) or []:
+                if entry['name'] not in seen[key]:
+                    seen[key].add(entry['name'])
+                    merged[key].append(entry)
+    return merged
+
+
+def get_current_context_name() -> Optional[str]:
+    return load_kubeconfig()['current-context']
+
+
+def get_context_names() -> List[str]:
+    return [entry['name'] for entry in load_kubeconfig()['contexts']]
+
+
+def get_default_kubeconfig_path() -> str:
+    '''
+    The file kubectl writes changes to: the first one that exists, or the
+    last one listed if none do.
+    '''
+
+    paths = get_kubeconfig_paths()
+    for fn in paths:
+        if os.path.exists(fn):
+            return fn
+    return paths[-1]
+
+
+def set_current_context(context_name: str):
+    '''
+    Makes `context_name` the current context, like `kubectl config
+    use-context`. The file is replaced atomically, so a concurrent reader
+    (or a crash) never sees it half written.
+    '''
+
+    if context_name not in get_context_names():
+        raise KubeconfigError(f'No context named "{context_name}" in kubeconfig')
+    fn = get_default_kubeconfig_path()
+    config = dict(_load_file(fn))
+    config['current-context'] = context_name
+    config.setdefault('apiVersion', 'v1')
+    config.setdefault('kind', 'Config')
+
+    dirname = os.path.dirname(os.path.abspath(fn))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_fn = tempfile.mkstemp(dir=dirname, prefix='.config-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yaml.safe_dump(config, f, default_flow_style=False)
+        # keep the original's permissions; kubeconfig holds credentials
+        os.chmod(tmp_fn, os.stat(fn).st_mode & 0o777 if os.path.exists(fn) else 0o600)
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        os.unlink(tmp_fn)
+        raise
+
+
+def _find(config: dict, key: str, name: str) -> dict:
+    for entry in config[key]:
+        if entry['name'] == name:
+            return entry[key[:-1]] or {}
+    raise KeyError(f'No {key[:-1]} named "{name}" in kubeconfig')
+
+
+def resolve_context(config: dict, context_name: Optional[str] = None):
+    '''
+    Returns (context_name, cluster, user, namespace) for the given context,
+    or for the current context if none is given.
+    '''
+
+    context_name = context_name or config['current-context']
+    if context_name is None:
+        raise KeyError('No current context set in kubeconfig')
+    context = _find(config, 'contexts', context_name)
+    cluster = _find(config, 'clusters', context['cluster'])
+    user = _find(config, 'users', context['user']) if context.get('user') else {}
+    return context_name, cluster, user, context.get('namespace', 'default')
+
+
+# https://XXXX.gr7.us-east-1.eks.amazonaws.com
+EKS_SERVER_RE = re.compile(r'\.([a-z]{2}(?:-[a-z]+)+-\d+)\.eks\.amazonaws\.com')
+
+
+def get_context_region(context_name: Optional[str] = None) -> Optional[str]:
+    '''
+    The AWS region of an EKS context (the current one by default), from its
+    API server address or the `--region` of its `aws eks get-token` plugin.
+    '''
+
+    try:
+        _, cluster, user, _ = resolve_context(load_kubeconfig(), context_name)
+    except (KeyError, KubeconfigError):
+        return None
+    m = EKS_SERVER_RE.search(cluster.get('server') or '')
+    if m is not None:
+        return m.group(1)
+    args = list((user.get('exec') or {}).get('args') or [])
+    if '--region' in args[:-1]:
+        return args[args.index('--region') + 1]
+    return None
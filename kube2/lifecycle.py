@@ -0,0 +1,154 @@
+'''
+Suspending and resuming jobs, and cleaning up what deploys leave behind.
+
+`suspend_job` scales a job's StatefulSet to zero and records the replica
+count in an annotation. The StatefulSet, its secret and its PVC bindings
+all stay, so `resume_job` only scales it back, waits for the pods and
+re-distributes the hostfile with the private key kept in the job's secret.
+No key generation, rendering or apply.
+
+Each deploy creates a `{name}-YYYY-MM-DD-HH-MM` secret, labelled with the
+job's name. `get_orphaned_secrets` finds the labelled ones no StatefulSet
+mounts any more. Deploys before the label created the same secrets without
+it; those are only considered with `legacy=True`, and only when their name
+and keys are exactly what those deploys made and no pod mounts them, since
+nothing else tells them apart from the user's own secrets.
+'''
+
+import base64
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from kube2.backend import get_backend
+from kube2.distribute import DistributeError, distribute_job_files
+from kube2.remote import DEFAULT_FANOUT, get_job_pods
+from kube2.wait import WaitTimeout, wait_for_statefulset_ready
+
+
+SUSPENDED_REPLICAS_ANNOTATION = 'kube2/suspended-replicas'
+
+# on every deploy secret, with the job's name as its value
+DEPLOY_SECRET_LABEL = 'kube2/job'
+
+# what deploys made before secrets were labelled: the name, and exactly
+# these keys, from `kubectl create secret generic --from-file`
+LEGACY_SECRET_NAME_RE = re.compile(r'^.+-[0-9]{4}-[0-9]{2}-[0-9]{2}-[0-9]{2}-[0-9]{2}$')
+LEGACY_SECRET_KEYS = {'id_rsa.pub', 'post_start_script.sh'}
+
+# secrets deleted per kubectl call
+GC_BATCH_SIZE = 50
+
+# a deploy creates its secret just before its StatefulSet, so a secret this
+# new may belong to a deploy still in flight
+GC_MIN_AGE = timedelta(hours=1)
+
+
+class LifecycleError(Exception):
+    pass
+
+
+def get_job_secret_name(statefulset: dict) -> Optional[str]:
+    for volume in statefulset['spec']['template']['spec'].get('volumes') or []:
+        if volume['name'] == 'secret-volume':
+            return volume['secret']['secretName']
+    return None
+
+
+def suspend_job(name: str, backend=None) -> int:
+    '''
+    Scales the job to zero, returning how many replicas it had.
+    '''
+
+    backend = backend or get_backend()
+    ss = backend.get_statefulset(name)
+    annotations = ss['metadata'].get('annotations') or {}
+    replicas = ss['spec'].get('replicas', 1)
+    if replicas == 0:
+        if SUSPENDED_REPLICAS_ANNOTATION in annotations:
+            raise LifecycleError(f'Job "{name}" is already suspended.')
+        raise LifecycleError(f'Job "{name}" has no replicas to suspend.')
+    # one merge patch, so the count is never lost between two updates
+    backend.patch('statefulsets', name, {
+        'metadata': {'annotations': {SUSPENDED_REPLICAS_ANNOTATION: str(replicas)}},
+        'spec': {'replicas': 0},
+    })
+    return replicas
+
+
+def resume_job(name: str, *, timeout: float, max_workers: int = DEFAULT_FANOUT, backend=None) -> str:
+    '''
+    Scales a suspended job back up, waits for its pods and distributes the
+    hostfile and keys again. Returns the hostfile.
+    '''
+
+    backend = backend or get_backend()
+    ss = backend.get_statefulset(name)
+    annotations = ss['metadata'].get('annotations') or {}
+    if SUSPENDED_REPLICAS_ANNOTATION not in annotations:
+        raise LifecycleError(f'Job "{name}" is not suspended.')
+    replicas = int(annotations[SUSPENDED_REPLICAS_ANNOTATION])
+
+    # check for the key first, so a job that can't be resumed stays suspended
+    secret_name = get_job_secret_name(ss)
+    secret = backend.get_secret(secret_name) if secret_name is not None else {}
+    keypair = (secret.get('data') or {}).get('id_rsa')
+    if keypair is None:
+        raise LifecycleError(f'Job "{name}" was deployed without its key in a secret; kill and deploy it again.')
+
+    backend.patch('statefulsets', name, {
+        'metadata': {'annotations': {SUSPENDED_REPLICAS_ANNOTATION: None}},
+        'spec': {'replicas': replicas},
+    })
+    try:
+        wait_for_statefulset_ready(name, timeout=timeout, backend=backend)
+        return distribute_job_files(get_job_pods(name, backend), base64.b64decode(keypair), max_workers=max_workers)
+    except WaitTimeout as e:
+        raise LifecycleError(f'Job "{name}" did not become ready: {e}')
+    except DistributeError as e:
+        raise LifecycleError(str(e))
+
+
+def is_legacy_deploy_secret(secret: dict) -> bool:
+    return (
+        DEPLOY_SECRET_LABEL not in (secret['metadata'].get('labels') or {})
+        and LEGACY_SECRET_NAME_RE.match(secret['metadata']['name']) is not None
+        and set(secret.get('data') or {}) == LEGACY_SECRET_KEYS
+    )
+
+
+def get_orphaned_secrets(backend=None, min_age: timedelta = GC_MIN_AGE, legacy: bool = False) -> List[str]:
+    '''
+    Deploy secrets older than `min_age` that no StatefulSet mounts. Suspended
+    jobs still mount theirs. Only secrets with `DEPLOY_SECRET_LABEL` count,
+    and with `legacy`, unlabelled ones from older deploys that no pod mounts
+    either.
+    '''
+
+    backend = backend or get_backend()
+    in_use = {get_job_secret_name(ss) for ss in backend.list_statefulsets()}
+    if legacy:
+        secrets = [
+            secret for secret in backend.list_secrets()
+            if DEPLOY_SECRET_LABEL in (secret['metadata'].get('labels') or {}) or is_legacy_deploy_secret(secret)
+        ]
+        for pod in backend.list_pods():
+            for volume in pod['spec'].get('volumes') or []:
+                if 'secret' in volume:
+                    in_use.add(volume['secret']['secretName'])
+    else:
+        secrets = backend.list_secrets(label_selector=DEPLOY_SECRET_LABEL)
+    cutoff = datetime.now(timezone.utc) - min_age
+    orphans = []
+    for secret in secrets:
+        name = secret['metadata']['name']
+        created = datetime.strptime(secret['metadata']['creationTimestamp'], '%Y-%m-%dT%H:%M:%SZ')
+        if name not in in_use and created.replace(tzinfo=timezone.utc) < cutoff:
+            orphans.append(name)
+    return sorted(orphans)
+
+
+def delete_secrets(names: List[str], backend=None, batch_size: int = GC_BATCH_SIZE):
+    backend = backend or get_backend()
+    for i in range(0, len(names), batch_size):
+        backend.delete('secrets', *names[i:i + batch_size])
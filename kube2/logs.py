@@ -0,0 +1,259 @@
+'''
+Streaming the logs of every replica of a job at once.
+
+One reader thread per pod reads its `kubectl logs` stream and hands the
+complete lines of each read, as one batch of bytes, to a single writer. The
+writer prefixes every line with the pod's ordinal and writes batches in the
+order they arrived. Lines are only split and decoded when there's a filter,
+and then by the reader as they stream in, so merging costs little per line
+and adds no latency when following.
+
+Each stream may have at most `buffer_kb` of batches waiting for the writer.
+Past that its reader blocks and the pipe pushes back on kubectl, so a noisy
+rank is slowed down instead of growing memory or crowding out the others.
+With an output directory, each reader writes its own file instead and
+nothing is merged. Each stream's stderr is drained by a thread of its own,
+keeping only its tail, so a chatty stderr can't fill its pipe and stall the
+stream.
+'''
+
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional
+
+from kube2.binaries import ensure_binary
+
+
+# per stream
+DEFAULT_BUFFER_KB = 1024
+
+# the most one read takes from a stream, and so about the largest batch
+READ_BYTES = 64 * 1024
+
+# longer lines are split, so one runaway line can't take unbounded memory
+MAX_LINE_BYTES = 64 * 1024
+
+# the most batches the writer combines into one write
+WRITE_BATCHES = 64
+
+# how much of the end of each stream's stderr is kept for its error
+STDERR_TAIL_BYTES = 16 * 1024
+
+DURATION_RE = re.compile(r'^([0-9]+(h|m|s|ms))+$')
+
+_DONE = object()
+
+
+class LogsError(Exception):
+    pass
+
+
+@dataclass
+class StreamResult(object):
+    pod: str
+    # lines that passed the filter
+    lines: int
+    returncode: int
+    error: str
+
+
+class KubectlLogs(object):
+    '''
+    Log source that runs `kubectl logs`. Anything with the same `open` method
+    returning a Popen-like object (`stdout` with `read1`, `stderr`, `wait`,
+    `terminate`) can stand in for it.
+    '''
+
+    def __init__(self, context: Optional[str] = None):
+        self.context = context
+
+    def argv(self, pod: str, follow: bool, since: Optional[str]) -> List[str]:
+        argv = ['kubectl']
+        if self.context is not None:
+            argv += ['--context', self.context]
+        argv += ['logs', pod]
+        if follow:
+            argv += ['--follow']
+        if since is not None:
+            # a duration (10m, 1h30m) or an RFC 3339 time
+            argv += [f'--since={since}' if DURATION_RE.match(since) else f'--since-time={since}']
+        return argv
+
+    def open(self, pod: str, *, follow: bool = False, since: Optional[str] = None) -> subprocess.Popen:
+        ensure_binary('kubectl')
+        return subprocess.Popen(
+            self.argv(pod, follow, since),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+
+def make_line_filter(grep: Optional[str], ignore_case: bool = False) -> Optional[Callable[[str], bool]]:
+    '''
+    A predicate for lines matching the regex `grep`, or None to keep all.
+    '''
+
+    if grep is None:
+        return None
+    try:
+        pattern = re.compile(grep, re.IGNORECASE if ignore_case else 0)
+    except re.error as e:
+        raise LogsError(f'Invalid --grep pattern "{grep}": {e}')
+    return lambda line: pattern.search(line) is not None
+
+
+def read_batches(stream, read_bytes: int = READ_BYTES, max_line_bytes: int = MAX_LINE_BYTES) -> Iterator[bytes]:
+    '''
+    Yields the complete, newline-terminated lines of each read from a binary
+    stream. A trailing partial line is held for the next read, unless it's
+    over `max_line_bytes`.
+    '''
+
+    partial = b''
+    while True:
+        data = stream.read1(read_bytes)
+        if not data:
+            break
+        data = partial + data
+        end = data.rfind(b'\n') + 1
+        if end == 0 and len(data) > max_line_bytes:
+            data += b'\n'
+            end = len(data)
+        partial = data[end:]
+        if end > 0:
+            yield data[:end]
+    if partial:
+        yield partial + b'\n'
+
+
+def read_tail(stream, limit: int = STDERR_TAIL_BYTES) -> bytes:
+    '''
+    Reads a binary stream to the end, returning its last `limit` bytes.
+    '''
+
+    tail = b''
+    while True:
+        data = stream.read1(READ_BYTES)
+        if not data:
+            return tail
+        tail = (tail + data)[-limit:]
+
+
+def filter_batch(batch: bytes, match: Callable[[str], bool]) -> bytes:
+    lines = batch.split(b'\n')[:-1]
+    return b''.join(line + b'\n' for line in lines if match(line.decode('utf-8', errors='replace')))
+
+
+def prefix_batch(batch: bytes, prefix: bytes) -> bytes:
+    return prefix + batch[:-1].replace(b'\n', b'\n' + prefix) + b'\n'
+
+
+def get_stream_label(pod: str) -> str:
+    # the StatefulSet ordinal, or the whole name for anything else
+    name, _, ordinal = pod.rpartition('-')
+    return ordinal if name and ordinal.isdigit() else pod
+
+
+def stream_logs(
+    pods: List[str],
+    *,
+    source=None,
+    follow: bool = False,
+    since: Optional[str] = None,
+    match: Optional[Callable[[str], bool]] = None,
+    out_dir: Optional[str] = None,
+    out=None,
+    buffer_kb: int = DEFAULT_BUFFER_KB,
+) -> List[StreamResult]:
+    '''
+    Streams the logs of `pods` concurrently, writing lines that pass `match`
+    to the binary stream `out` (stdout by default) as `[ordinal] line`, or
+    to `out_dir/<pod>.log`. Returns when every stream has ended; on
+    KeyboardInterrupt, stops the streams and re-raises.
+    '''
+
+    source = source or KubectlLogs()
+    out = out or sys.stdout.buffer
+    labels = [get_stream_label(pod) for pod in pods]
+    width = max([len(label) for label in labels] + [0])
+    prefixes = [f'[{label:>{width}}] '.encode() for label in labels]
+    batches: 'queue.Queue' = queue.Queue()
+    slots = [threading.BoundedSemaphore(max(1, buffer_kb * 1024 // READ_BYTES)) for _ in pods]
+    procs = [None] * len(pods)
+    results = [StreamResult(pod, 0, 0, '') for pod in pods]
+    stop = threading.Event()
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    def read(i: int):
+        result = results[i]
+        f = None
+        try:
+            proc = procs[i] = source.open(pods[i], follow=follow, since=since)
+            stderr = []
+            drain = threading.Thread(target=lambda: stderr.append(read_tail(proc.stderr)), daemon=True)
+            drain.start()
+            if out_dir is not None:
+                f = open(os.path.join(out_dir, f'{pods[i]}.log'), 'wb')
+            for batch in read_batches(proc.stdout):
+                if match is not None:
+                    batch = filter_batch(batch, match)
+                    if len(batch) == 0:
+                        continue
+                result.lines += batch.count(b'\n')
+                if f is not None:
+                    f.write(batch)
+                    continue
+                while not slots[i].acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                batches.put((i, batch))
+            drain.join()
+            result.error = b''.join(stderr).decode(errors='replace').strip()
+            result.returncode = proc.wait()
+        except Exception as e:
+            result.returncode = 1
+            result.error = str(e)
+        finally:
+            if f is not None:
+                f.close()
+            batches.put((i, _DONE))
+
+    threads = [threading.Thread(target=read, args=(i,), daemon=True) for i in range(len(pods))]
+    for t in threads:
+        t.start()
+    try:
+        remaining = len(pods)
+        while remaining > 0:
+            ready = [batches.get()]
+            while len(ready) < WRITE_BATCHES:
+                try:
+                    ready.append(batches.get_nowait())
+                except queue.Empty:
+                    break
+            chunk = []
+            for i, batch in ready:
+                if batch is _DONE:
+                    remaining -= 1
+                else:
+                    chunk.append(prefix_batch(batch, prefixes[i]))
+            if len(chunk) > 0:
+                out.write(b''.join(chunk))
+                out.flush()
+            # only once written, so batches being written count against the buffers too
+            for i, batch in ready:
+                if batch is not _DONE:
+                    slots[i].release()
+    except KeyboardInterrupt:
+        stop.set()
+        for proc in procs:
+            if proc is not None:
+                proc.terminate()
+        raise
+    return results
@@ -0,0 +1,98 @@
+'''
+Rendering and applying Kubernetes manifests.
+
+Templates in kube2/templates are rendered with a single process-wide jinja2
+environment whose compiled bytecode is cached in ~/.cache/kube2/jinja, parsed
+back into objects to validate them, and handed to the backend in one batch
+(`kubectl apply -f -` or server-side apply), without temp files.
+'''
+
+import base64
+import json
+import os
+from typing import Dict, List, Optional
+
+from kube2.backend import get_backend
+from kube2.cache import CACHE_DIR
+from kube2.trace import span
+
+
+class ManifestError(Exception):
+    pass
+
+
+_environment = None
+
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        import jinja2
+        bytecode_dir = os.path.join(CACHE_DIR, 'jinja')
+        os.makedirs(bytecode_dir, exist_ok=True)
+        _environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(searchpath=os.path.dirname(__file__)),
+            undefined=jinja2.StrictUndefined,
+            bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
+            auto_reload=False,
+        )
+    return _environment
+
+
+def render_text(fn: str, args: dict) -> str:
+    with span(fn, 'template', args=args):
+        return get_environment().get_template(fn).render(**args)
+
+
+def parse_manifests(text: str, source: str = '<manifest>') -> List[dict]:
+    '''
+    Parse a multi-document YAML string, checking every document looks like a
+    Kubernetes-style object.
+    '''
+
+    import yaml
+    try:
+        docs = [d for d in yaml.load_all(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) if d]
+    except yaml.YAMLError as e:
+        raise ManifestError(f'{source}: invalid YAML: {e}')
+    for i, doc in enumerate(docs):
+        if not isinstance(doc, dict):
+            raise ManifestError(f'{source}: document {i} is not a mapping')
+        for field in ('apiVersion', 'kind'):
+            if field not in doc:
+                raise ManifestError(f'{source}: document {i} has no {field}')
+        if not doc.get('metadata', {}).get('name'):
+            raise ManifestError(f'{source}: document {i} ({doc["kind"]}) has no metadata.name')
+    return docs
+
+
+def render_manifests(fn: str, args: dict) -> List[dict]:
+    return parse_manifests(render_text(fn, args), source=fn)
+
+
+def make_secret(name: str, files: Dict[str, bytes], labels: Optional[Dict[str, str]] = None) -> dict:
+    metadata = {'name': name}
+    if labels:
+        metadata['labels'] = dict(labels)
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'type': 'Opaque',
+        'metadata': metadata,
+        'data': {k: base64.b64encode(v).decode() for k, v in files.items()},
+    }
+
+
+def to_json_list(docs: List[dict]) -> bytes:
+    '''
+    Serializes objects as JSON for `kubectl apply -f -`: the object itself,
+    or a `List` wrapping several.
+    '''
+
+    if len(docs) == 1:
+        return json.dumps(docs[0]).encode()
+    return json.dumps({'apiVersion': 'v1', 'kind': 'List', 'items': docs}).encode()
+
+
+def apply_manifests(docs: List[dict], backend=None):
+    (backend or get_backend()).apply(docs)
@@ -0,0 +1,95 @@
+'''
+Placement of a job's replicas on nodes, and the rank order of the hostfile.
+
+Deploys render the StatefulSet with one of three placement policies:
+
+    exclusive  at most one replica per node (required pod anti-affinity)
+    spread     replicas may share nodes, but are spread evenly across them
+    any        no constraint beyond the resource requests
+
+and, for all of them, pinned to the node group's availability zone (where
+the EFA-enabled nodes are) when its nodes are all in one zone.
+
+Once the pods are running, `plan_ranks` orders them for MPI/DeepSpeed:
+replicas on the same node get consecutive ranks, nodes are ordered by the
+lowest StatefulSet ordinal they host, and each host's slots come from the
+pod's actual `nvidia.com/gpu` request instead of a fixed 8.
+'''
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from kube2.types import Rank
+from kube2.utils import get_pod_ordinal
+
+
+PLACEMENTS = ('exclusive', 'spread', 'any')
+DEFAULT_PLACEMENT = 'exclusive'
+
+GPU_RESOURCE = 'nvidia.com/gpu'
+
+
+class PlacementError(Exception):
+    pass
+
+
+def get_placement_args(placement: str, zone: Optional[str]) -> dict:
+    '''
+    Template arguments for templates/statefulset.yml.
+    '''
+
+    if placement not in PLACEMENTS:
+        raise PlacementError(f'Unknown placement "{placement}"; expected one of {", ".join(PLACEMENTS)}')
+    return {
+        'anti_affinity': placement == 'exclusive',
+        'topology_spread': placement == 'spread',
+        'zone': zone,
+    }
+
+
+def get_gpu_request(pod: dict) -> int:
+    '''
+    GPUs requested by the pod's containers (extended resources can't be
+    overcommitted, so a limit implies an equal request).
+    '''
+
+    total = 0
+    for container in pod.get('spec', {}).get('containers', []):
+        resources = container.get('resources') or {}
+        value = (resources.get('requests') or {}).get(GPU_RESOURCE)
+        if value is None:
+            value = (resources.get('limits') or {}).get(GPU_RESOURCE)
+        if value is not None:
+            total += int(value)
+    return total
+
+
+def plan_ranks(pods: List[dict], default_slots: int = 1) -> List[Rank]:
+    '''
+    Orders a job's running pods into MPI ranks. Pods without GPUs get
+    `default_slots` slots. Raises `PlacementError` if a pod isn't scheduled
+    or has no IP yet.
+    '''
+
+    by_node: Dict[str, List[dict]] = OrderedDict()
+    for pod in sorted(pods, key=get_pod_ordinal):
+        name = pod['metadata']['name']
+        node = pod.get('spec', {}).get('nodeName')
+        if not node:
+            raise PlacementError(f'Pod {name} is not scheduled on a node yet')
+        if not pod.get('status', {}).get('podIP'):
+            raise PlacementError(f'Pod {name} has no IP yet')
+        by_node.setdefault(node, []).append(pod)
+
+    ranks = []
+    for node, node_pods in by_node.items():
+        for pod in node_pods:
+            ranks.append(Rank(
+                rank=len(ranks),
+                pod=pod['metadata']['name'],
+                ip=pod['status']['podIP'],
+                node=node,
+                slots=get_gpu_request(pod) or default_slots,
+            ))
+    return ranks
+
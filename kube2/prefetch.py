@@ -0,0 +1,133 @@
+'''
+Warming a job's Docker image on the nodes before its pods need it.
+
+`prefetch_image` runs a short-lived DaemonSet on the job node group whose
+init container uses the image, so every node pulls it in parallel, and whose
+main container just pauses. Once all of its pods are ready the image is on
+every node. The digest the nodes resolved is read back from the pods, so a
+deploy can pin it and use `imagePullPolicy: IfNotPresent` instead of pulling
+again.
+'''
+
+import hashlib
+import secrets
+from collections import Counter
+from typing import List, Optional
+
+from kube2.backend import get_backend
+from kube2.manifest import apply_manifests, render_manifests
+from kube2.wait import WaitTimeout, wait_for_daemonset_ready
+
+
+# the managed node group jobs run on (see templates/cluster.yml)
+JOB_NODEGROUP = 'cluster'
+
+# multi-GB CUDA images can take a while to pull
+DEFAULT_PREFETCH_TIMEOUT = 1800
+
+
+class PrefetchError(Exception):
+    pass
+
+
+def is_pinned(docker_image: str) -> bool:
+    return '@sha256:' in docker_image
+
+
+def get_pull_policy(docker_image: str) -> str:
+    '''
+    A digest always names the same image, so a node that has it never needs
+    to pull again; a tag may have moved since the node pulled it.
+    '''
+
+    return 'IfNotPresent' if is_pinned(docker_image) else 'Always'
+
+
+def pin_image(docker_image: str, digest: str) -> str:
+    '''
+    `repo:tag` -> `repo@digest`.
+    '''
+
+    repo = docker_image.split('@')[0]
+    if ':' in repo.rsplit('/', 1)[-1]:
+        repo = repo.rsplit(':', 1)[0]
+    return f'{repo}@{digest}'
+
+
+def get_prefetch_name(docker_image: str) -> str:
+    # a suffix per call, so concurrent prefetches of one image each get (and
+    # delete) their own DaemonSet; the nodes still only pull the image once
+    image_hash = hashlib.sha1(docker_image.encode()).hexdigest()[:10]
+    return f'prefetch-{image_hash}-{secrets.token_hex(3)}'
+
+
+def get_image_digest(pods: List[dict]) -> Optional[str]:
+    '''
+    The `sha256:...` digest the prefetch pods' init containers ran, or None
+    if no pod reports one. Raises `PrefetchError` if nodes disagree, which
+    means the tag moved while it was being pulled.
+    '''
+
+    digests = Counter()
+    for pod in pods:
+        for status in pod.get('status', {}).get('initContainerStatuses') or []:
+            image_id = status.get('imageID') or ''
+            if '@sha256:' in image_id:
+                digests[image_id.rsplit('@', 1)[1]] += 1
+    if len(digests) == 0:
+        return None
+    if len(digests) > 1:
+        raise PrefetchError(f'Nodes pulled different digests ({", ".join(digests)}); the tag changed during prefetch, retry')
+    return next(iter(digests))
+
+
+def get_pull_errors(pods: List[dict]) -> List[str]:
+    errors = []
+    for pod in pods:
+        for status in pod.get('status', {}).get('initContainerStatuses') or []:
+            waiting = status.get('state', {}).get('waiting')
+            if waiting is not None and waiting.get('reason') not in (None, 'PodInitializing'):
+                node = pod.get('spec', {}).get('nodeName', pod['metadata']['name'])
+                errors.append(f'{node}: {waiting["reason"]} {waiting.get("message", "")}'.strip())
+    return errors
+
+
+def prefetch_image(
+    docker_image: str,
+    *,
+    timeout: float = DEFAULT_PREFETCH_TIMEOUT,
+    nodegroup: str = JOB_NODEGROUP,
+    backend=None,
+) -> str:
+    '''
+    Pulls `docker_image` on every node of `nodegroup` and returns it pinned to
+    the digest the nodes resolved. The DaemonSet is deleted afterwards, even
+    if the pull fails.
+    '''
+
+    backend = backend or get_backend()
+    name = get_prefetch_name(docker_image)
+    docs = render_manifests(
+        fn='templates/prefetch.yml',
+        args={
+            'name': name,
+            'docker_image': docker_image,
+            'image_pull_policy': get_pull_policy(docker_image),
+            'nodegroup': nodegroup,
+        }
+    )
+    apply_manifests(docs, backend)
+    try:
+        try:
+            ds = wait_for_daemonset_ready(name, timeout=timeout, backend=backend)
+        except WaitTimeout as e:
+            errors = get_pull_errors(backend.list_pods(label_selector=f'app={name}'))
+            raise PrefetchError(f'Prefetching {docker_image} did not finish: {e}' + ''.join(f'\n  {x}' for x in errors))
+        if ds.get('status', {}).get('desiredNumberScheduled', 0) == 0:
+            raise PrefetchError(f'No nodes in node group "{nodegroup}" to prefetch {docker_image} on')
+        digest = get_image_digest(backend.list_pods(label_selector=f'app={name}'))
+    finally:
+        backend.delete('daemonsets', name)
+    if digest is None:
+        return docker_image
+    return pin_image(docker_image, digest)
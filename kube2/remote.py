@@ -0,0 +1,207 @@
+'''
+Running commands inside a job's pods, and fanning them out across replicas.
+'''
+
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from kube2.backend import get_backend
+from kube2.binaries import ensure_binary
+from kube2.trace import span
+from kube2.utils import get_pod_ordinal
+
+
+# default cap on concurrent kubectl exec sessions per command
+DEFAULT_FANOUT = 16
+
+# default time allowed per cluster or region in multi-target queries
+DEFAULT_TARGET_TIMEOUT = 20
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+@dataclass
+class ExecResult(object):
+    pod: str
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+class KubectlExec(object):
+    '''
+    Transport that runs commands in pods with `kubectl exec`. Anything with
+    the same `run`/`popen` methods can stand in for it.
+    '''
+
+    def __init__(self, context: Optional[str] = None):
+        self.context = context
+
+    def argv(self, pod: str, command: List[str], stdin: bool) -> List[str]:
+        argv = ['kubectl']
+        if self.context is not None:
+            argv += ['--context', self.context]
+        argv += ['exec']
+        if stdin:
+            argv += ['-i']
+        return argv + [pod, '--'] + command
+
+    def run(
+        self,
+        pod: str,
+        command: List[str],
+        input: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+    ) -> ExecResult:
+        ensure_binary('kubectl')
+        with span('kubectl exec', 'subprocess', pod=pod, command=command) as s:
+            try:
+                proc = subprocess.run(
+                    self.argv(pod, command, stdin=input is not None),
+                    input=input,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    timeout=timeout,
+                )
+            except subprocess.TimeoutExpired as e:
+                s.set(status=124)
+                return ExecResult(pod, 124, e.stdout or b'', (e.stderr or b'') + b'timed out\n')
+            s.set(status=proc.returncode)
+        return ExecResult(pod, proc.returncode, proc.stdout, proc.stderr)
+
+    def popen(self, pod: str, command: List[str], stdin: bool = False) -> subprocess.Popen:
+        ensure_binary('kubectl')
+        return subprocess.Popen(
+            self.argv(pod, command, stdin=stdin),
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+
+def fan_out(fn: Callable[[T], R], items: Iterable[T], max_workers: int = DEFAULT_FANOUT) -> List[R]:
+    '''
+    Apply `fn` to every item with at most `max_workers` running at once,
+    returning the results in the order of `items`.
+    '''
+
+    items = list(items)
+    if len(items) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        return list(pool.map(fn, items))
+
+
+def fan_out_with_timeout(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    timeout: float,
+    max_workers: int = DEFAULT_FANOUT,
+) -> List[Tuple[Optional[R], Optional[BaseException]]]:
+    '''
+    Like `fan_out`, but returns after at most `timeout` seconds and never
+    raises: each item gets `(result, None)` or `(None, error)`, and items
+    still running at the deadline get a `TimeoutError`. Their threads are
+    abandoned rather than killed, so `fn` should bound its own I/O as well.
+    '''
+
+    items = list(items)
+    if len(items) == 0:
+        return []
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        futures = [pool.submit(fn, item) for item in items]
+        done, _ = wait(futures, timeout=timeout)
+        results = []
+        for f in futures:
+            if f not in done:
+                results.append((None, TimeoutError(f'timed out after {timeout}s')))
+            elif f.exception() is not None:
+                results.append((None, f.exception()))
+            else:
+                results.append((f.result(), None))
+        return results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_on_pods(
+    pods: List[str],
+    command: List[str],
+    *,
+    max_workers: int = DEFAULT_FANOUT,
+    timeout: Optional[float] = None,
+    transport=None,
+) -> List[ExecResult]:
+    '''
+    Runs `command` in every pod, at most `max_workers` at once, returning
+    the results in the order of `pods`. Never raises for a failed pod; a
+    transport error becomes that pod's result, with exit status 255.
+    '''
+
+    transport = transport or KubectlExec()
+
+    def run(pod: str) -> ExecResult:
+        try:
+            return transport.run(pod, command, timeout=timeout)
+        except Exception as e:
+            return ExecResult(pod, 255, b'', f'{e}\n'.encode())
+
+    return fan_out(run, pods, max_workers)
+
+
+def group_results(results: List[ExecResult]) -> List[Tuple[List[str], ExecResult]]:
+    '''
+    Groups the pods whose command exited the same way with the same output,
+    ordered by each group's first pod, like `dshbak -c`.
+    '''
+
+    groups: Dict[Tuple[int, bytes, bytes], List[str]] = OrderedDict()
+    first: Dict[Tuple[int, bytes, bytes], ExecResult] = {}
+    for r in results:
+        key = (r.returncode, r.stdout, r.stderr)
+        groups.setdefault(key, []).append(r.pod)
+        first.setdefault(key, r)
+    return [(pods, first[key]) for key, pods in groups.items()]
+
+
+def format_pod_set(pods: List[str]) -> str:
+    '''
+    `job-0 job-1 job-2 job-5` -> `job-[0-2,5]`; pods of different jobs are
+    listed one by one.
+    '''
+
+    names = {pod.rpartition('-')[0] for pod in pods}
+    ordinals = [pod.rpartition('-')[2] for pod in pods]
+    if len(names) != 1 or '' in names or not all(o.isdigit() for o in ordinals):
+        return ','.join(pods)
+    ranges = []
+    for n in sorted(int(o) for o in ordinals):
+        if len(ranges) > 0 and ranges[-1][1] == n - 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    spans = [str(a) if a == b else f'{a}-{b}' for a, b in ranges]
+    return f'{names.pop()}-[{",".join(spans)}]'
+
+
+def format_target_error(error: BaseException) -> str:
+    '''
+    A one-line STATUS cell for a cluster or region that failed.
+    '''
+
+    message = str(error).strip().split('\n')[0][:80]
+    return f'ERROR: {message or type(error).__name__}'
+
+
+def get_job_pods(name: str, backend=None) -> List[dict]:
+    '''
+    The pods of a job, selected by its `app` label, ordered by rank.
+    '''
+
+    pods = (backend or get_backend()).list_pods(label_selector=f'app={name}')
+    return sorted(pods, key=get_pod_ordinal)
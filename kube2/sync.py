@@ -0,0 +1,372 @@
+'''
+Syncing a local directory with a volume's S3 prefix, s3://kube2-volumes/<name>/,
+which FSx imports from when the volume is created with `--s3`.
+
+Files go through one shared boto3 transfer manager, so the parts of big
+multipart files and whole small files share a single concurrency limit and
+a fixed memory budget. The source is walked lazily and only a bounded number
+of files are in flight at once, so syncing millions of files doesn't queue
+them all up front.
+
+Uploads keep a manifest of content hashes in the bucket (under
+.kube2-manifests/, outside every volume's prefix). A file whose size and
+mtime match the manifest is skipped without being read. A file that was
+touched but whose SHA-256 is unchanged is skipped without being uploaded.
+Downloads keep a local manifest of ETags in the kube2 cache.
+'''
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Tuple
+
+from kube2.aws_utils import aws_client
+from kube2.cache import CACHE_DIR
+
+
+VOLUME_BUCKET = os.environ.get('KUBE2_VOLUME_BUCKET', 'kube2-volumes')
+MANIFEST_PREFIX = '.kube2-manifests/'
+
+DEFAULT_SYNC_JOBS = 16
+DEFAULT_MEMORY_MB = 1024
+
+# multipart part size bounds (S3's minimum part size is 5 MiB)
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class SyncError(Exception):
+    pass
+
+
+def get_volume_prefix(name: str) -> str:
+    return f'{name}/'
+
+
+def get_manifest_key(name: str) -> str:
+    return f'{MANIFEST_PREFIX}{name}.json'
+
+
+def get_s3_client(region: str):
+    # KUBE2_S3_ENDPOINT_URL points sync at a local S3 stand-in (moto, minio)
+    endpoint = os.environ.get('KUBE2_S3_ENDPOINT_URL')
+    kwargs = {'endpoint_url': endpoint} if endpoint else {}
+    return aws_client('s3', region_name=region, **kwargs)
+
+
+def make_transfer_config(jobs: int, memory_mb: int):
+    '''
+    A transfer config whose buffered chunks and I/O queue stay within about
+    `memory_mb` in total, however many files are in flight.
+    '''
+
+    from boto3.s3.transfer import TransferConfig
+
+    budget = memory_mb * 1024 * 1024
+    chunk_size = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, budget // (2 * jobs)))
+    config = TransferConfig(
+        multipart_threshold=chunk_size,
+        multipart_chunksize=chunk_size,
+        max_concurrency=jobs,
+    )
+    # half the budget for part buffers, half for queued download writes
+    config.max_in_memory_upload_chunks = max(2, budget // (2 * chunk_size))
+    config.max_in_memory_download_chunks = max(2, budget // (2 * chunk_size))
+    config.max_io_queue = max(16, (budget // 2) // config.io_chunksize)
+    return config
+
+
+def walk_files(root: str) -> Iterator[Tuple[str, os.stat_result]]:
+    '''
+    Yields (relative posix path, stat) for every regular file under `root`,
+    one directory at a time. Symlinked directories aren't followed.
+    '''
+
+    stack = ['']
+    while len(stack) > 0:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            rel = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(rel)
+            elif entry.is_file():
+                yield rel, entry.stat()
+
+
+def file_sha256(fn: str) -> str:
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def write_json_atomic(fn: str, data):
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, fn)
+
+
+def load_remote_manifest(client, bucket: str, name: str) -> Dict[str, dict]:
+    from botocore.exceptions import ClientError
+    try:
+        response = client.get_object(Bucket=bucket, Key=get_manifest_key(name))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return {}
+        raise
+    return json.loads(response['Body'].read())
+
+
+def save_remote_manifest(client, bucket: str, name: str, manifest: Dict[str, dict]):
+    client.put_object(
+        Bucket=bucket,
+        Key=get_manifest_key(name),
+        Body=json.dumps(manifest).encode(),
+        ContentType='application/json',
+    )
+
+
+def merge_manifests(old: Dict[str, dict], new: Dict[str, dict], failed: set, completed: bool) -> Dict[str, dict]:
+    '''
+    The manifest to save after a sync. A completed sync saw every file, so
+    its entries replace the old ones (dropping deleted files). An interrupted
+    one keeps the old entries it didn't reach, so the next run doesn't redo
+    them. Failed files are always dropped, so they're retried.
+    '''
+
+    if completed:
+        merged = dict(new)
+    else:
+        merged = dict(old)
+        merged.update(new)
+    for rel in failed:
+        merged.pop(rel, None)
+    return merged
+
+
+def get_local_manifest_path(bucket: str, name: str, dest: str) -> str:
+    key = hashlib.sha1(f'{bucket}/{name}:{os.path.abspath(dest)}'.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, 'sync', f'{name}-{key}.json')
+
+
+class SyncProgress(object):
+    '''
+    Thread-safe counters, printed as a one-line summary at most every
+    `interval` seconds.
+    '''
+
+    def __init__(self, out=sys.stdout, interval: float = 2.0):
+        self.out = out
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.t0 = time.monotonic()
+        self.last_print = self.t0
+        self.transferred = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.errors = []
+
+    def add(self, *, transferred: int = 0, skipped: int = 0, nbytes: int = 0, error: str = None):
+        with self.lock:
+            self.transferred += transferred
+            self.skipped += skipped
+            self.bytes += nbytes
+            if error is not None:
+                self.failed += 1
+                self.errors.append(error)
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.t0, 1e-6)
+        mb = self.bytes / 1e6
+        return (
+            f'{self.transferred} transferred, {self.skipped} unchanged, {self.failed} failed; '
+            f'{mb:.1f} MB in {elapsed:.1f}s ({mb / elapsed:.1f} MB/s)'
+        )
+
+    def maybe_print(self):
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            print(self.summary(), file=self.out, flush=True)
+
+
+def run_bounded(tasks: Iterator, fn, jobs: int, progress: SyncProgress):
+    '''
+    Calls `fn(*task)` for every task on `jobs` threads, keeping at most a few
+    tasks per thread queued so `tasks` is consumed lazily.
+    '''
+
+    slots = threading.BoundedSemaphore(jobs * 4)
+
+    def run(task):
+        try:
+            fn(*task)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for task in tasks:
+            while not slots.acquire(timeout=progress.interval):
+                progress.maybe_print()
+            pool.submit(run, task)
+            progress.maybe_print()
+
+
+def upload_dir(
+    src: str,
+    name: str,
+    *,
+    region: str,
+    bucket: str = VOLUME_BUCKET,
+    jobs: int = DEFAULT_SYNC_JOBS,
+    memory_mb: int = DEFAULT_MEMORY_MB,
+    out=sys.stdout,
+) -> SyncProgress:
+    '''
+    Uploads new and changed files under `src` to the volume's prefix. Files
+    that fail are left out of the manifest, so the next sync retries them.
+    '''
+
+    from boto3.s3.transfer import create_transfer_manager
+
+    if not os.path.isdir(src):
+        raise SyncError(f'{src} is not a directory')
+    client = get_s3_client(region)
+    manifest = load_remote_manifest(client, bucket, name)
+    new_manifest: Dict[str, dict] = {}
+    failed = set()
+    lock = threading.Lock()
+    progress = SyncProgress(out)
+    prefix = get_volume_prefix(name)
+    manager = create_transfer_manager(client, make_transfer_config(jobs, memory_mb))
+
+    def sync_one(rel: str, st: os.stat_result):
+        path = os.path.join(src, rel)
+        old = manifest.get(rel)
+        try:
+            if old is not None and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+                entry = old
+                progress.add(skipped=1)
+            else:
+                entry = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': file_sha256(path)}
+                if old is not None and old['sha256'] == entry['sha256']:
+                    progress.add(skipped=1)
+                else:
+                    manager.upload(
+                        path,
+                        bucket,
+                        prefix + rel,
+                        extra_args={'Metadata': {'sha256': entry['sha256']}},
+                    ).result()
+                    progress.add(transferred=1, nbytes=st.st_size)
+        except Exception as e:
+            progress.add(error=f'{rel}: {e}')
+            with lock:
+                failed.add(rel)
+            return
+        with lock:
+            new_manifest[rel] = entry
+
+    completed = False
+    try:
+        with manager:
+            run_bounded(walk_files(src), sync_one, jobs, progress)
+        completed = True
+    finally:
+        save_remote_manifest(client, bucket, name, merge_manifests(manifest, new_manifest, failed, completed))
+    return progress
+
+
+def download_dir(
+    dest: str,
+    name: str,
+    *,
+    region: str,
+    bucket: str = VOLUME_BUCKET,
+    jobs: int = DEFAULT_SYNC_JOBS,
+    memory_mb: int = DEFAULT_MEMORY_MB,
+    out=sys.stdout,
+) -> SyncProgress:
+    '''
+    Downloads the volume's prefix into `dest`, skipping files whose ETag,
+    size and mtime match what the last download left there.
+    '''
+
+    from boto3.s3.transfer import create_transfer_manager
+
+    client = get_s3_client(region)
+    manifest_fn = get_local_manifest_path(bucket, name, dest)
+    manifest: Dict[str, dict] = {}
+    if os.path.exists(manifest_fn):
+        with open(manifest_fn) as f:
+            manifest = json.load(f)
+    new_manifest: Dict[str, dict] = {}
+    failed = set()
+    lock = threading.Lock()
+    progress = SyncProgress(out)
+    prefix = get_volume_prefix(name)
+    root = os.path.abspath(dest)
+    manager = create_transfer_manager(client, make_transfer_config(jobs, memory_mb))
+
+    def list_objects() -> Iterator[Tuple[dict]]:
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents') or []:
+                if not obj['Key'].endswith('/'):
+                    yield (obj,)
+
+    def sync_one(obj: dict):
+        rel = obj['Key'][len(prefix):]
+        path = os.path.abspath(os.path.join(root, rel))
+        old = manifest.get(rel)
+        try:
+            if not path.startswith(root + os.sep):
+                raise SyncError('key escapes the destination directory')
+            st = os.stat(path) if os.path.exists(path) else None
+            if (
+                old is not None and st is not None
+                and old['etag'] == obj['ETag']
+                and old['size'] == st.st_size
+                and old['mtime'] == st.st_mtime_ns
+            ):
+                entry = old
+                progress.add(skipped=1)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                manager.download(bucket, obj['Key'], path).result()
+                st = os.stat(path)
+                entry = {'etag': obj['ETag'], 'size': st.st_size, 'mtime': st.st_mtime_ns}
+                progress.add(transferred=1, nbytes=st.st_size)
+        except Exception as e:
+            progress.add(error=f'{rel}: {e}')
+            with lock:
+                failed.add(rel)
+            return
+        with lock:
+            new_manifest[rel] = entry
+
+    os.makedirs(root, exist_ok=True)
+    completed = False
+    try:
+        with manager:
+            run_bounded(list_objects(), sync_one, jobs, progress)
+        completed = True
+    finally:
+        write_json_atomic(manifest_fn, merge_manifests(manifest, new_manifest, failed, completed))
+    return progress
@@ -0,0 +1,236 @@
+'''
+Tracing of the slow things kube2 does: shell commands, kubectl and API server
+calls, AWS calls and template rendering.
+
+Tracing is off unless `--trace FILE` or `--timings` is given. While it is off
+`span()` hands back a shared no-op object and AWS clients get no event hooks,
+so instrumented code pays for little more than an attribute check. When it is
+on, every span is recorded as a Chrome trace event (load the file in
+chrome://tracing or https://ui.perfetto.dev) and/or summarized in a table on
+exit. Arguments are redacted before they are recorded.
+'''
+
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, List, Optional
+
+
+# dict keys whose values are never recorded
+SECRET_KEY_WORDS = ('token', 'password', 'secret', 'credential', 'authorization', 'private')
+
+# longest string argument kept in a trace
+MAX_ARG_LENGTH = 500
+
+_SECRET_PATTERNS = [
+    # --token=abc, --password abc, --aws-secret-access-key abc
+    (re.compile(r'(--?[\w-]*(?:token|password|secret)[\w-]*[= ])(\S+)', re.I), r'\1<redacted>'),
+    # Authorization: Bearer abc
+    (re.compile(r'(bearer\s+)\S+', re.I), r'\1<redacted>'),
+    # AWS access key ids
+    (re.compile(r'\b(?:AKIA|ASIA)[0-9A-Z]{16}\b'), '<redacted>'),
+]
+
+
+def redact(value: Any) -> Any:
+    '''
+    A JSON-serializable copy of `value` with anything that looks like a
+    credential replaced, long strings truncated and bytes reduced to their
+    length.
+    '''
+
+    if isinstance(value, str):
+        for pattern, replacement in _SECRET_PATTERNS:
+            value = pattern.sub(replacement, value)
+        if len(value) > MAX_ARG_LENGTH:
+            value = value[:MAX_ARG_LENGTH] + '...'
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, dict):
+        return {
+            str(k): '<redacted>' if any(w in str(k).lower() for w in SECRET_KEY_WORDS) else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return redact(repr(value))
+
+
+def _track() -> int:
+    '''
+    The trace "thread" for the current span: the asyncio task if there is
+    one, so overlapping `sh_async` commands get their own rows, otherwise
+    the OS thread.
+    '''
+
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is not None:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return id(task)
+    return threading.get_ident()
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and 'status' not in self.args:
+            self.args['error'] = f'{exc_type.__name__}: {exc}'
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+    def set(self, **args):
+        '''
+        Attach more arguments (e.g. `status=`) once they are known.
+        '''
+
+        self.args.update(args)
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.events: List[dict] = []
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+
+    def record(self, name: str, category: str, start: float, end: float, args: dict, track: Optional[int] = None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.t0) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': track if track is not None else _track(),
+            'args': redact(args),
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self, fn: str):
+        with self.lock:
+            events = list(self.events)
+        with open(fn, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary_rows(self) -> List[List[str]]:
+        '''
+        Rows for `make_table`: calls and time per category and name, slowest
+        first.
+        '''
+
+        totals = defaultdict(lambda: [0, 0.0, 0.0])
+        with self.lock:
+            for e in self.events:
+                t = totals[(e['cat'], e['name'])]
+                t[0] += 1
+                t[1] += e['dur'] / 1e6
+                t[2] = max(t[2], e['dur'] / 1e6)
+        rows = [['CATEGORY', 'NAME', 'CALLS', 'TOTAL', 'MAX']]
+        for (category, name), (calls, total, longest) in sorted(totals.items(), key=lambda e: -e[1][1]):
+            rows.append([category, name, str(calls), f'{total:.3f}s', f'{longest:.3f}s'])
+        return rows
+
+    def print_timings(self, out=sys.stderr):
+        from kube2.utils import make_table
+        print(make_table(self.summary_rows()), file=out)
+
+
+tracer = Tracer()
+
+
+def span(name: str, category: str, **args):
+    '''
+    Context manager timing the enclosed block as one trace event:
+
+        with span('kubectl', 'subprocess', cmd=cmd) as s:
+            proc = subprocess.run(...)
+            s.set(status=proc.returncode)
+    '''
+
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return Span(tracer, name, category, args)
+
+
+def configure_tracing(*, trace_file: Optional[str] = None, timings: bool = False):
+    if trace_file is None and not timings:
+        return
+    tracer.enabled = True
+    if trace_file is not None:
+        atexit.register(tracer.write, trace_file)
+    if timings:
+        atexit.register(tracer.print_timings)
+
+
+# botocore event hooks: the start time and operation are kept in the
+# per-request context dict that botocore passes to every handler
+
+def _before_aws_call(params, model, context, **kwargs):
+    context['kube2_trace'] = (
+        f'{model.service_model.service_name}.{model.name}',
+        params,
+        time.perf_counter(),
+    )
+
+
+def _after_aws_call(http_response, context, **kwargs):
+    if 'kube2_trace' in context:
+        name, params, start = context.pop('kube2_trace')
+        args = {'params': params, 'status': http_response.status_code}
+        tracer.record(name, 'aws', start, time.perf_counter(), args)
+
+
+def _after_aws_call_error(exception, context, **kwargs):
+    if 'kube2_trace' in context:
+        name, params, start = context.pop('kube2_trace')
+        args = {'params': params, 'error': f'{type(exception).__name__}: {exception}'}
+        tracer.record(name, 'aws', start, time.perf_counter(), args)
+
+
+def trace_aws_client(client):
+    '''
+    Record every call made through a boto3 client.
+    '''
+
+    events = client.meta.events
+    events.register('before-parameter-build', _before_aws_call)
+    events.register('after-call', _after_aws_call)
+    events.register('after-call-error', _after_aws_call_error)
+    return client
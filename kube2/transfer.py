@@ -0,0 +1,292 @@
+'''
+Copying directories between the local machine and a job's replicas.
+
+Files move as a tar stream through `kubectl exec`, optionally gzipped, and
+are never staged locally. Before copying, each side's files are listed
+(`find` in the pod, a directory walk locally) and only files whose size or
+mtime differ are sent. tar restores mtimes on extraction, so a copy that
+was interrupted resumes where it stopped. The pods that need the same
+files share one tar stream, which is built and compressed once and written
+to all of their `tar -x` processes at the same time.
+'''
+
+import gzip
+import os
+import shlex
+import sys
+import tarfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from kube2.remote import DEFAULT_FANOUT, KubectlExec, fan_out_with_timeout
+from kube2.sync import SyncProgress
+
+
+# fast, since the bottleneck is usually the exec stream, not the CPU
+GZIP_LEVEL = 1
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# for listing the files already in a pod
+LIST_TIMEOUT = 120
+
+# size and whole-second mtime, since that's what survives a tar round trip
+FileInfo = Tuple[int, int]
+
+
+class TransferError(Exception):
+    pass
+
+
+def get_local_files(path: str) -> Dict[str, FileInfo]:
+    '''
+    Regular files under `path` (or `path` itself, if it's a file), by posix
+    path relative to it.
+    '''
+
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return {os.path.basename(path): (st.st_size, int(st.st_mtime))}
+    files = {}
+    for root, dirs, fns in os.walk(path):
+        dirs.sort()
+        for fn in sorted(fns):
+            full = os.path.join(root, fn)
+            if os.path.isfile(full) and not os.path.islink(full):
+                st = os.stat(full)
+                rel = os.path.relpath(full, path).replace(os.sep, '/')
+                files[rel] = (st.st_size, int(st.st_mtime))
+    return files
+
+
+def parse_find_output(output: bytes) -> Dict[str, FileInfo]:
+    '''
+    Parses `find -printf '%P\\0%s\\0%T@\\0'`.
+    '''
+
+    fields = output.split(b'\0')
+    files = {}
+    for i in range(0, len(fields) - 2, 3):
+        rel = fields[i].decode('utf-8', errors='surrogateescape')
+        files[rel] = (int(fields[i + 1]), int(float(fields[i + 2])))
+    return files
+
+
+def get_remote_files(pod: str, path: str, transport, missing_ok: bool = False) -> Dict[str, FileInfo]:
+    '''
+    Regular files under `path` in `pod`. A missing `path` is an error unless
+    `missing_ok`, when it has no files (an upload destination that nothing
+    has been copied to yet).
+    '''
+
+    script = f'find {shlex.quote(path)} -type f -printf "%P\\0%s\\0%T@\\0"'
+    if missing_ok:
+        script = f'[ ! -e {shlex.quote(path)} ] || {script}'
+    r = transport.run(pod, ['/bin/sh', '-c', script], timeout=LIST_TIMEOUT)
+    if r.returncode != 0:
+        raise TransferError(f'{pod}: {r.stderr.decode(errors="replace").strip()}')
+    return parse_find_output(r.stdout)
+
+
+def get_changed(src: Dict[str, FileInfo], dest: Dict[str, FileInfo]) -> List[str]:
+    return [rel for rel, info in src.items() if dest.get(rel) != info]
+
+
+class Tee(object):
+    '''
+    A write-only file object that copies every write to several pods' tar
+    processes. A pod whose process goes away is dropped, and the rest carry on.
+    '''
+
+    def __init__(self, procs: Dict[str, object], progress: SyncProgress):
+        self.procs = dict(procs)
+        self.progress = progress
+        self.failed: Dict[str, str] = {}
+
+    def write(self, data: bytes) -> int:
+        for pod, proc in list(self.procs.items()):
+            try:
+                proc.stdin.write(data)
+            except (BrokenPipeError, OSError) as e:
+                self.failed[pod] = f'stream closed: {e}'
+                del self.procs[pod]
+        if len(self.procs) == 0:
+            raise TransferError('every destination pod closed its stream')
+        self.progress.maybe_print()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class CountingReader(object):
+    '''
+    Reads a local file, counting the bytes delivered to each destination.
+    '''
+
+    def __init__(self, f, progress: SyncProgress, copies: int):
+        self.f = f
+        self.progress = progress
+        self.copies = copies
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.progress.add(nbytes=len(data) * self.copies)
+        return data
+
+
+def write_tar(out, src: str, rels: List[str], compress: bool, progress: SyncProgress, copies: int):
+    fileobj = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) if compress else out
+    base = src if os.path.isdir(src) else os.path.dirname(src)
+    with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT, bufsize=COPY_BLOCK_SIZE) as tar:
+        for rel in rels:
+            path = os.path.join(base, *rel.split('/'))
+            info = tar.gettarinfo(path, arcname=rel)
+            with open(path, 'rb') as f:
+                tar.addfile(info, CountingReader(f, progress, copies))
+            progress.add(transferred=copies)
+    if compress:
+        fileobj.close()
+
+
+def upload_to_pods(
+    src: str,
+    dest: str,
+    pods: List[str],
+    *,
+    compress: bool = False,
+    max_workers: int = DEFAULT_FANOUT,
+    transport=None,
+    out=sys.stdout,
+) -> Tuple[SyncProgress, Dict[str, str]]:
+    '''
+    Copies `src` (a file, or a directory's contents) into the directory `dest`
+    in every pod, skipping files whose size and mtime already match. Returns
+    the progress counters and an error message per pod that failed.
+    '''
+
+    transport = transport or KubectlExec()
+    if not os.path.exists(src):
+        raise TransferError(f'{src} does not exist')
+    local = get_local_files(src)
+    progress = SyncProgress(out)
+    errors: Dict[str, str] = {}
+
+    # group the pods that need exactly the same files
+    groups: Dict[Tuple[str, ...], List[str]] = OrderedDict()
+    listings = fan_out_with_timeout(
+        lambda pod: get_remote_files(pod, dest, transport, missing_ok=True),
+        pods,
+        LIST_TIMEOUT,
+        max_workers,
+    )
+    for pod, (remote, error) in zip(pods, listings):
+        if error is not None:
+            errors[pod] = str(error)
+            continue
+        changed = tuple(get_changed(local, remote))
+        progress.add(skipped=len(local) - len(changed))
+        if len(changed) > 0:
+            groups.setdefault(changed, []).append(pod)
+
+    untar = f'mkdir -p {shlex.quote(dest)} && tar -x{"z" if compress else ""}f - -C {shlex.quote(dest)}'
+    for rels, group in groups.items():
+        for i in range(0, len(group), max(1, max_workers)):
+            batch = group[i:i + max(1, max_workers)]
+            procs = {pod: transport.popen(pod, ['/bin/sh', '-c', untar], stdin=True) for pod in batch}
+            tee = Tee(procs, progress)
+            write_error = None
+            try:
+                write_tar(tee, src, list(rels), compress, progress, len(batch))
+            except (TransferError, OSError) as e:
+                write_error = str(e)
+            finally:
+                for proc in procs.values():
+                    try:
+                        proc.stdin.close()
+                    except (BrokenPipeError, OSError):
+                        pass
+            for pod, proc in procs.items():
+                stderr = proc.stderr.read()
+                if proc.wait() != 0 or pod in tee.failed or write_error is not None:
+                    errors[pod] = (
+                        tee.failed.get(pod) or write_error
+                        or stderr.decode(errors='replace').strip() or 'tar failed'
+                    )
+    for pod in errors:
+        progress.add(error=f'{pod}: {errors[pod]}')
+    return progress, errors
+
+
+def download_from_pod(
+    pod: str,
+    src: str,
+    dest: str,
+    *,
+    compress: bool = False,
+    transport=None,
+    progress: Optional[SyncProgress] = None,
+) -> SyncProgress:
+    '''
+    Copies the directory `src` in `pod` into the local directory `dest`,
+    skipping files whose size and mtime already match. Raises
+    `TransferError` if `src` doesn't exist in the pod.
+    '''
+
+    transport = transport or KubectlExec()
+    progress = progress or SyncProgress()
+    remote = get_remote_files(pod, src, transport)
+    local = get_local_files(dest) if os.path.isdir(dest) else {}
+    changed = get_changed(remote, local)
+    progress.add(skipped=len(remote) - len(changed))
+    if len(changed) == 0:
+        return progress
+
+    os.makedirs(dest, exist_ok=True)
+    compression = f'--use-compress-program="gzip -{GZIP_LEVEL}" ' if compress else ''
+    script = f'cd {shlex.quote(src)} && tar --null -T - {compression}-cf -'
+    proc = transport.popen(pod, ['/bin/sh', '-c', script], stdin=True)
+
+    def send_names():
+        try:
+            proc.stdin.write(b''.join(rel.encode('utf-8', errors='surrogateescape') + b'\0' for rel in changed))
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    # written from a thread, so a long list can't fill the pipe while tar's
+    # output isn't being read
+    sender = threading.Thread(target=send_names, daemon=True)
+    sender.start()
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode='r|gz' if compress else 'r|') as tar:
+            for member in tar:
+                extract_member(tar, member, dest)
+                if member.isfile():
+                    progress.add(transferred=1, nbytes=member.size)
+                progress.maybe_print()
+    except tarfile.TarError as e:
+        proc.kill()
+        stderr = proc.stderr.read().decode(errors='replace').strip()
+        raise TransferError(f'{pod}: {stderr or e}')
+    finally:
+        sender.join()
+    stderr = proc.stderr.read()
+    if proc.wait() != 0:
+        raise TransferError(f'{pod}: {stderr.decode(errors="replace").strip() or "tar failed"}')
+    return progress
+
+
+def extract_member(tar: tarfile.TarFile, member: tarfile.TarInfo, dest: str):
+    if hasattr(tarfile, 'data_filter'):
+        tar.extract(member, dest, filter='data')
+        return
+    # older Pythons: refuse anything that would land outside dest
+    root = os.path.abspath(dest)
+    path = os.path.abspath(os.path.join(root, member.name))
+    if not path.startswith(root + os.sep) or not (member.isfile() or member.isdir()):
+        raise TransferError(f'refusing to extract {member.name}')
+    tar.extract(member, dest)
+
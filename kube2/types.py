@@ -8,6 +8,7 @@ class Cluster(object):
     name: str
     created_at: datetime
     status: str
+    region: str
 
 
 @dataclass
@@ -32,3 +33,12 @@ class Job(object):
     status: str
     age: str
     attached_volumes: List[str]
+
+
+@dataclass
+class Rank(object):
+    rank: int
+    pod: str
+    ip: str
+    node: str
+    slots: int
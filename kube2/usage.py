@@ -0,0 +1,120 @@
+'''
+Collecting used/free bytes for PVCs from the kubelet stats summary.
+
+Rather than exec'ing `df` once per volume, each node that has a pod mounting
+one of the volumes is asked once for `/stats/summary`, which reports usage
+for every PVC mounted on it. Nodes are queried in parallel with a per-node
+timeout; volumes we can't get numbers for are reported as unknown.
+Results are cached briefly so repeated listings don't hit every kubelet.
+'''
+
+from typing import Dict, List, Optional, Set
+
+from kube2.backend import KubeError, get_backend
+from kube2.cache import cache
+from kube2.remote import fan_out
+from kube2.utils import get_current_context
+
+
+USAGE_TTL = 30
+NODE_TIMEOUT = 5.0
+
+
+def format_bytes(n: float) -> str:
+    if n < 1024:
+        return f'{int(n)}B'
+    for unit in ['Ki', 'Mi', 'Gi', 'Ti', 'Pi']:
+        n /= 1024
+        if n < 1024 or unit == 'Pi':
+            return f'{n:.1f}{unit}'
+
+
+def format_usage(usage: Optional[dict]) -> str:
+    if usage is None:
+        return 'unknown'
+    used, available = usage['used'], usage['available']
+    total = used + available
+    pct = f' ({100 * used / total:.0f}%)' if total > 0 else ''
+    return f'{format_bytes(used)} used, {format_bytes(available)} free{pct}'
+
+
+def get_nodes_by_pvc(pods: List[dict], pvc_names: Set[str]) -> Dict[str, Set[str]]:
+    nodes: Dict[str, Set[str]] = {}
+    for pod in pods:
+        node = pod['spec'].get('nodeName')
+        if node is None or pod['status'].get('phase') != 'Running':
+            continue
+        for v in pod['spec'].get('volumes', []):
+            claim = v.get('persistentVolumeClaim')
+            if claim is not None and claim['claimName'] in pvc_names:
+                nodes.setdefault(claim['claimName'], set()).add(node)
+    return nodes
+
+
+def parse_stats_summary(summary: dict) -> Dict[str, dict]:
+    usage = {}
+    for pod in summary.get('pods', []):
+        for v in pod.get('volume', []):
+            ref = v.get('pvcRef')
+            if ref is not None and 'usedBytes' in v and 'availableBytes' in v:
+                usage[ref['name']] = {'used': v['usedBytes'], 'available': v['availableBytes']}
+    return usage
+
+
+def get_pvc_usage(
+    pvc_names: List[str],
+    backend=None,
+    timeout: float = NODE_TIMEOUT,
+    context: Optional[str] = None,
+) -> Dict[str, Optional[dict]]:
+    '''
+    Maps each PVC name to {'used': bytes, 'available': bytes}, or None if
+    it isn't mounted anywhere or its node didn't answer in time. Cached
+    results are per `context` (the current one by default), since PVC names
+    repeat across clusters.
+    '''
+
+    backend = backend or get_backend()
+    context = context if context is not None else get_current_context()
+    result: Dict[str, Optional[dict]] = {}
+    missing = []
+    for name in pvc_names:
+        usage = cache.get(f'usage:{context}:{name}')
+        if usage is not None:
+            result[name] = usage
+        else:
+            missing.append(name)
+    if len(missing) == 0:
+        return result
+
+    try:
+        pods = backend.list_pods()
+    except KubeError:
+        pods = []
+    nodes_by_pvc = get_nodes_by_pvc(pods, set(missing))
+    # one node per volume is enough; prefer nodes that serve several volumes
+    counts: Dict[str, int] = {}
+    for nodes in nodes_by_pvc.values():
+        for node in nodes:
+            counts[node] = counts.get(node, 0) + 1
+    chosen = set()
+    for nodes in nodes_by_pvc.values():
+        if len(nodes & chosen) == 0:
+            chosen.add(max(nodes, key=lambda n: (counts[n], n)))
+
+    def query(node: str) -> Dict[str, dict]:
+        try:
+            return parse_stats_summary(
+                backend.get_raw(f'/api/v1/nodes/{node}/proxy/stats/summary', timeout=timeout)
+            )
+        except (KubeError, OSError, ValueError):
+            return {}
+
+    collected: Dict[str, dict] = {}
+    for usage in fan_out(query, sorted(chosen)):
+        collected.update(usage)
+    for name in missing:
+        result[name] = collected.get(name)
+        if result[name] is not None:
+            cache.set(f'usage:{context}:{name}', result[name], USAGE_TTL)
+    return result
@@ -1,44 +1,75 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
 from typing import List, Optional
-import jinja2
-import os
 import subprocess
 import sys
-import arrow
-from terminaltables import AsciiTable
-import boto3
-from kube2.aws_utils import get_clusters
-import json
+from kube2.aws_utils import DEFAULT_REGION, get_cluster_names, invalidate_cluster
+from kube2.backend import KubeError, get_backend
+from kube2.binaries import ensure_binaries_for, ensure_binary
+from kube2.manifest import render_text
+from kube2.trace import span
 from datetime import datetime
 
-from kube2.types import Cluster, Context, Job, Volume
+from kube2.types import Context, Job, Volume
 
 
-def sh(cmd):
+def sh(cmd, input: Optional[bytes] = None):
+    ensure_binaries_for(cmd)
+    with span('sh', 'subprocess', cmd=cmd) as s:
+        proc = subprocess.run(cmd, shell=True, input=input)
+        s.set(status=proc.returncode)
     try:
-        subprocess.run(cmd, check=True, shell=True)
+        proc.check_returncode()
     except subprocess.CalledProcessError as e:
         print('Command Failed:', e)
         sys.exit(1)
 
 
 def sh_capture(cmd):
-    proc = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=True,
-    )
-    (out, err) = proc.communicate()
+    ensure_binaries_for(cmd)
+    with span('sh_capture', 'subprocess', cmd=cmd) as s:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=True,
+        )
+        (out, err) = proc.communicate()
+        s.set(status=proc.returncode)
     return out.decode()
 
 
+class CommandFailed(Exception):
+    pass
+
+
+async def sh_async(cmd, input: Optional[bytes] = None, capture: bool = False) -> str:
+    '''
+    Run a shell command on the event loop. Raises `CommandFailed` instead of
+    exiting, so the caller decides how to surface the error.
+    '''
+
+    import asyncio
+
+    ensure_binaries_for(cmd)
+    with span('sh_async', 'subprocess', cmd=cmd) as s:
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE if capture else None,
+            stderr=asyncio.subprocess.PIPE if capture else None,
+        )
+        out, err = await proc.communicate(input)
+        s.set(status=proc.returncode)
+    if proc.returncode != 0:
+        msg = f'Command returned non-zero exit status {proc.returncode}: {cmd}'
+        if capture and err:
+            msg += '\n' + err.decode().strip()
+        raise CommandFailed(msg)
+    return out.decode() if capture else ''
+
+
 def load_template(fn: str, args: dict):
-    searchpath = os.path.dirname(__file__)
-    templateLoader = jinja2.FileSystemLoader(searchpath=searchpath)
-    templateEnv = jinja2.Environment(loader=templateLoader, undefined=jinja2.StrictUndefined)
-    template = templateEnv.get_template(fn)
-    return template.render(**args)
+    return render_text(fn, args)
 
 
 def check_name(name: str):
@@ -49,19 +80,25 @@ def check_name(name: str):
 
 
 def get_current_kube_context():
-    x = sh_capture(f'kubectl config current-context')
-    x = x.strip()
-    if x.startswith('error'):
-        print(x)
+    from kube2.kubeconfig import KubeconfigError, get_current_context_name
+    try:
+        x = get_current_context_name()
+    except KubeconfigError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+    if x is None:
+        print('Error: current-context is not set')
         sys.exit(1)
     return x
 
 
 def humanize_date(date):
+    import arrow
     return arrow.get(date).humanize()
 
 
 def make_table(data):
+    from terminaltables import AsciiTable
     table = AsciiTable(data)
     table.outer_border = False
     table.inner_row_border = False
@@ -73,18 +110,20 @@ def make_table(data):
 
 
 def assert_binary_on_path(binary: str, msg: str = None):
-    x = sh_capture('which ' + binary)
-    if x.strip() == '' or x.endswith('not found'):
-        if msg is None:
-            print(f'Unable to find `{binary}` on your path. Aborting!')
-        else:
-            print(msg)
-        sys.exit(1)
+    ensure_binary(binary, msg)
 
 
 
-def get_current_context():
-    return sh_capture(f'kubectl config current-context').strip()
+def get_current_context() -> str:
+    '''
+    The current context's name, or '' if there isn't one.
+    '''
+
+    from kube2.kubeconfig import KubeconfigError, get_current_context_name
+    try:
+        return get_current_context_name() or ''
+    except KubeconfigError:
+        return ''
 
 
 def get_context_name_from_cluster_name(cluster_name: str):
@@ -98,99 +137,238 @@ def get_cluster_name_from_context_name(context_name: str) -> Optional[str]:
         return None
 
 
+def get_current_region() -> str:
+    '''
+    The AWS region of the current cluster, or `DEFAULT_REGION`.
+    '''
+
+    from kube2.kubeconfig import get_context_region
+    return get_context_region() or DEFAULT_REGION
+
+
 def get_current_cluster() -> Optional[str]:
     cluster_name = get_cluster_name_from_context_name(get_current_context())
     if cluster_name is None:
         return None
-    assert cluster_name in [c.name for c in get_clusters()]
+    region = get_current_region()
+    if cluster_name not in get_cluster_names(region):
+        # the cached list may predate the cluster, e.g. if it was created
+        # from another machine
+        invalidate_cluster(cluster_name, region)
+        if cluster_name not in get_cluster_names(region):
+            print(f'Error: The current context\'s cluster "{cluster_name}" doesn\'t exist in {region}; '
+                  'select another with kube2.py cluster switch')
+            sys.exit(1)
     return cluster_name
 
 
 def get_contexts(filter_kube2=True) -> List[Context]:
-    x = sh_capture(f'kubectl config get-contexts').strip()
-    if not x.startswith('CURRENT'):
-        print('Error:')
-        print(x)
+    from kube2.kubeconfig import KubeconfigError, load_kubeconfig
+    try:
+        config = load_kubeconfig()
+    except KubeconfigError as e:
+        print(f'Error: {e}')
         sys.exit(1)
-    x = x.split('\n')[1:]
     contexts = []
-    for line in x:
-        items = line.strip().split()
-        if items[0].strip() == '*':
-            name = items[1]
-            selected = True
-        else:
-            name = items[0]
-            selected = False
+    for entry in config['contexts']:
+        name = entry['name']
         if filter_kube2 and not name.startswith('kube2'):
             pass  # filter out this local context, b/c it wasn't created with kube2
         else:
-            contexts.append(Context(name=name, selected=selected))
+            contexts.append(Context(name=name, selected=name == config['current-context']))
     return contexts
 
 
+def get_volume_name_from_claim(claim_name: str) -> str:
+    # kube2 names its claims "pvc-<volume>"; leave anyone else's alone
+    return claim_name[len('pvc-'):] if claim_name.startswith('pvc-') else claim_name
+
+
 def get_volumes() -> List[Volume]:
-    x = sh_capture(f'''kubectl get pvc -o=jsonpath='{{@}}' ''').strip()
-    data = json.loads(x)
     volumes = []
-    for item in data['items']:
-        name = item['metadata']['name']
-        # remove the "pvc-" from the start
-        name = name[name.index('-')+1:]
+    for item in get_backend().list_pvcs():
+        name = get_volume_name_from_claim(item['metadata']['name'])
         created = datetime.strptime(
             item['metadata']['creationTimestamp'],
             '%Y-%m-%dT%H:%M:%SZ'
         )
-        capacity = item['status']['capacity']['storage']
+        capacity = item['status'].get('capacity', {}).get('storage', 'pending')
         volumes.append(Volume(
             name=name,
             capacity=capacity,
-            usage='todo',  # TODO: compute usage
+            usage='unknown',  # filled in by `kube2.usage` where needed
             created=created,
         ))
-    # print(json.dumps(data, indent=2))
     return volumes
 
 
-def get_volume_names_attached_to_job(job_name: str) -> List[str]:
-    x = sh_capture(f''' kubectl exec --stdin {job_name}-1 -- /bin/bash -c 'ls /mnt' ''').strip()
-    x = [e.strip() for e in x.split()]
-    return x
+def get_pod_status(pod: dict) -> str:
+    '''
+    Approximates the STATUS column of `kubectl get pods` for a pod object.
+    '''
+
+    if pod['metadata'].get('deletionTimestamp'):
+        return 'Terminating'
+    for cs in pod['status'].get('containerStatuses', []):
+        for state in ('waiting', 'terminated'):
+            reason = cs.get('state', {}).get(state, {}).get('reason')
+            if reason:
+                return reason
+    return pod['status'].get('phase', 'Unknown')
+
+
+def get_job_name_from_pod(pod: dict) -> str:
+    labels = pod['metadata'].get('labels') or {}
+    if 'app' in labels:
+        return labels['app']
+    # not one of our StatefulSets, fall back to stripping the ordinal
+    return '-'.join(pod['metadata']['name'].split('-')[:-1])
+
+
+def get_pod_ordinal(pod: dict) -> int:
+    try:
+        return int(pod['metadata']['name'].rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def get_pod_volume_names(pod: dict) -> List[str]:
+    names = []
+    for v in pod['spec'].get('volumes', []):
+        claim = v.get('persistentVolumeClaim')
+        if claim is not None:
+            names.append(get_volume_name_from_claim(claim['claimName']))
+    return names
+
+
+def get_pod_restarts(pod: dict) -> int:
+    return sum(cs.get('restartCount', 0) for cs in pod['status'].get('containerStatuses', []))
+
+
+def format_status_histogram(statuses: Counter) -> str:
+    if set(statuses.keys()) == {'Running'}:
+        return 'All Running'
+    # ties broken by name, so the order doesn't depend on event order
+    return ','.join(f'{k}:{v}' for k, v in sorted(statuses.items(), key=lambda e: (-e[1], e[0])))
+
+
+class JobIndex(object):
+    '''
+    An in-memory index of jobs, kept up to date from pod watch events. Each
+    event only touches the aggregates of the job its pod belongs to, so an
+    update costs O(changed pods) regardless of how many pods are running.
+    '''
+
+    def __init__(self):
+        # pod name -> (job name, status, restarts, creation timestamp)
+        self.pods = {}
+        self.statuses = defaultdict(Counter)
+        self.restarts = defaultdict(int)
+        self.created = defaultdict(Counter)
+        # pod name -> (ordinal, attached volume names)
+        self.pod_volumes = {}
+        self.job_pods = defaultdict(set)
+        # job name -> its lowest-ordinal pod, whose volumes the row shows
+        self.volume_source = {}
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def apply(self, event: dict) -> Optional[str]:
+        '''
+        Applies an ADDED/MODIFIED/DELETED pod event, returning the name of
+        the job whose row changed (if any).
+        '''
+
+        pod = event['object']
+        pod_name = pod['metadata']['name']
+        old = self.pods.pop(pod_name, None)
+        if old is not None:
+            self._remove(*old)
+        job_name = get_job_name_from_pod(pod)
+        if old is not None and (event['type'] == 'DELETED' or old[0] != job_name):
+            self._forget_pod(old[0], pod_name)
+        if event['type'] == 'DELETED':
+            return old[0] if old is not None else None
+        entry = (
+            job_name,
+            get_pod_status(pod),
+            get_pod_restarts(pod),
+            pod['metadata']['creationTimestamp'],
+        )
+        self.pods[pod_name] = entry
+        _, status, restarts, created = entry
+        self.statuses[job_name][status] += 1
+        self.restarts[job_name] += restarts
+        self.created[job_name][created] += 1
+
+        volumes = (get_pod_ordinal(pod), get_pod_volume_names(pod))
+        old_volumes = self.pod_volumes.get(pod_name)
+        self.pod_volumes[pod_name] = volumes
+        self.job_pods[job_name].add(pod_name)
+        source = self.volume_source.get(job_name)
+        if source is None or volumes[0] < self.pod_volumes[source][0]:
+            self.volume_source[job_name] = pod_name
+        if old is not None and old[:3] == entry[:3] and old_volumes == volumes:
+            return None
+        return job_name
+
+    def _forget_pod(self, job_name: str, pod_name: str):
+        self.pod_volumes.pop(pod_name, None)
+        pods = self.job_pods[job_name]
+        pods.discard(pod_name)
+        if len(pods) == 0:
+            del self.job_pods[job_name]
+            self.volume_source.pop(job_name, None)
+        elif self.volume_source.get(job_name) == pod_name:
+            # only when the job's lowest-ordinal pod goes away: O(job size)
+            self.volume_source[job_name] = min(pods, key=lambda name: self.pod_volumes[name][0])
+
+    def _remove(self, job_name: str, status: str, restarts: int, created: str):
+        self.statuses[job_name][status] -= 1
+        if self.statuses[job_name][status] == 0:
+            del self.statuses[job_name][status]
+        self.restarts[job_name] -= restarts
+        self.created[job_name][created] -= 1
+        if self.created[job_name][created] == 0:
+            del self.created[job_name][created]
+        if len(self.statuses[job_name]) == 0:
+            for d in (self.statuses, self.restarts, self.created):
+                d.pop(job_name, None)
+
+    def clear(self):
+        self.__init__()
+
+    def get_job(self, name: str) -> Optional[Job]:
+        if name not in self.statuses:
+            return None
+        return Job(
+            name=name,
+            nodes=sum(self.statuses[name].values()),
+            restarts=self.restarts[name],
+            status=format_status_histogram(self.statuses[name]),
+            age=humanize_date(min(self.created[name])),
+            attached_volumes=self.pod_volumes[self.volume_source[name]][1] if name in self.volume_source else [],
+        )
+
+    def get_jobs(self) -> List[Job]:
+        return [self.get_job(name) for name in sorted(self.statuses.keys())]
+
+
+def parse_jobs(pods: List[dict]) -> List[Job]:
+    '''
+    Builds the job table from a single snapshot of pod objects.
+    '''
+
+    index = JobIndex()
+    for pod in pods:
+        index.apply({'type': 'ADDED', 'object': pod})
+    return index.get_jobs()
 
 
 def get_jobs() -> List[Job]:
-    x = sh_capture('kubectl get pods')
-    x = x.strip()
-    if not x.startswith('NAME'):
+    try:
+        pods = get_backend().list_pods()
+    except KubeError:
         return []
-    else:
-        x = x.strip().split('\n')
-        x = x[1:]  # skip titles
-        d = defaultdict(lambda: [])
-        for line in x:
-            name, ready, status, restarts, age = line.split()
-            key = '-'.join(name.split('-')[:-1])
-            d[key].append([name, ready, status, restarts, age])
-        jobs = []
-        for k, v in d.items():
-            name = k
-            if all('Running' == e for e in v[0][2].split(',')):
-                attached_volumes = get_volume_names_attached_to_job(name)
-            else:
-                attached_volumes = []
-            nodes = len(v)
-            if all(e[2] == 'Running' for e in v):
-                status = 'All Running'
-            else:
-                status = ','.join(e[2] for e in v)
-            restarts = v[0][3]
-            age = v[0][4]
-            jobs.append(Job(
-                name=name,
-                nodes=nodes,
-                restarts=restarts,
-                status=status,
-                age=age,
-                attached_volumes=attached_volumes,
-            ))
-        return jobs
+    return parse_jobs(pods)
@@ -4,31 +4,40 @@
 
 # 3. kubectl apply -f specs/eks/fsx.yml
 
-import os
 import sys
-import tempfile
-import time
-from typing import List
-import boto3
-from kube2.types import Volume
 
 from kube2.utils import (
     check_name,
     get_current_cluster,
+    get_current_region,
     get_volumes,
     humanize_date,
-    load_template,
     make_table,
     sh,
     sh_capture,
 )
 
 from kube2.aws_utils import (
+    aws_client,
     get_cluster_vpc_id,
-    get_clusters,
     get_security_group_id,
     get_subnet_id,
+    invalidate_vpc,
 )
+from kube2.backend import KubeError, get_backend
+from kube2.capacity import get_nodegroup_zone
+from kube2.manifest import ManifestError, apply_manifests, render_manifests
+from kube2.prefetch import JOB_NODEGROUP
+from kube2.sync import (
+    DEFAULT_MEMORY_MB,
+    DEFAULT_SYNC_JOBS,
+    VOLUME_BUCKET,
+    SyncError,
+    download_dir,
+    upload_dir,
+)
+from kube2.usage import format_usage, get_pvc_usage
+from kube2.wait import WaitTimeout, wait_for_pvc_bound
 
 
 def enable_fsx():
@@ -45,11 +54,12 @@ def create_and_configure_security_group(
     cluster_name: str,
     volume_name: str,
     vpc_id: str,
+    region: str,
 ):
-    client = boto3.client('ec2', region_name='us-east-1')
+    client = aws_client('ec2', region_name=region)
     group_name = f'{cluster_name}-{volume_name}-fsx'
 
-    sg_id = get_security_group_id(vpc_id=vpc_id, group_name=group_name)
+    sg_id = get_security_group_id(vpc_id=vpc_id, group_name=group_name, region=region)
 
     # create if doesn't already exist
     if sg_id is None:
@@ -97,9 +107,13 @@ class VolumeCLI(object):
         *,
         name: str,
         storage_size: str,
+        timeout: int = 120,
+        s3: bool = False,
     ):
         '''
-        Create a new FSx volume backed by S3.
+        Create a new FSx volume. With --s3, the volume imports the files in
+        s3://kube2-volumes/<name>/ (stage them first with `volume sync`) and
+        exports to s3://kube2-volumes/<name>/export.
         '''
 
         check_name(name)
@@ -116,45 +130,85 @@ class VolumeCLI(object):
         if not is_fsx_enabled():
             enable_fsx()
 
-        vpc_id = get_cluster_vpc_id(cluster_name)
+        region = get_current_region()
+        vpc_id = get_cluster_vpc_id(cluster_name, region)
         sg_id = create_and_configure_security_group(
             cluster_name=cluster_name,
             volume_name=name,
-            vpc_id=vpc_id
+            vpc_id=vpc_id,
+            region=region,
         )
         pvc_name = get_pvc_name(name)
         sc_name = get_sc_name(name)
-        subnet_id = get_subnet_id(vpc_id)
+        try:
+            node_zone = get_nodegroup_zone(get_backend().list_nodes(), JOB_NODEGROUP)
+        except KubeError:
+            node_zone = None
+        subnet_id = get_subnet_id(vpc_id, node_zone, region=region)
         assert subnet_id is not None
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-
-            script_fn = os.path.join(tmpdir, 'fsx.yml')
-            script = load_template(
+        try:
+            manifests = render_manifests(
                 fn='templates/fsx.yml',
                 args={
                     'storage_class_name': sc_name,
-                    's3_import_path': f's3://kube2-volumes/{name}',
-                    's3_export_path': f's3://kube2-volumes/{name}/export',
+                    's3_import_path': f's3://{VOLUME_BUCKET}/{name}' if s3 else None,
+                    's3_export_path': f's3://{VOLUME_BUCKET}/{name}/export' if s3 else None,
                     'security_group_id': sg_id,
                     'persistent_volume_claim_name': pvc_name,
                     'storage_size': storage_size,
-                    'storage_class_name': sc_name,
                     'subnet_id': subnet_id,
                 }
             )
-            with open(script_fn, 'w') as f:
-                f.write(script)
-
             print('Creating volume...')
-            sh(f'kubectl apply -f {script_fn}')
-            print('Waiting for FSx filesystem to be created (check progress here: https://console.aws.amazon.com/fsx/home?region=us-east-1)...')
-            for _ in range(60*2):
-                s = sh_capture(f'''kubectl get pvc pvc-my-vol -o 'jsonpath={{..status.phase}}' ''').strip()
-                if s == 'Bound':
-                    break
-                time.sleep(1)
-            sh(f'kubectl describe pvc | tail -n 1')
+            apply_manifests(manifests)
+        except (KubeError, ManifestError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        invalidate_vpc(vpc_id)
+        print(f'Waiting for FSx filesystem to be created (check progress here: https://console.aws.amazon.com/fsx/home?region={region})...')
+        try:
+            wait_for_pvc_bound(pvc_name, timeout=timeout)
+        except WaitTimeout as e:
+            print(f'Volume is not bound yet: {e}')
+        sh(f'kubectl describe pvc {pvc_name} | tail -n 1')
+
+    def sync(
+        self,
+        *,
+        name: str,
+        src: str,
+        download: bool = False,
+        jobs: int = DEFAULT_SYNC_JOBS,
+        memory_mb: int = DEFAULT_MEMORY_MB,
+    ):
+        '''
+        Upload a local directory to s3://kube2-volumes/<name>/, or with
+        --download, download that prefix into the directory. Only new and
+        changed files are transferred; at most --jobs transfers run at once,
+        buffering about --memory-mb in total.
+        '''
+
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        check_name(name)
+        sync_dir = download_dir if download else upload_dir
+        try:
+            progress = sync_dir(
+                src,
+                name,
+                region=get_current_region(),
+                jobs=jobs,
+                memory_mb=memory_mb,
+            )
+        except (SyncError, OSError, BotoCoreError, ClientError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        for error in progress.errors[:20]:
+            print(f'Failed: {error}')
+        print(progress.summary())
+        if progress.failed > 0:
+            sys.exit(1)
 
     def delete(
         self,
@@ -191,6 +245,9 @@ class VolumeCLI(object):
         if len(volumes) == 0:
             print('No volumes.')
         else:
+            usage = get_pvc_usage([get_pvc_name(v.name) for v in volumes])
+            for v in volumes:
+                v.usage = format_usage(usage.get(get_pvc_name(v.name)))
             table = [['NAME', 'CAPACITY', 'USAGE', 'CREATED']]
             for v in volumes:
                 table.append([
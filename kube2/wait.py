@@ -0,0 +1,156 @@
+'''
+Waiters built on Kubernetes watch streams.
+
+A waiter consumes watch events for a single object and returns as soon as an
+event satisfies its condition, instead of polling on a fixed interval. Broken
+or expired streams are reconnected with exponential backoff, resuming from
+the last seen resource version where the backend supports it.
+'''
+
+import sys
+import time
+from typing import Callable, Iterable, Optional
+
+from kube2.backend import KubeError, get_backend
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+# watch(resource_version, timeout) -> iterable of {'type': ..., 'object': ...}
+WatchSource = Callable[[Optional[str], Optional[float]], Iterable[dict]]
+
+
+def wait_for(
+    watch: WatchSource,
+    condition: Callable[[dict], bool],
+    *,
+    timeout: float,
+    progress: Optional[Callable[[dict], str]] = None,
+    initial_backoff: float = 0.5,
+    max_backoff: float = 10.0,
+    clock: Callable[[], float] = time.monotonic,
+    sleep: Callable[[float], None] = time.sleep,
+    out=sys.stdout,
+) -> dict:
+    '''
+    Consume events from `watch` until `condition(obj)` holds, returning that
+    object. Raises `WaitTimeout` if it doesn't happen within `timeout`
+    seconds. `progress(obj)`, if given, is printed whenever its text changes.
+    '''
+
+    deadline = clock() + timeout
+    resource_version = None
+    backoff = initial_backoff
+    last_progress = None
+    last_error = None
+    while True:
+        remaining = deadline - clock()
+        if remaining <= 0:
+            msg = f'Timed out after {timeout}s'
+            if last_error is not None:
+                msg += f' (last error: {last_error})'
+            raise WaitTimeout(msg)
+        try:
+            for event in watch(resource_version, remaining):
+                obj = event.get('object') or {}
+                if event.get('type') == 'ERROR':
+                    # typically 410 Gone: our resource version is too old
+                    resource_version = None
+                    last_error = obj.get('message', 'watch error')
+                    break
+                resource_version = obj.get('metadata', {}).get('resourceVersion', resource_version)
+                backoff = initial_backoff
+                if event.get('type') in ('BOOKMARK', 'DELETED'):
+                    continue
+                if progress is not None:
+                    text = progress(obj)
+                    if text != last_progress:
+                        print(text, file=out, flush=True)
+                        last_progress = text
+                if condition(obj):
+                    return obj
+                if clock() >= deadline:
+                    break
+        except (KubeError, OSError, ValueError) as e:
+            last_error = e
+        sleep(min(backoff, max(0.0, deadline - clock())))
+        backoff = min(backoff * 2, max_backoff)
+
+
+def watch_object(resource: str, name: str, backend=None) -> WatchSource:
+    backend = backend or get_backend()
+
+    def watch(resource_version, timeout):
+        return backend.watch(
+            resource,
+            name=name,
+            resource_version=resource_version,
+            timeout=timeout,
+        )
+    return watch
+
+
+def is_pvc_bound(pvc: dict) -> bool:
+    return pvc.get('status', {}).get('phase') == 'Bound'
+
+
+def pvc_progress(pvc: dict) -> str:
+    return f'{pvc["metadata"]["name"]}: {pvc.get("status", {}).get("phase", "Unknown")}'
+
+
+def is_statefulset_ready(ss: dict) -> bool:
+    status = ss.get('status', {})
+    generation = ss['metadata'].get('generation', 0)
+    return (
+        status.get('observedGeneration', 0) >= generation
+        and status.get('readyReplicas', 0) >= ss['spec'].get('replicas', 1)
+    )
+
+
+def statefulset_progress(ss: dict) -> str:
+    ready = ss.get('status', {}).get('readyReplicas', 0)
+    return f'{ss["metadata"]["name"]}: {ready}/{ss["spec"].get("replicas", 1)} pods ready'
+
+
+def is_daemonset_ready(ds: dict) -> bool:
+    status = ds.get('status', {})
+    generation = ds['metadata'].get('generation', 0)
+    return (
+        status.get('observedGeneration', 0) >= generation
+        and status.get('updatedNumberScheduled', 0) >= status.get('desiredNumberScheduled', 0)
+        and status.get('numberReady', 0) >= status.get('desiredNumberScheduled', 0)
+    )
+
+
+def daemonset_progress(ds: dict) -> str:
+    status = ds.get('status', {})
+    return f'{ds["metadata"]["name"]}: {status.get("numberReady", 0)}/{status.get("desiredNumberScheduled", 0)} nodes ready'
+
+
+def wait_for_pvc_bound(name: str, timeout: float, backend=None) -> dict:
+    return wait_for(
+        watch_object('persistentvolumeclaims', name, backend),
+        is_pvc_bound,
+        timeout=timeout,
+        progress=pvc_progress,
+    )
+
+
+def wait_for_statefulset_ready(name: str, timeout: float, backend=None) -> dict:
+    return wait_for(
+        watch_object('statefulsets', name, backend),
+        is_statefulset_ready,
+        timeout=timeout,
+        progress=statefulset_progress,
+    )
+
+
+def wait_for_daemonset_ready(name: str, timeout: float, backend=None) -> dict:
+    return wait_for(
+        watch_object('daemonsets', name, backend),
+        is_daemonset_ready,
+        timeout=timeout,
+        progress=daemonset_progress,
+    )
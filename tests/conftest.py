@@ -0,0 +1,30 @@
+import pytest
+
+from kube2 import backend, manifest, sync
+from kube2.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    # never read or write the user's cache directory: the metadata cache,
+    # jinja's bytecode cache, kubeconfig credentials or sync manifests
+    directory = str(tmp_path / 'cache')
+    monkeypatch.setattr(cache, 'directory', directory)
+    for module in (backend, manifest, sync):
+        monkeypatch.setattr(module, 'CACHE_DIR', directory)
+    monkeypatch.setattr(manifest, '_environment', None)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    '''
+    Real boto3 clients against moto's in-memory AWS.
+    '''
+
+    from moto import mock_aws
+
+    for key in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(key, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        yield
@@ -0,0 +1,63 @@
+from kube2.aws_utils import aws_client, get_cluster_names, get_clusters
+
+
+def create_cluster(name: str, region: str):
+    aws_client('eks', region_name=region).create_cluster(
+        name=name,
+        roleArn='arn:aws:iam::123456789012:role/eks',
+        resourcesVpcConfig={'subnetIds': ['subnet-0']},
+    )
+
+
+def test_aws_client_returns_a_working_client(aws):
+    # bench/fake_aws.py replaces aws_client, so only this covers the real one
+    client = aws_client('eks', region_name='us-west-2')
+    assert client.meta.region_name == 'us-west-2'
+    assert client.list_clusters()['clusters'] == []
+
+
+def test_get_clusters(aws):
+    for name in ('a', 'b', 'c'):
+        create_cluster(name, 'us-east-1')
+    create_cluster('elsewhere', 'us-west-2')
+
+    clusters = get_clusters(region='us-east-1')
+    assert sorted(c.name for c in clusters) == ['a', 'b', 'c']
+    assert {c.region for c in clusters} == {'us-east-1'}
+    assert sorted(get_cluster_names('us-west-2')) == ['elsewhere']
+
+
+def test_cached_names_are_per_identity(aws, monkeypatch):
+    create_cluster('a', 'us-east-1')
+    assert get_cluster_names('us-east-1') == ['a']
+    create_cluster('b', 'us-east-1')
+    # still cached for these credentials, but not shared with others
+    assert get_cluster_names('us-east-1') == ['a']
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'other')
+    assert sorted(get_cluster_names('us-east-1')) == ['a', 'b']
+
+
+def test_current_cluster_refetches_stale_names(aws, monkeypatch):
+    import pytest
+    from kube2 import utils
+
+    monkeypatch.setattr(utils, 'get_current_context', lambda: 'kube2-new')
+    monkeypatch.setattr(utils, 'get_current_region', lambda: 'us-east-1')
+    assert get_cluster_names('us-east-1') == []
+    # created elsewhere after the names were cached
+    create_cluster('new', 'us-east-1')
+    assert utils.get_current_cluster() == 'new'
+
+    monkeypatch.setattr(utils, 'get_current_context', lambda: 'kube2-gone')
+    with pytest.raises(SystemExit):
+        utils.get_current_cluster()
+
+
+def test_scope_follows_profile(monkeypatch):
+    from kube2.aws_utils import _scope
+
+    monkeypatch.delenv('AWS_ACCESS_KEY_ID', raising=False)
+    monkeypatch.setenv('AWS_PROFILE', 'one')
+    one = _scope()
+    monkeypatch.setenv('AWS_PROFILE', 'two')
+    assert _scope() != one
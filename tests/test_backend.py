@@ -0,0 +1,205 @@
+import json
+import socket
+import stat
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from kube2.backend import APIBackend, KubeError, KubectlBackend, make_backend
+
+
+def get_closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_connection_errors_raise_kube_error():
+    backend = APIBackend(f'http://127.0.0.1:{get_closed_port()}', timeout=1)
+    with pytest.raises(KubeError, match='GET /api/v1/namespaces/default/pods'):
+        backend.list_pods()
+    with pytest.raises(KubeError):
+        backend.get_raw('/api/v1/nodes/node-0/proxy/stats/summary', timeout=1)
+
+
+class FakeAPIServer(object):
+    '''
+    A tiny API server: objects by path, label selectors of the form
+    key=value, server-side apply, and watches that stream the events put in
+    `events` and then end.
+    '''
+
+    def __init__(self):
+        self.objects = {}
+        self.events = []
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                server.requests.append(('GET', url.path, params, self.headers))
+                if params.get('watch') == '1':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    for event in server.events:
+                        self.wfile.write(json.dumps(event).encode() + b'\n')
+                        self.wfile.flush()
+                    return
+                items = [
+                    obj for path, obj in sorted(server.objects.items())
+                    if path.rsplit('/', 1)[0] == url.path and matches(obj, params.get('labelSelector'))
+                ]
+                self.reply(200, {'kind': 'List', 'items': items})
+
+            def do_PATCH(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(('PATCH', url.path, params, self.headers))
+                if self.headers['Content-Type'] != 'application/apply-patch+yaml':
+                    self.reply(415, {'message': 'unsupported patch type'})
+                    return
+                server.objects[url.path] = body
+                self.reply(200, body)
+
+            def reply(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}'
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def matches(obj: dict, selector: str) -> bool:
+    if not selector:
+        return True
+    key, value = selector.split('=', 1)
+    return (obj['metadata'].get('labels') or {}).get(key) == value
+
+
+def make_pod(name: str, app: str) -> dict:
+    return {'apiVersion': 'v1', 'kind': 'Pod', 'metadata': {'name': name, 'labels': {'app': app}}}
+
+
+@pytest.fixture
+def server():
+    server = FakeAPIServer()
+    yield server
+    server.close()
+
+
+def test_apply_then_list(server, capsys):
+    backend = APIBackend(server.url, token='secret-token', timeout=5)
+    backend.apply([make_pod('a-0', 'a'), make_pod('a-1', 'a'), make_pod('b-0', 'b')])
+    assert 'pod/a-0 applied' in capsys.readouterr().out
+
+    method, path, params, headers = server.requests[0]
+    assert (method, path) == ('PATCH', '/api/v1/namespaces/default/pods/a-0')
+    assert params == {'fieldManager': 'kube2', 'force': 'true'}
+    assert headers['Authorization'] == 'Bearer secret-token'
+
+    assert [p['metadata']['name'] for p in backend.list_pods()] == ['a-0', 'a-1', 'b-0']
+    assert [p['metadata']['name'] for p in backend.list_pods(label_selector='app=a')] == ['a-0', 'a-1']
+    assert server.requests[-1][2] == {'labelSelector': 'app=a'}
+
+
+def test_watch_stream(server):
+    server.events = [
+        {'type': 'ADDED', 'object': make_pod('a-0', 'a')},
+        {'type': 'MODIFIED', 'object': dict(make_pod('a-0', 'a'), status={'phase': 'Running'})},
+        {'type': 'DELETED', 'object': make_pod('a-0', 'a')},
+    ]
+    backend = APIBackend(server.url, timeout=5)
+    events = list(backend.watch('pods', label_selector='app=a', resource_version='7', timeout=30))
+    assert events == server.events
+    params = server.requests[-1][2]
+    assert params['watch'] == '1'
+    assert params['labelSelector'] == 'app=a'
+    assert params['resourceVersion'] == '7'
+    assert params['timeoutSeconds'] == '30'
+
+
+def test_api_errors_keep_their_status(server):
+    backend = APIBackend(server.url, timeout=5)
+    with pytest.raises(KubeError) as e:
+        backend.request('PATCH', '/api/v1/namespaces/default/pods/x', body=b'{}')
+    assert e.value.status == 415
+
+
+def write_kubeconfig(tmp_path, plugin: str) -> str:
+    fn = tmp_path / 'kubeconfig'
+    fn.write_text(json.dumps({
+        'apiVersion': 'v1',
+        'kind': 'Config',
+        'current-context': 'kube2-test',
+        'clusters': [{'name': 'test', 'cluster': {'server': 'http://127.0.0.1:1'}}],
+        'contexts': [{'name': 'kube2-test', 'context': {'cluster': 'test', 'user': 'test'}}],
+        'users': [{'name': 'test', 'user': {'exec': {
+            'apiVersion': 'client.authentication.k8s.io/v1beta1',
+            'command': plugin,
+            'args': ['get-token'],
+        }}}],
+    }))
+    return str(fn)
+
+
+def test_exec_tokens_are_per_identity(tmp_path, monkeypatch):
+    # a plugin that hands out a new token on every run
+    calls = tmp_path / 'calls'
+    plugin = tmp_path / 'plugin'
+    plugin.write_text(
+        f'#!{sys.executable}\n'
+        'import json, os\n'
+        f'with open({str(calls)!r}, "a") as f: f.write("x")\n'
+        f'n = len(open({str(calls)!r}).read())\n'
+        'print(json.dumps({"status": {"token": f"{os.environ.get(\'AWS_PROFILE\')}-{n}", '
+        '"expirationTimestamp": "2999-01-01T00:00:00Z"}}))\n'
+    )
+    plugin.chmod(plugin.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('KUBECONFIG', write_kubeconfig(tmp_path, str(plugin)))
+    monkeypatch.delenv('KUBE2_BACKEND', raising=False)
+
+    def token() -> str:
+        return APIBackend.from_kubeconfig().headers['Authorization']
+
+    monkeypatch.setenv('AWS_PROFILE', 'one')
+    assert token() == 'Bearer one-1'
+    assert token() == 'Bearer one-1'
+    monkeypatch.setenv('AWS_PROFILE', 'two')
+    assert token() == 'Bearer two-2'
+    monkeypatch.setenv('AWS_PROFILE', 'one')
+    assert token() == 'Bearer one-1'
+
+
+def test_make_backend_falls_back_only_for_config_errors(tmp_path, monkeypatch):
+    monkeypatch.delenv('KUBE2_BACKEND', raising=False)
+    monkeypatch.setenv('KUBECONFIG', str(tmp_path / 'missing'))
+    assert isinstance(make_backend(), KubectlBackend)
+
+    def broken(context=None):
+        raise AttributeError('a bug')
+
+    monkeypatch.setattr(APIBackend, 'from_kubeconfig', broken)
+    with pytest.raises(AttributeError):
+        make_backend()
@@ -0,0 +1,47 @@
+from kube2.capacity import CapacityLedger, JobShape, Snapshot
+
+
+def make_node(i: int, gpus: int = 8) -> dict:
+    return {
+        'metadata': {'name': f'node-{i}'},
+        'spec': {},
+        'status': {'allocatable': {'nvidia.com/gpu': str(gpus)}, 'conditions': [{'type': 'Ready', 'status': 'True'}]},
+    }
+
+
+def make_pod(name: str, app: str, node: str, gpus: int) -> dict:
+    return {
+        'metadata': {'name': name, 'labels': {'app': app}},
+        'spec': {'nodeName': node, 'containers': [{'name': 'main', 'resources': {'requests': {'nvidia.com/gpu': str(gpus)}}}]},
+        'status': {'phase': 'Running'},
+    }
+
+
+def test_ledger_reserves_admitted_jobs():
+    nodes = [make_node(i) for i in range(2)]
+    ledger = CapacityLedger(Snapshot(nodes=nodes, pods=[]))
+    half = JobShape(replicas=2, requests={'nvidia.com/gpu': 4000})
+    assert ledger.admit(half, 'a').ok
+    assert ledger.admit(half, 'b').ok
+    # the four half-node replicas filled both nodes
+    report = ledger.admit(JobShape(replicas=1, requests={'nvidia.com/gpu': 1000}), 'c')
+    assert not report.ok and report.limiting == 'nvidia.com/gpu'
+    assert sorted(ledger.reserved) == ['a', 'b']
+
+
+def test_refresh_replaces_reservations_with_real_pods():
+    nodes = [make_node(0)]
+    ledger = CapacityLedger(Snapshot(nodes=nodes, pods=[]))
+    shape = JobShape(replicas=2, requests={'nvidia.com/gpu': 4000})
+    assert ledger.admit(shape, 'a').ok
+
+    # too soon: the cached snapshot is kept
+    ledger.refresh(lambda: Snapshot(nodes=[], pods=[]), max_age=60)
+    assert ledger.base.nodes == nodes
+
+    # one replica bound so far: keep holding the room
+    ledger.refresh(lambda: Snapshot(nodes=nodes, pods=[make_pod('a-0', 'a', 'node-0', 4)]))
+    assert 'a' in ledger.reserved
+    ledger.refresh(lambda: Snapshot(nodes=nodes, pods=[make_pod(f'a-{i}', 'a', 'node-0', 4) for i in range(2)]))
+    assert ledger.reserved == {}
+    assert not ledger.admit(shape, 'b').ok
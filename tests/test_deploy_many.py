@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from kube2 import job
+from kube2.capacity import Snapshot
+from kube2.graph import Step
+
+
+def make_node(i: int) -> dict:
+    return {
+        'metadata': {'name': f'node-{i}', 'labels': {}},
+        'spec': {},
+        'status': {
+            'allocatable': {
+                'cpu': '96',
+                'memory': '1130Gi',
+                'hugepages-2Mi': '10Gi',
+                'nvidia.com/gpu': '8',
+                'vpc.amazonaws.com/efa': '4',
+            },
+            'conditions': [{'type': 'Ready', 'status': 'True'}],
+        },
+    }
+
+
+def make_spec_job(name: str, nodes: int = 1) -> dict:
+    return {'name': name, 'docker_image': 'image', 'nodes': nodes, 'attach': '', 'placement': 'exclusive'}
+
+
+def stub_deploys(monkeypatch, existing=(), n_nodes=8):
+    '''
+    Discovery sees the `existing` jobs on a cluster of `n_nodes` empty GPU
+    nodes; deploys run their real steps up to the capacity check and stop
+    there.
+    '''
+
+    snapshots = []
+
+    def get_snapshot():
+        snapshots.append(Snapshot(nodes=[make_node(i) for i in range(n_nodes)], pods=[]))
+        return snapshots[-1]
+
+    monkeypatch.setattr(job, 'get_snapshot', get_snapshot)
+    monkeypatch.setattr(job, 'get_discovery_steps', lambda: [
+        Step('cluster', lambda results: 'cluster'),
+        Step('jobs', lambda results: [SimpleNamespace(name=name) for name in existing]),
+        Step('volumes', lambda results: []),
+    ])
+    get_deploy_steps = job.get_deploy_steps
+
+    def until_preflight(**kwargs):
+        steps = get_deploy_steps(**kwargs)
+        return [step for step in steps if step.name in ('validate', 'zone', 'render', 'preflight')]
+
+    monkeypatch.setattr(job, 'get_deploy_steps', until_preflight)
+    return snapshots
+
+
+def test_taken_name_fails_only_its_own_row(monkeypatch):
+    stub_deploys(monkeypatch, existing=['taken'])
+    table = asyncio.run(job.deploy_many_async(
+        [make_spec_job('a'), make_spec_job('taken'), make_spec_job('b')], max_parallel=2, timeout=10,
+    ))
+    rows = {row[0]: row[3] for row in table[1:]}
+    assert rows['a'] == 'Deployed'
+    assert rows['b'] == 'Deployed'
+    assert rows['taken'].startswith('Failed at validate: A job already exists')
+
+
+def test_sweep_does_not_oversubscribe(monkeypatch):
+    snapshots = stub_deploys(monkeypatch, n_nodes=4)
+    # each fits alone; together only two of them do
+    table = asyncio.run(job.deploy_many_async(
+        [make_spec_job(name, nodes=2) for name in ('a', 'b', 'c')], max_parallel=3, timeout=10,
+    ))
+    statuses = [row[3] for row in table[1:]]
+    assert statuses.count('Deployed') == 2
+    assert [s for s in statuses if s != 'Deployed'][0].startswith('Failed at preflight: Job')
+    assert len(snapshots) == 1
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kube2 import job
+from kube2.capacity import CapacityLedger, Snapshot
+from kube2.graph import Step, run_graph_async
+from kube2.manifest import render_manifests
+
+
+def make_node(i: int) -> dict:
+    return {
+        'metadata': {'name': f'node-{i}', 'labels': {}},
+        'spec': {},
+        'status': {
+            'allocatable': {
+                'cpu': '95690m',
+                'memory': '1130Gi',
+                'hugepages-2Mi': '10Gi',
+                'nvidia.com/gpu': '8',
+                'vpc.amazonaws.com/efa': '4',
+            },
+            'conditions': [{'type': 'Ready', 'status': 'True'}],
+        },
+    }
+
+
+def render(replicas: int) -> list:
+    return render_manifests('templates/statefulset.yml', {
+        'name': 'queued',
+        'docker_image': 'image',
+        'image_pull_policy': 'IfNotPresent',
+        'nodes': replicas,
+        'secret_name': 'queued-secret',
+        'mounts': [],
+        'anti_affinity': True,
+        'topology_spread': False,
+        'zone': None,
+    })
+
+
+def test_queued_deploy_leaves_executor_free(tmp_path, monkeypatch):
+    # the cluster only grows once another step has run; a queued check that
+    # held the executor's only thread would never let it
+    grown = threading.Event()
+    monkeypatch.setattr(job, 'QUEUE_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(job, 'get_snapshot', lambda: Snapshot(
+        nodes=[make_node(i) for i in range(2 if grown.is_set() else 1)], pods=[]))
+
+    steps = job.get_deploy_steps(
+        name='queued',
+        docker_image='image',
+        nodes=2,
+        attach='',
+        tmpdir=str(tmp_path),
+        timeout=10,
+        queue=True,
+        queue_timeout=5,
+    )
+    preflight = next(step for step in steps if step.name == 'preflight')
+    initial = {'render': render(2), 'capacity': CapacityLedger(Snapshot(nodes=[make_node(0)], pods=[]))}
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        return await run_graph_async([
+            Step('preflight', preflight.fn, ['render', 'capacity']),
+            Step('other', lambda results: grown.set()),
+        ], initial=initial)
+
+    results, _ = asyncio.run(main())
+    assert results['preflight'].ok
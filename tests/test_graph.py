@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+from kube2.graph import Step, StepFailed, run_graph, run_graph_async
+
+
+def sleeper(name: str, seconds: float, log: list):
+    def fn(results):
+        log.append(('start', name))
+        time.sleep(seconds)
+        log.append(('end', name))
+        return name
+    return fn
+
+
+def async_sleeper(name: str, seconds: float, log: list):
+    async def fn(results):
+        log.append(('start', name))
+        await asyncio.sleep(seconds)
+        log.append(('end', name))
+        return name
+    return fn
+
+
+def test_independent_steps_overlap():
+    log = []
+    steps = [
+        Step('a', sleeper('a', 0.3, log)),
+        Step('b', sleeper('b', 0.3, log)),
+        Step('c', async_sleeper('c', 0.3, log)),
+    ]
+    t0 = time.perf_counter()
+    results, timings = run_graph(steps)
+    wall = time.perf_counter() - t0
+    assert results == {'a': 'a', 'b': 'b', 'c': 'c'}
+    assert wall < 0.6
+    assert set(timings) == {'a', 'b', 'c'}
+
+
+def test_dependencies_run_in_order():
+    log = []
+    seen = {}
+
+    def join(results):
+        seen.update(results)
+        return 'd'
+
+    steps = [
+        Step('a', sleeper('a', 0.2, log)),
+        Step('b', async_sleeper('b', 0.1, log), ['a']),
+        Step('c', sleeper('c', 0.05, log)),
+        Step('d', join, ['b', 'c']),
+    ]
+    results, timings = run_graph(steps, initial={'x': 1})
+    assert log.index(('end', 'a')) < log.index(('start', 'b'))
+    # c doesn't wait for a
+    assert log.index(('start', 'c')) < log.index(('end', 'a'))
+    assert seen == {'x': 1, 'a': 'a', 'b': 'b', 'c': 'c'}
+    assert timings['d'][0] >= max(timings['b'][1], timings['c'][1])
+
+
+def test_failing_step_stops_its_dependents():
+    log = []
+
+    def fail(results):
+        raise RuntimeError('boom')
+
+    steps = [
+        Step('a', fail),
+        Step('b', sleeper('b', 0.01, log), ['a']),
+        Step('c', async_sleeper('c', 0.01, log), ['b']),
+    ]
+    with pytest.raises(StepFailed) as e:
+        run_graph(steps)
+    assert e.value.step == 'a'
+    assert isinstance(e.value.error, RuntimeError)
+    assert log == []
+
+
+def test_graph_is_checked_before_running():
+    log = []
+    with pytest.raises(ValueError):
+        run_graph([Step('b', sleeper('b', 0, log), ['a']), Step('a', sleeper('a', 0, log))])
+    with pytest.raises(ValueError):
+        asyncio.run(run_graph_async([Step('a', sleeper('a', 0, log), ['missing'])]))
+    assert log == []
@@ -0,0 +1,174 @@
+import queue
+import random
+import re
+import threading
+
+import urllib3
+
+from kube2 import utils
+from kube2.job import run_job_dashboard, watch_pod_events
+from kube2.utils import JobIndex, parse_jobs
+
+
+def make_pod(job: str, rank: int, *, phase: str = 'Running', restarts: int = 0, volume: str = None) -> dict:
+    volume = volume or f'pvc-{job}-data'
+    return {
+        'metadata': {
+            'name': f'{job}-{rank}',
+            'labels': {'app': job},
+            'creationTimestamp': f'2021-06-01T00:{rank % 60:02d}:00Z',
+        },
+        'spec': {'volumes': [{'name': 'data', 'persistentVolumeClaim': {'claimName': volume}}]},
+        'status': {'phase': phase, 'containerStatuses': [{'restartCount': restarts, 'state': {}}]},
+    }
+
+
+def make_event_stream(n_pods: int, n_events: int, seed: int = 0):
+    '''
+    ADDED events for `n_pods` pods in jobs of 1 to 128 replicas, then a mix
+    of phase changes, restarts, deletions and re-creations. Yields each event
+    with the pods that exist after it.
+    '''
+
+    rng = random.Random(seed)
+    pods = {}
+    sizes = [1, 2, 8, 32, 128]
+    job = 0
+    while len(pods) < n_pods:
+        size = min(rng.choice(sizes), n_pods - len(pods))
+        for rank in range(size):
+            pod = make_pod(f'job-{job}', rank)
+            pods[pod['metadata']['name']] = pod
+            yield {'type': 'ADDED', 'object': pod}, pods
+        job += 1
+
+    names = sorted(pods.keys())
+    for _ in range(n_events):
+        name = rng.choice(names)
+        job_name, rank = name.rsplit('-', 1)
+        kind = rng.random()
+        if name not in pods:
+            pods[name] = make_pod(job_name, int(rank), phase='Pending', volume=f'pvc-{job_name}-{rng.randrange(3)}')
+            yield {'type': 'ADDED', 'object': pods[name]}, pods
+        elif kind < 0.15:
+            yield {'type': 'DELETED', 'object': pods.pop(name)}, pods
+        else:
+            old = pods[name]
+            pods[name] = make_pod(
+                job_name,
+                int(rank),
+                phase=rng.choice(['Running', 'Running', 'Pending', 'Failed']),
+                restarts=old['status']['containerStatuses'][0]['restartCount'] + (kind > 0.9),
+                volume=old['spec']['volumes'][0]['persistentVolumeClaim']['claimName'],
+            )
+            yield {'type': 'MODIFIED', 'object': pods[name]}, pods
+
+
+def test_index_matches_snapshot_over_10k_pod_stream():
+    index = JobIndex()
+    for i, (event, pods) in enumerate(make_event_stream(10000, 20000)):
+        index.apply(event)
+        if i % 5000 == 4999:
+            assert index.get_jobs() == parse_jobs(list(pods.values()))
+    assert len(index.pods) == len(pods)
+    assert index.get_jobs() == parse_jobs(list(pods.values()))
+
+
+def test_apply_reports_changed_job():
+    index = JobIndex()
+    assert index.apply({'type': 'ADDED', 'object': make_pod('a', 0)}) == 'a'
+    # nothing the table shows changed
+    assert index.apply({'type': 'MODIFIED', 'object': make_pod('a', 0)}) is None
+    assert index.apply({'type': 'MODIFIED', 'object': make_pod('a', 0, restarts=1)}) == 'a'
+    assert index.apply({'type': 'DELETED', 'object': make_pod('a', 0)}) == 'a'
+    assert index.get_job('a') is None
+
+
+def test_volumes_follow_lowest_ordinal_pod():
+    index = JobIndex()
+    index.apply({'type': 'ADDED', 'object': make_pod('a', 1, volume='pvc-one')})
+    index.apply({'type': 'ADDED', 'object': make_pod('a', 0, volume='pvc-zero')})
+    index.apply({'type': 'ADDED', 'object': make_pod('a', 2, volume='pvc-two')})
+    assert index.get_job('a').attached_volumes == ['zero']
+    index.apply({'type': 'DELETED', 'object': make_pod('a', 0, volume='pvc-zero')})
+    assert index.get_job('a').attached_volumes == ['one']
+    index.apply({'type': 'DELETED', 'object': make_pod('a', 1, volume='pvc-one')})
+    assert index.get_job('a').attached_volumes == ['two']
+    index.apply({'type': 'ADDED', 'object': make_pod('a', 0, volume='pvc-new')})
+    assert index.get_job('a').attached_volumes == ['new']
+
+
+class FlakyBackend(object):
+    supports_resume = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def watch(self, resource, *, resource_version=None, timeout=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise urllib3.exceptions.ProtocolError('Connection broken')
+        yield {'type': 'ADDED', 'object': make_pod('a', 0)}
+
+
+def test_watcher_survives_stream_errors():
+    backend = FlakyBackend()
+    events = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(target=watch_pod_events, args=(backend, events, stop), daemon=True)
+    thread.start()
+    assert events.get(timeout=5) is None
+    assert isinstance(events.get(timeout=5), urllib3.exceptions.ProtocolError)
+    assert events.get(timeout=5) is None
+    assert events.get(timeout=5)['object']['metadata']['name'] == 'a-0'
+    stop.set()
+    thread.join(timeout=15)
+    assert not thread.is_alive()
+
+
+class QuietBackend(object):
+    '''
+    Two jobs' pods, then no more events.
+    '''
+
+    supports_resume = True
+
+    def __init__(self):
+        self.done = threading.Event()
+
+    def watch(self, resource, *, resource_version=None, timeout=None):
+        yield {'type': 'ADDED', 'object': make_pod('a', 0)}
+        yield {'type': 'ADDED', 'object': make_pod('b', 0)}
+        self.done.wait()
+
+
+class Screen(object):
+    '''
+    Collects the dashboard's output, ending it once `until` matches.
+    '''
+
+    def __init__(self, until):
+        self.text = ''
+        self.until = until
+
+    def write(self, data: str):
+        self.text += data
+
+    def flush(self):
+        if self.until(self.text):
+            raise KeyboardInterrupt
+
+
+def test_dashboard_ages_advance_without_events(monkeypatch):
+    ages = iter(range(1000))
+    monkeypatch.setattr(utils, 'humanize_date', lambda date: f'{next(ages)}s')
+    backend = QuietBackend()
+    screen = Screen(until=lambda text: ' 9s ' in text)
+    try:
+        run_job_dashboard(backend, refresh=0.01, tick=0.02, out=screen)
+    finally:
+        backend.done.set()
+    # both rows were re-rendered by the tick, well after their only events
+    for row, job in ((2, 'a'), (3, 'b')):
+        seen = re.findall(rf'\x1b\[{row};1H{job} [^\x1b]* ([0-9]+)s ', screen.text)
+        assert len(seen) >= 4
@@ -0,0 +1,46 @@
+import json
+import os
+from collections import Counter
+
+from kube2.utils import get_pod_volume_names, parse_jobs
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'pods-200-jobs.json')
+
+
+def load_pods():
+    with open(FIXTURE) as f:
+        return json.load(f)['items']
+
+
+def test_parse_jobs_fixture():
+    pods = load_pods()
+    jobs = {job.name: job for job in parse_jobs(pods)}
+    assert len(jobs) == 200
+    assert sum(job.nodes for job in jobs.values()) == len(pods)
+
+    # one row per StatefulSet, with every replica counted
+    replicas = Counter(pod['metadata']['labels']['app'] for pod in pods)
+    assert {name: job.nodes for name, job in jobs.items()} == dict(replicas)
+
+    for name, job in jobs.items():
+        job_pods = [p for p in pods if p['metadata']['labels']['app'] == name]
+        assert job.restarts == sum(p['status']['containerStatuses'][0]['restartCount'] for p in job_pods)
+        root = next(p for p in job_pods if p['metadata']['name'] == f'{name}-0')
+        assert job.attached_volumes == get_pod_volume_names(root)
+
+    assert jobs['train-000'].attached_volumes == ['data-0', 'scratch']
+    assert jobs['train-001'].attached_volumes == ['data-1']
+    assert jobs['train-001'].status == 'All Running'
+    assert jobs['train-003'].status == 'CrashLoopBackOff:8'
+    assert jobs['train-005'].status == 'ContainerCreating:1,Running:1'
+
+
+def test_claim_names_without_prefix():
+    pod = {'spec': {'volumes': [
+        {'name': 'a', 'persistentVolumeClaim': {'claimName': 'pvc-data'}},
+        {'name': 'b', 'persistentVolumeClaim': {'claimName': 'scratch'}},
+        {'name': 'c', 'persistentVolumeClaim': {'claimName': 'other-claim'}},
+        {'name': 'd', 'emptyDir': {}},
+    ]}}
+    assert get_pod_volume_names(pod) == ['data', 'scratch', 'other-claim']
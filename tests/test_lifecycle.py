@@ -0,0 +1,96 @@
+from kube2.lifecycle import DEPLOY_SECRET_LABEL, delete_secrets, get_orphaned_secrets
+from kube2.manifest import make_secret
+
+
+OLD = '2021-06-01T00:00:00Z'
+
+
+LEGACY_FILES = {'id_rsa.pub': b'ssh-rsa AAAA', 'post_start_script.sh': b'#!/bin/bash'}
+
+
+def make_secret_object(name: str, job: str = None, created: str = OLD, files: dict = None) -> dict:
+    secret = make_secret(name, files or {}, labels={DEPLOY_SECRET_LABEL: job} if job else None)
+    secret['metadata']['creationTimestamp'] = created
+    return secret
+
+
+def make_statefulset(secret_name: str) -> dict:
+    return {'spec': {'template': {'spec': {'volumes': [
+        {'name': 'secret-volume', 'secret': {'secretName': secret_name}},
+    ]}}}}
+
+
+def make_pod(secret_name: str) -> dict:
+    return {'spec': {'volumes': [
+        {'name': 'config', 'configMap': {'name': 'config'}},
+        {'name': 'credentials', 'secret': {'secretName': secret_name}},
+    ]}}
+
+
+class FakeBackend(object):
+    def __init__(self, secrets, statefulsets, pods=()):
+        self.secrets = secrets
+        self.statefulsets = statefulsets
+        self.pods = list(pods)
+        self.deleted = []
+
+    def list_statefulsets(self):
+        return self.statefulsets
+
+    def list_pods(self):
+        return self.pods
+
+    def list_secrets(self, label_selector=None):
+        # existence selectors only, e.g. "kube2/job"
+        return [s for s in self.secrets if label_selector is None or label_selector in s['metadata'].get('labels', {})]
+
+    def delete(self, resource, *names):
+        assert resource == 'secrets'
+        self.deleted += names
+
+
+def test_gc_only_deletes_labelled_orphans():
+    backend = FakeBackend(
+        secrets=[
+            make_secret_object('train-2021-06-01-00-00', job='train'),
+            make_secret_object('train-2021-05-01-00-00', job='train'),
+            make_secret_object('killed-2021-05-01-00-00', job='killed'),
+            # too new: may belong to a deploy in progress
+            make_secret_object('fresh-2021-06-01-00-00', job='fresh', created='2999-01-01T00:00:00Z'),
+            # the user's own secrets, even ones named like ours
+            make_secret_object('db-password'),
+            make_secret_object('backup-2021-05-01-00-00'),
+        ],
+        statefulsets=[make_statefulset('train-2021-06-01-00-00')],
+    )
+    orphans = get_orphaned_secrets(backend=backend)
+    assert orphans == ['killed-2021-05-01-00-00', 'train-2021-05-01-00-00']
+    delete_secrets(orphans, backend=backend, batch_size=1)
+    assert backend.deleted == orphans
+
+
+def test_gc_legacy_deletes_unlabelled_deploy_secrets():
+    backend = FakeBackend(
+        secrets=[
+            make_secret_object('killed-2021-05-01-00-00', job='killed'),
+            make_secret_object('old-2020-01-01-00-00', files=LEGACY_FILES),
+            # still mounted, by a StatefulSet or just a pod
+            make_secret_object('running-2020-01-01-00-00', files=LEGACY_FILES),
+            make_secret_object('mounted-2020-01-01-00-00', files=LEGACY_FILES),
+            make_secret_object('fresh-2020-01-01-00-00', files=LEGACY_FILES, created='2999-01-01T00:00:00Z'),
+            # named like ours, but not holding exactly what a deploy made
+            make_secret_object('backup-2021-05-01-00-00', files={**LEGACY_FILES, 'password': b'x'}),
+            make_secret_object('keys-2021-05-01-00-00', files={'id_rsa.pub': b'ssh-rsa AAAA'}),
+            make_secret_object('old-2020-01-01', files=LEGACY_FILES),
+        ],
+        statefulsets=[make_statefulset('running-2020-01-01-00-00')],
+        pods=[make_pod('mounted-2020-01-01-00-00')],
+    )
+    assert get_orphaned_secrets(backend=backend) == ['killed-2021-05-01-00-00']
+    assert get_orphaned_secrets(backend=backend, legacy=True) == ['killed-2021-05-01-00-00', 'old-2020-01-01-00-00']
+
+
+def test_deploy_secret_label():
+    secret = make_secret('job-2021-06-01-00-00', {'a': b'x'}, labels={DEPLOY_SECRET_LABEL: 'job'})
+    assert secret['metadata'] == {'name': 'job-2021-06-01-00-00', 'labels': {'kube2/job': 'job'}}
+    assert 'labels' not in make_secret('other', {})['metadata']
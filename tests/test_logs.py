@@ -0,0 +1,131 @@
+import io
+import os
+import threading
+
+import pytest
+
+from kube2.logs import LogsError, make_line_filter, stream_logs
+
+
+def log_line(pod: str, i: int) -> str:
+    return f'{pod} {i} loss {i % 7}\n'
+
+
+class FakeProc(object):
+    '''
+    A Popen stand-in whose stdout and stderr are pipes fed as fast as they
+    take data. stderr is written in full before stdout.
+    '''
+
+    def __init__(self, pod: str, lines: int, stderr_bytes: int, returncode: int):
+        self.returncode = returncode
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        self.stdout = os.fdopen(out_r, 'rb')
+        self.stderr = os.fdopen(err_r, 'rb')
+        self.thread = threading.Thread(
+            target=self.feed,
+            args=(os.fdopen(out_w, 'wb'), os.fdopen(err_w, 'wb'), pod, lines, stderr_bytes),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def feed(self, out, err, pod: str, lines: int, stderr_bytes: int):
+        try:
+            with err:
+                for start in range(0, stderr_bytes, 4096):
+                    err.write(b'w' * min(4096, stderr_bytes - start))
+                if stderr_bytes > 0:
+                    err.write(b'\nlast warning\n')
+            with out:
+                for start in range(0, lines, 100):
+                    out.write(''.join(log_line(pod, i) for i in range(start, min(lines, start + 100))).encode())
+        except BrokenPipeError:
+            pass
+
+    def wait(self) -> int:
+        self.thread.join()
+        return self.returncode
+
+    def terminate(self):
+        self.stdout.close()
+
+
+class FakeLogs(object):
+    def __init__(self, lines: int, stderr_bytes: int = 0, returncode: int = 0):
+        self.lines = lines
+        self.stderr_bytes = stderr_bytes
+        self.returncode = returncode
+
+    def open(self, pod: str, *, follow: bool = False, since=None) -> FakeProc:
+        return FakeProc(pod, self.lines, self.stderr_bytes, self.returncode)
+
+
+def run(pods, source, **kwargs):
+    # in a thread, so a stalled stream fails the test instead of hanging it
+    out = io.BytesIO()
+    results = []
+    t = threading.Thread(target=lambda: results.extend(stream_logs(pods, source=source, out=out, **kwargs)), daemon=True)
+    t.start()
+    t.join(timeout=30)
+    assert not t.is_alive(), 'stream_logs stalled'
+    return results, out.getvalue().decode()
+
+
+def split_by_label(text: str) -> dict:
+    lines = {}
+    for line in text.splitlines():
+        label, rest = line.split('] ', 1)
+        lines.setdefault(label.lstrip('[ '), []).append(rest + '\n')
+    return lines
+
+
+PODS = [f'train-{i}' for i in range(12)]
+
+
+def test_lines_of_each_pod_stay_in_order():
+    results, text = run(PODS, FakeLogs(5000), buffer_kb=1)
+
+    by_label = split_by_label(text)
+    for i, pod in enumerate(PODS):
+        assert by_label[str(i)] == [log_line(pod, n) for n in range(5000)]
+    assert [(r.pod, r.lines, r.returncode, r.error) for r in results] == [(pod, 5000, 0, '') for pod in PODS]
+
+
+def test_grep_keeps_only_matching_lines():
+    results, text = run(PODS, FakeLogs(5000), match=make_line_filter(r'LOSS 0$', ignore_case=True))
+
+    by_label = split_by_label(text)
+    for i, pod in enumerate(PODS):
+        assert by_label[str(i)] == [log_line(pod, n) for n in range(0, 5000, 7)]
+    assert [r.lines for r in results] == [len(range(0, 5000, 7))] * len(PODS)
+
+
+def test_invalid_grep_pattern():
+    with pytest.raises(LogsError, match='Invalid --grep pattern'):
+        make_line_filter('loss (')
+
+
+def test_out_dir_writes_a_file_per_pod(tmp_path):
+    out_dir = str(tmp_path / 'logs')
+    results, text = run(PODS, FakeLogs(3000), out_dir=out_dir)
+
+    assert text == ''
+    assert sorted(os.listdir(out_dir)) == sorted(f'{pod}.log' for pod in PODS)
+    for pod in PODS:
+        with open(os.path.join(out_dir, f'{pod}.log')) as f:
+            assert f.read() == ''.join(log_line(pod, n) for n in range(3000))
+    assert [r.lines for r in results] == [3000] * len(PODS)
+
+
+def test_chatty_stderr_does_not_stall_stdout():
+    # far more stderr than a pipe holds, written before any stdout
+    results, text = run(PODS[:4], FakeLogs(2000, stderr_bytes=1024 * 1024, returncode=1))
+
+    by_label = split_by_label(text)
+    for i, pod in enumerate(PODS[:4]):
+        assert by_label[str(i)] == [log_line(pod, n) for n in range(2000)]
+    for r in results:
+        assert r.returncode == 1
+        assert r.error.endswith('last warning')
+        assert len(r.error) < 32 * 1024
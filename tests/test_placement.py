@@ -0,0 +1,112 @@
+import pytest
+
+from kube2.manifest import render_manifests
+from kube2.placement import PlacementError, get_gpu_request, get_placement_args, plan_ranks
+
+
+def make_pod(ordinal: int, node: str, *, gpus=None, limit_gpus=None, ip: str = None) -> dict:
+    resources = {}
+    if gpus is not None:
+        resources['requests'] = {'nvidia.com/gpu': gpus}
+    if limit_gpus is not None:
+        resources['limits'] = {'nvidia.com/gpu': limit_gpus}
+    return {
+        'metadata': {'name': f'job-{ordinal}'},
+        'spec': {'nodeName': node, 'containers': [{'name': 'job', 'resources': resources}]},
+        'status': {'podIP': ip or f'10.0.0.{ordinal}'},
+    }
+
+
+@pytest.mark.parametrize('pod, expected', [
+    (make_pod(0, 'n'), 0),
+    (make_pod(0, 'n', gpus='8'), 8),
+    (make_pod(0, 'n', gpus=4), 4),
+    # a limit alone implies an equal request
+    (make_pod(0, 'n', limit_gpus='2'), 2),
+    (make_pod(0, 'n', gpus='1', limit_gpus='1'), 1),
+    ({'metadata': {'name': 'job-0'}, 'spec': {'containers': [
+        {'name': 'a', 'resources': {'requests': {'nvidia.com/gpu': '2'}}},
+        {'name': 'b', 'resources': {'limits': {'nvidia.com/gpu': '3'}}},
+        {'name': 'c'},
+    ]}}, 5),
+])
+def test_gpu_request(pod, expected):
+    assert get_gpu_request(pod) == expected
+
+
+@pytest.mark.parametrize('pods, expected', [
+    # one replica per node, in ordinal order
+    (
+        [make_pod(1, 'b', gpus=8), make_pod(0, 'a', gpus=8)],
+        [('job-0', 'a', 8), ('job-1', 'b', 8)],
+    ),
+    # replicas sharing a node get consecutive ranks; nodes ordered by lowest ordinal
+    (
+        [make_pod(0, 'b', gpus=4), make_pod(1, 'a', gpus=4), make_pod(2, 'b', gpus=4), make_pod(3, 'a', gpus=4)],
+        [('job-0', 'b', 4), ('job-2', 'b', 4), ('job-1', 'a', 4), ('job-3', 'a', 4)],
+    ),
+    # ordinals sort numerically, not as strings
+    (
+        [make_pod(10, 'c', gpus=1), make_pod(2, 'b', gpus=1), make_pod(1, 'a', gpus=1)],
+        [('job-1', 'a', 1), ('job-2', 'b', 1), ('job-10', 'c', 1)],
+    ),
+    # pods without GPUs get the default
+    (
+        [make_pod(0, 'a'), make_pod(1, 'a', gpus=2)],
+        [('job-0', 'a', 1), ('job-1', 'a', 2)],
+    ),
+])
+def test_plan_ranks(pods, expected):
+    ranks = plan_ranks(pods)
+    assert [r.rank for r in ranks] == list(range(len(pods)))
+    assert [(r.pod, r.node, r.slots) for r in ranks] == expected
+    assert all(r.ip == f'10.0.0.{r.pod.split("-")[1]}' for r in ranks)
+
+
+def test_plan_ranks_default_slots():
+    assert [r.slots for r in plan_ranks([make_pod(0, 'a')], default_slots=8)] == [8]
+
+
+@pytest.mark.parametrize('pod', [
+    {'metadata': {'name': 'job-0'}, 'spec': {}, 'status': {'podIP': '10.0.0.1'}},
+    {'metadata': {'name': 'job-0'}, 'spec': {'nodeName': 'a'}, 'status': {}},
+])
+def test_plan_ranks_needs_scheduled_pods(pod):
+    with pytest.raises(PlacementError):
+        plan_ranks([pod])
+
+
+def render_pod_spec(placement_args: dict) -> dict:
+    docs = render_manifests('templates/statefulset.yml', {
+        'name': 'job',
+        'docker_image': 'image',
+        'image_pull_policy': 'IfNotPresent',
+        'nodes': 2,
+        'secret_name': 'job-secret',
+        'mounts': [],
+        **placement_args,
+    })
+    return next(doc for doc in docs if doc['kind'] == 'StatefulSet')['spec']['template']['spec']
+
+
+@pytest.mark.parametrize('placement, zone, args, affinity, spread', [
+    ('exclusive', None, {'anti_affinity': True, 'topology_spread': False, 'zone': None}, {'podAntiAffinity'}, False),
+    ('exclusive', 'us-east-1a', {'anti_affinity': True, 'topology_spread': False, 'zone': 'us-east-1a'}, {'nodeAffinity', 'podAntiAffinity'}, False),
+    ('spread', None, {'anti_affinity': False, 'topology_spread': True, 'zone': None}, set(), True),
+    ('spread', 'us-east-1a', {'anti_affinity': False, 'topology_spread': True, 'zone': 'us-east-1a'}, {'nodeAffinity'}, True),
+    ('any', None, {'anti_affinity': False, 'topology_spread': False, 'zone': None}, set(), False),
+    ('any', 'us-east-1a', {'anti_affinity': False, 'topology_spread': False, 'zone': 'us-east-1a'}, {'nodeAffinity'}, False),
+])
+def test_placement_args(placement, zone, args, affinity, spread):
+    assert get_placement_args(placement, zone) == args
+    spec = render_pod_spec(args)
+    assert set(spec.get('affinity') or {}) == affinity
+    assert ('topologySpreadConstraints' in spec) == spread
+    if zone is not None:
+        terms = spec['affinity']['nodeAffinity']['requiredDuringSchedulingIgnoredDuringExecution']['nodeSelectorTerms']
+        assert terms[0]['matchExpressions'][0]['values'] == [zone]
+
+
+def test_unknown_placement():
+    with pytest.raises(PlacementError):
+        get_placement_args('packed', None)
@@ -0,0 +1,59 @@
+import threading
+
+from kube2.prefetch import pin_image, prefetch_image
+
+
+DIGEST = 'sha256:' + 'a' * 64
+
+
+class FakeBackend(object):
+    '''
+    DaemonSets become ready only once every expected prefetch has applied
+    its own, so the calls overlap.
+    '''
+
+    supports_resume = True
+
+    def __init__(self, expected: int):
+        self.live = set()
+        self.deleted = []
+        self.all_applied = threading.Barrier(expected, timeout=10)
+        self.lock = threading.Lock()
+
+    def apply(self, docs):
+        with self.lock:
+            self.live.update(doc['metadata']['name'] for doc in docs)
+
+    def watch(self, resource, *, name=None, resource_version=None, timeout=None):
+        self.all_applied.wait()
+        with self.lock:
+            assert name in self.live, f'{name} was deleted by another prefetch'
+        yield {'type': 'ADDED', 'object': {
+            'metadata': {'name': name, 'generation': 1, 'resourceVersion': '1'},
+            'status': {'observedGeneration': 1, 'desiredNumberScheduled': 2, 'updatedNumberScheduled': 2, 'numberReady': 2},
+        }}
+
+    def list_pods(self, label_selector=None):
+        return [{'metadata': {'name': 'p'}, 'status': {'initContainerStatuses': [{'imageID': f'docker.io/x@{DIGEST}'}]}}]
+
+    def delete(self, resource, *names):
+        with self.lock:
+            self.live.difference_update(names)
+            self.deleted += names
+
+
+def test_concurrent_prefetches_of_one_image():
+    backend = FakeBackend(expected=2)
+    results = []
+
+    def run():
+        results.append(prefetch_image('x:latest', timeout=10, backend=backend))
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [pin_image('x:latest', DIGEST)] * 2
+    assert len(set(backend.deleted)) == 2
+    assert backend.live == set()
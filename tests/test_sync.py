@@ -0,0 +1,120 @@
+import io
+import json
+import os
+
+import pytest
+
+from kube2 import sync
+from kube2.aws_utils import aws_client
+from kube2.sync import SyncError, download_dir, get_manifest_key, upload_dir
+
+
+BUCKET = 'kube2-volumes'
+REGION = 'us-east-1'
+
+
+@pytest.fixture
+def s3(aws):
+    client = aws_client('s3', region_name=REGION)
+    client.create_bucket(Bucket=BUCKET)
+    return client
+
+
+def write_tree(root, files: dict):
+    for rel, data in files.items():
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def list_keys(client, prefix: str) -> list:
+    response = client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return sorted(obj['Key'] for obj in response.get('Contents') or [])
+
+
+def sync_up(src) -> sync.SyncProgress:
+    return upload_dir(str(src), 'vol', region=REGION, jobs=4, out=io.StringIO())
+
+
+def sync_down(dest) -> sync.SyncProgress:
+    return download_dir(str(dest), 'vol', region=REGION, jobs=4, out=io.StringIO())
+
+
+FILES = {
+    'a.txt': b'a',
+    'sub/b.bin': os.urandom(1000),
+    'sub/deeper/c.txt': b'c' * 10,
+}
+
+
+def test_upload_then_download(s3, tmp_path):
+    src, dest = tmp_path / 'src', tmp_path / 'dest'
+    write_tree(src, FILES)
+
+    progress = sync_up(src)
+    assert (progress.transferred, progress.skipped, progress.failed) == (3, 0, 0)
+    assert list_keys(s3, 'vol/') == ['vol/' + rel for rel in sorted(FILES)]
+    manifest = json.loads(s3.get_object(Bucket=BUCKET, Key=get_manifest_key('vol'))['Body'].read())
+    assert sorted(manifest) == sorted(FILES)
+
+    progress = sync_down(dest)
+    assert (progress.transferred, progress.skipped, progress.failed) == (3, 0, 0)
+    for rel, data in FILES.items():
+        assert (dest / rel).read_bytes() == data
+
+    # a second download finds everything in place
+    progress = sync_down(dest)
+    assert (progress.transferred, progress.skipped) == (0, 3)
+
+    # a file changed locally is fetched again
+    (dest / 'a.txt').write_bytes(b'changed')
+    progress = sync_down(dest)
+    assert (progress.transferred, progress.skipped) == (1, 2)
+    assert (dest / 'a.txt').read_bytes() == b'a'
+
+
+def test_upload_skips_unchanged(s3, tmp_path):
+    src = tmp_path / 'src'
+    write_tree(src, FILES)
+    sync_up(src)
+
+    progress = sync_up(src)
+    assert (progress.transferred, progress.skipped) == (0, 3)
+
+    # touched but identical: hashed, not uploaded
+    os.utime(src / 'a.txt', ns=(0, 0))
+    progress = sync_up(src)
+    assert (progress.transferred, progress.skipped) == (0, 3)
+
+    (src / 'sub' / 'b.bin').write_bytes(b'new')
+    progress = sync_up(src)
+    assert (progress.transferred, progress.skipped) == (1, 2)
+    assert s3.get_object(Bucket=BUCKET, Key='vol/sub/b.bin')['Body'].read() == b'new'
+
+
+def test_interrupted_upload_resumes(s3, tmp_path, monkeypatch):
+    src = tmp_path / 'src'
+    write_tree(src, FILES)
+    walk_files = sync.walk_files
+
+    def interrupted(root):
+        for i, item in enumerate(walk_files(root)):
+            if i == 2:
+                raise KeyboardInterrupt
+            yield item
+
+    monkeypatch.setattr(sync, 'walk_files', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        sync_up(src)
+    monkeypatch.setattr(sync, 'walk_files', walk_files)
+
+    # the files reached before the interrupt were recorded and aren't redone
+    progress = sync_up(src)
+    assert (progress.transferred, progress.skipped) == (1, 2)
+    assert list_keys(s3, 'vol/') == ['vol/' + rel for rel in sorted(FILES)]
+
+
+def test_upload_needs_a_directory(s3, tmp_path):
+    with pytest.raises(SyncError):
+        sync_up(tmp_path / 'missing')
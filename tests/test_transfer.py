@@ -0,0 +1,69 @@
+import io
+import os
+import subprocess
+
+import pytest
+
+from kube2.remote import ExecResult
+from kube2.sync import SyncProgress
+from kube2.transfer import TransferError, download_from_pod, upload_to_pods
+
+
+class LocalExec(object):
+    '''
+    Runs "pod" commands locally, in a directory per pod.
+    '''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def cwd(self, pod: str) -> str:
+        path = os.path.join(self.root, pod)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def run(self, pod, command, input=None, timeout=None) -> ExecResult:
+        proc = subprocess.run(command, input=input, capture_output=True, cwd=self.cwd(pod), timeout=timeout)
+        return ExecResult(pod, proc.returncode, proc.stdout, proc.stderr)
+
+    def popen(self, pod, command, stdin=False):
+        return subprocess.Popen(
+            command,
+            cwd=self.cwd(pod),
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+
+@pytest.fixture
+def transport(tmp_path):
+    return LocalExec(str(tmp_path / 'pods'))
+
+
+def test_upload_creates_missing_dest(tmp_path, transport):
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'sub' / 'a.txt').write_text('a')
+    progress, errors = upload_to_pods(str(src), 'out/new', ['p0', 'p1'], transport=transport, out=io.StringIO())
+    assert errors == {}
+    assert progress.transferred == 2
+    for pod in ('p0', 'p1'):
+        assert (tmp_path / 'pods' / pod / 'out' / 'new' / 'sub' / 'a.txt').read_text() == 'a'
+
+
+def test_download_round_trip(tmp_path, transport):
+    remote = tmp_path / 'pods' / 'p0' / 'data'
+    remote.mkdir(parents=True)
+    (remote / 'a.txt').write_text('a')
+    dest = tmp_path / 'dest'
+    progress = download_from_pod('p0', 'data', str(dest), transport=transport, progress=SyncProgress())
+    assert progress.transferred == 1
+    assert (dest / 'a.txt').read_text() == 'a'
+
+
+def test_download_of_missing_src_fails(tmp_path, transport):
+    dest = tmp_path / 'dest'
+    with pytest.raises(TransferError, match='missing'):
+        download_from_pod('p0', 'missing', str(dest), transport=transport, progress=SyncProgress())
+    assert not dest.exists()
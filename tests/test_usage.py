@@ -0,0 +1,61 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kube2.backend import APIBackend
+from kube2.usage import get_pvc_usage
+
+
+def make_pod(name: str, node: str, claim: str) -> dict:
+    return {
+        'metadata': {'name': name},
+        'spec': {'nodeName': node, 'volumes': [{'name': 'v', 'persistentVolumeClaim': {'claimName': claim}}]},
+        'status': {'phase': 'Running'},
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/api/v1/namespaces/default/pods'):
+            body = {'items': [make_pod('a-0', 'node-a', 'pvc-a'), make_pod('b-0', 'node-b', 'pvc-b')]}
+        elif self.path.startswith('/api/v1/nodes/node-a/'):
+            body = {'pods': [{'volume': [{'pvcRef': {'name': 'pvc-a'}, 'usedBytes': 1, 'availableBytes': 3}]}]}
+        else:
+            # node-b's kubelet hangs up without answering
+            self.close_connection = True
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_unreachable_node_reports_unknown():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = APIBackend(f'http://127.0.0.1:{server.server_address[1]}', timeout=5)
+        usage = get_pvc_usage(['pvc-a', 'pvc-b'], backend=backend)
+    finally:
+        server.shutdown()
+    assert usage == {'pvc-a': {'used': 1, 'available': 3}, 'pvc-b': None}
+
+
+def test_cached_usage_is_per_context():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = APIBackend(f'http://127.0.0.1:{server.server_address[1]}', timeout=5)
+        assert get_pvc_usage(['pvc-a'], backend=backend, context='kube2-one')['pvc-a'] is not None
+    finally:
+        server.shutdown()
+        server.server_close()
+    closed = APIBackend(f'http://127.0.0.1:{server.server_address[1]}', timeout=1)
+    # served from the cache for the same context only
+    assert get_pvc_usage(['pvc-a'], backend=closed, context='kube2-one')['pvc-a'] is not None
+    assert get_pvc_usage(['pvc-a'], backend=closed, context='kube2-two')['pvc-a'] is None
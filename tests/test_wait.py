@@ -0,0 +1,62 @@
+import json
+import socket
+import threading
+
+from kube2.backend import APIBackend
+from kube2.wait import wait_for_statefulset_ready
+
+
+def make_statefulset(ready: int, resource_version: str) -> dict:
+    return {
+        'metadata': {'name': 'job', 'generation': 1, 'resourceVersion': resource_version},
+        'spec': {'replicas': 2},
+        'status': {'observedGeneration': 1, 'readyReplicas': ready},
+    }
+
+
+def chunk(data: bytes) -> bytes:
+    return b'%x\r\n%s\r\n' % (len(data), data)
+
+
+class FlakyWatchServer(object):
+    '''
+    Answers the first watch with one event and then drops the connection in
+    the middle of the chunked body. Later watches get the ready event.
+    '''
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.paths = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.sock.getsockname()[1]}'
+
+    def serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            with conn:
+                request = b''
+                while b'\r\n\r\n' not in request:
+                    request += conn.recv(4096)
+                self.paths.append(request.split(b' ')[1].decode())
+                conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n')
+                if len(self.paths) == 1:
+                    event = {'type': 'ADDED', 'object': make_statefulset(1, '10')}
+                    conn.sendall(chunk(json.dumps(event).encode() + b'\n') + b'400\r\n{"type": "MODIF')
+                else:
+                    event = {'type': 'MODIFIED', 'object': make_statefulset(2, '11')}
+                    conn.sendall(chunk(json.dumps(event).encode() + b'\n') + b'0\r\n\r\n')
+
+
+def test_wait_reconnects_after_dropped_watch():
+    server = FlakyWatchServer()
+    backend = APIBackend(server.url, timeout=5)
+    ss = wait_for_statefulset_ready('job', timeout=30, backend=backend)
+    assert ss['status']['readyReplicas'] == 2
+    assert len(server.paths) == 2
+    # resumed from the last event seen before the drop
+    assert 'resourceVersion=10' in server.paths[1]
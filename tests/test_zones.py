@@ -0,0 +1,54 @@
+import pytest
+
+from kube2.aws_utils import ZoneError, choose_cluster_zones, get_availability_zones, get_instance_type_zones
+from kube2.capacity import get_nodegroup_zone
+
+
+def make_node(name: str, zone: str, nodegroup: str) -> dict:
+    return {'metadata': {'name': name, 'labels': {
+        'topology.kubernetes.io/zone': zone,
+        'eks.amazonaws.com/nodegroup': nodegroup,
+    }}}
+
+
+def test_zones_come_from_the_region(aws):
+    # eu-west-1 has no "d" zone
+    zones = get_availability_zones('eu-west-1')
+    assert 'eu-west-1d' not in zones
+    node_zone, other = choose_cluster_zones('p4d.24xlarge', 'eu-west-1')
+    assert node_zone in get_instance_type_zones('p4d.24xlarge', 'eu-west-1')
+    assert other in zones and other != node_zone
+
+
+def test_requested_zone(aws):
+    assert choose_cluster_zones('p4d.24xlarge', 'us-east-1', zone='us-east-1b')[0] == 'us-east-1b'
+    with pytest.raises(ZoneError):
+        choose_cluster_zones('p4d.24xlarge', 'eu-west-1', zone='eu-west-1d')
+
+
+def test_nodegroup_zone():
+    nodes = [
+        make_node('a', 'us-east-1a', 'cluster'),
+        make_node('b', 'us-east-1a', 'cluster'),
+        make_node('c', 'us-east-1b', 'cpu'),
+    ]
+    assert get_nodegroup_zone(nodes, 'cluster') == 'us-east-1a'
+    assert get_nodegroup_zone(nodes, 'missing') is None
+    nodes.append(make_node('d', 'us-east-1c', 'cluster'))
+    assert get_nodegroup_zone(nodes, 'cluster') is None
+
+
+def test_deploy_without_node_list_permission(tmp_path, monkeypatch):
+    from kube2 import job
+    from kube2.backend import KubeError
+
+    class ForbiddenBackend(object):
+        def list_nodes(self):
+            raise KubeError('nodes is forbidden', status=403)
+
+    monkeypatch.setattr(job, 'get_backend', lambda: ForbiddenBackend())
+    steps = job.get_deploy_steps(
+        name='job', docker_image='image', nodes=1, attach='', tmpdir=str(tmp_path), timeout=10, preflight=False,
+    )
+    zone = next(step for step in steps if step.name == 'zone')
+    assert zone.fn({}) is None